@@ -0,0 +1,125 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+@dataclass
+class Deadline:
+    """Time budget for a whole skill request.
+
+    margin is held back from the budget so the response can still be
+    serialized and sent before the caller gives up on the request.
+    """
+
+    budget: float
+    margin: float = 0.0
+    started_at: float = field(default_factory=time.monotonic)
+    expired_records: int = 0
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started_at
+
+    def remaining(self) -> float:
+        return self.budget - self.margin - self.elapsed()
+
+    def used(self) -> float:
+        """Fraction of the budget spent so far."""
+        return self.elapsed() / self.budget if self.budget > 0 else 1.0
+
+
+@dataclass
+class BudgetStats:
+    """How much of their deadline budget recent batches used."""
+
+    batches: int = 0
+    records: int = 0
+    expired_records: int = 0
+    last_used: float = 0.0
+    max_used: float = 0.0
+    total_used: float = 0.0
+
+    def record(self, deadline: Deadline, records: int) -> None:
+        used = deadline.used()
+        self.batches += 1
+        self.records += records
+        self.expired_records += deadline.expired_records
+        self.last_used = used
+        self.max_used = max(self.max_used, used)
+        self.total_used += used
+        logger.info(
+            f"Batch of {records} records used {used:.0%} of its {deadline.budget:g}s budget, "
+            f"{deadline.expired_records} records hit the deadline"
+        )
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "batches": self.batches,
+            "records": self.records,
+            "expired_records": self.expired_records,
+            "last_budget_used": round(self.last_used, 4),
+            "max_budget_used": round(self.max_used, 4),
+            "mean_budget_used": round(self.total_used / self.batches, 4) if self.batches else 0.0,
+        }
+
+
+async def run_bounded(
+    items: List[T],
+    worker: Callable[[T], Awaitable[R]],
+    max_concurrency: int,
+    timeout: Optional[float],
+    on_timeout: Callable[[T], R],
+    on_error: Callable[[T, Exception], R],
+    deadline: Optional[Deadline] = None,
+    on_deadline: Optional[Callable[[T], R]] = None,
+    item_records: Optional[Callable[[T], int]] = None,
+    item_timeout: Optional[Callable[[T], Optional[float]]] = None,
+) -> List[R]:
+    """Run worker over every item concurrently and return results in input order.
+
+    At most max_concurrency workers are in flight at once. Each worker gets its
+    own timeout which starts once it holds a semaphore slot, so time spent
+    queueing behind other records is not charged to the record itself.
+    item_timeout, when given, sets the timeout of each item instead, e.g. for
+    records that make several model calls.
+
+    With a deadline, records still queued or in flight when the budget runs
+    out are cancelled and answered by on_deadline, so the results of every
+    finished record can be returned in time. When an item stands for several
+    records (a pack sent as one model call), item_records tells how many of
+    them to count as expired.
+    """
+    semaphore = asyncio.Semaphore(max(1, max_concurrency))
+    deadline_at = None
+    if deadline is not None:
+        deadline_at = asyncio.get_running_loop().time() + deadline.remaining()
+
+    async def run_one(item: T) -> R:
+        async with semaphore:
+            try:
+                async with asyncio.timeout(item_timeout(item) if item_timeout else timeout):
+                    return await worker(item)
+            except TimeoutError:
+                return on_timeout(item)
+            except Exception as e:
+                return on_error(item, e)
+
+    async def run_one_before_deadline(item: T) -> R:
+        try:
+            # The per-record timeout only fires for its own expiry; the deadline
+            # surfaces here as a TimeoutError from the outer context
+            async with asyncio.timeout_at(deadline_at):
+                return await run_one(item)
+        except TimeoutError:
+            deadline.expired_records += item_records(item) if item_records else 1
+            return on_deadline(item)
+
+    run = run_one if deadline is None else run_one_before_deadline
+    # gather preserves the order of its arguments regardless of completion order
+    return await asyncio.gather(*(run(item) for item in items))
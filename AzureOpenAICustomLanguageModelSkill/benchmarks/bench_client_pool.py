@@ -0,0 +1,117 @@
+"""Compare a per-invocation Azure OpenAI client with the pooled client registry.
+
+Starts a local stub Azure OpenAI endpoint that counts new TCP connections, then
+sends the same skill batches through both strategies and reports how many
+connections (TCP/TLS handshakes against a real endpoint) each batch needed.
+
+Run from the skill folder:
+
+    python -m benchmarks.bench_client_pool --batches 10 --batch-size 50
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+import weakref
+
+from aiohttp import web
+from openai import AsyncAzureOpenAI
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from client_registry import close_all, get_client  # noqa: E402
+from function_app import SummaryResponse  # noqa: E402
+
+# function_app configures DEBUG logging on import; keep the benchmark output readable
+logging.getLogger().setLevel(logging.WARNING)
+
+API_VERSION = "2024-08-01-preview"
+DEPLOYMENT = "gpt-4o"
+
+
+class ConnectionCountingStub:
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.connections = 0
+        self._seen = weakref.WeakSet()
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if request.transport not in self._seen:
+            self._seen.add(request.transport)
+            self.connections += 1
+        await request.read()
+        await asyncio.sleep(self.latency)
+        return web.json_response({
+            "id": "chatcmpl-bench",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": DEPLOYMENT,
+            "choices": [{
+                "index": 0,
+                "finish_reason": "stop",
+                "message": {"role": "assistant", "content": json.dumps({"summary": "A short summary."})},
+            }],
+            "usage": {"prompt_tokens": 20, "completion_tokens": 5, "total_tokens": 25},
+        })
+
+
+async def send_batch(client: AsyncAzureOpenAI, batch_size: int, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def call(record_id: int):
+        async with semaphore:
+            return await client.beta.chat.completions.parse(
+                model=DEPLOYMENT,
+                messages=[{"role": "user", "content": f"record {record_id}"}],
+                response_format=SummaryResponse,
+            )
+
+    return await asyncio.gather(*(call(i) for i in range(batch_size)))
+
+
+async def run_strategy(name, stub, endpoint, args, pooled):
+    stub.connections = 0
+    start = time.perf_counter()
+    for _ in range(args.batches):
+        if pooled:
+            client = get_client(endpoint, "bench-key", API_VERSION, args.pool_size, keepalive_timeout=60)
+            await send_batch(client, args.batch_size, args.concurrency)
+        else:
+            # Legacy behaviour: a new client (and connection pool) for every invocation
+            client = AsyncAzureOpenAI(api_key="bench-key", azure_endpoint=endpoint, api_version=API_VERSION)
+            await send_batch(client, args.batch_size, args.concurrency)
+            await client.close()
+    elapsed = time.perf_counter() - start
+    print(f"{name:<22} connections/batch={stub.connections / args.batches:7.2f} "
+          f"total={stub.connections:5d} elapsed={elapsed:6.2f}s")
+
+
+async def main(args):
+    stub = ConnectionCountingStub(args.latency)
+    app = web.Application()
+    app.router.add_post("/openai/deployments/{deployment}/chat/completions", stub.handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", args.port)
+    await site.start()
+    endpoint = f"http://127.0.0.1:{args.port}"
+    try:
+        await run_strategy("per-invocation client", stub, endpoint, args, pooled=False)
+        await run_strategy("pooled registry", stub, endpoint, args, pooled=True)
+    finally:
+        await close_all()
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--batches", type=int, default=10)
+    parser.add_argument("--batch-size", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--pool-size", type=int, default=100)
+    parser.add_argument("--latency", type=float, default=0.02, help="stub latency in seconds")
+    parser.add_argument("--port", type=int, default=8798)
+    asyncio.run(main(parser.parse_args()))
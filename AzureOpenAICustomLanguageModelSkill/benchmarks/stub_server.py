@@ -0,0 +1,258 @@
+"""Local OpenAI-compatible chat completion stub for benchmarks and load tests.
+
+Answers every POST with a chat completion after a latency drawn from a
+configurable distribution. It can inject throttling (429 with a retry-after
+header) and server errors at a given rate. Requests with a json_schema
+response_format get a structured answer that conforms to the schema. Tests
+can pass a responder that sees each request first and can delay it, fail it
+by raising an aiohttp HTTP exception, or return the answer content. It
+serves any path, so it works both as an Azure AI model inference endpoint
+and as an Azure OpenAI endpoint (/openai/deployments/<name>/chat/completions).
+
+Run from the skill folder:
+
+    python -m benchmarks.stub_server --port 8790 --latency 0.5 --latency-dist lognormal --throttle-rate 0.05
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from aiohttp import web
+
+
+@dataclass
+class LatencyModel:
+    """Model latency in seconds.
+
+    fixed always waits median; uniform draws from median * (1 +/- spread);
+    lognormal draws around median with sigma spread, giving the long tail
+    that real deployments show.
+    """
+
+    median: float = 0.2
+    distribution: str = "lognormal"
+    spread: float = 0.5
+
+    def sample(self, rng: random.Random) -> float:
+        if self.median <= 0:
+            return 0.0
+        if self.distribution == "fixed":
+            return self.median
+        if self.distribution == "uniform":
+            return max(0.0, rng.uniform(self.median * (1 - self.spread), self.median * (1 + self.spread)))
+        if self.distribution == "lognormal":
+            return rng.lognormvariate(math.log(self.median), self.spread)
+        raise ValueError(f"Unknown latency distribution: {self.distribution}")
+
+
+@dataclass
+class StubStats:
+    requests: int = 0
+    completed: int = 0
+    throttled: int = 0
+    errors: int = 0
+
+    def as_dict(self) -> Dict[str, int]:
+        return dict(self.__dict__)
+
+
+def _approximate_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+def _message_text(message: Dict[str, Any]) -> str:
+    content = message.get("content")
+    if isinstance(content, str):
+        return content
+    return " ".join(part.get("text") or "" for part in content or [] if isinstance(part, dict))
+
+
+def _packed_records(messages: List[Dict[str, Any]]) -> Optional[List[Dict[str, Any]]]:
+    """The records of a packed request (a JSON array of recordId and text), if it is one."""
+    if not messages:
+        return None
+    try:
+        records = json.loads(_message_text(messages[-1]))
+    except ValueError:
+        return None
+    if isinstance(records, list) and all(isinstance(r, dict) and "recordId" in r for r in records):
+        return records
+    return None
+
+
+class SchemaInstance:
+    """Builds a small instance that satisfies a JSON schema, following $ref into $defs."""
+
+    def __init__(self, schema: Dict[str, Any], records: Optional[List[Dict[str, Any]]]):
+        self.defs = schema.get("$defs") or schema.get("definitions") or {}
+        self.records = records
+        self.root = schema
+
+    def build(self) -> Any:
+        return self._value(self.root, "value")
+
+    def _resolve(self, schema: Dict[str, Any]) -> Dict[str, Any]:
+        while "$ref" in schema:
+            schema = self.defs[schema["$ref"].rsplit("/", 1)[-1]]
+        if "anyOf" in schema:
+            schema = next((s for s in schema["anyOf"] if s.get("type") != "null"), schema["anyOf"][0])
+        return self._resolve(schema) if "$ref" in schema else schema
+
+    def _value(self, schema: Dict[str, Any], name: str, record: Optional[Dict[str, Any]] = None) -> Any:
+        schema = self._resolve(schema)
+        kind = schema.get("type")
+        if "enum" in schema:
+            return schema["enum"][0]
+        if kind == "object" or "properties" in schema:
+            return {key: self._value(value, key, record) for key, value in schema.get("properties", {}).items()}
+        if kind == "array":
+            items = self._resolve(schema.get("items", {}))
+            if self.records is not None and "recordId" in items.get("properties", {}):
+                # One entry per packed record, keyed by its recordId
+                return [self._value(items, name, r) for r in self.records]
+            return [self._value(items, name, record)]
+        if kind in ("number", "integer"):
+            return 0.9 if kind == "number" else 1
+        if kind == "boolean":
+            return True
+        if name == "recordId" and record is not None:
+            return str(record["recordId"])
+        return f"stub {name}"
+
+
+# Called with the request path and body; returns the answer content, or None for the default answer
+Responder = Callable[[str, Dict[str, Any]], Awaitable[Optional[str]]]
+
+
+class StubModelServer:
+    def __init__(self, latency: LatencyModel, throttle_rate: float = 0.0, error_rate: float = 0.0,
+                 retry_after: float = 1.0, completion_tokens: int = 50, seed: Optional[int] = None,
+                 responder: Optional[Responder] = None):
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.completion_tokens = completion_tokens
+        self.responder = responder
+        self.rng = random.Random(seed)
+        self.stats = StubStats()
+        self._runner: Optional[web.AppRunner] = None
+
+    def content(self, body: Dict[str, Any]) -> str:
+        messages = body.get("messages") or []
+        records = _packed_records(messages)
+        response_format = body.get("response_format") or {}
+        if response_format.get("type") == "json_schema":
+            schema = response_format["json_schema"].get("schema") or {}
+            return json.dumps(SchemaInstance(schema, records).build())
+        if records is not None:
+            return json.dumps({"records": [
+                {"recordId": str(r["recordId"]), "entities": ["Contoso", "Seattle"]} for r in records
+            ]})
+        return "[Contoso, Seattle]"
+
+    async def handle(self, request: web.Request) -> web.Response:
+        self.stats.requests += 1
+        body = await request.json()
+        started = time.perf_counter()
+        if self.rng.random() < self.throttle_rate:
+            self.stats.throttled += 1
+            return web.json_response(
+                {"error": {"code": "429", "message": "Rate limit is exceeded (stub)"}},
+                status=429,
+                headers={"retry-after-ms": str(int(self.retry_after * 1000))},
+            )
+        latency = self.latency.sample(self.rng)
+        await asyncio.sleep(latency)
+        if self.rng.random() < self.error_rate:
+            self.stats.errors += 1
+            return web.json_response({"error": {"code": "500", "message": "Stub server error"}}, status=500)
+
+        content = await self.responder(request.path, body) if self.responder is not None else None
+        if content is None:
+            content = self.content(body)
+        prompt_tokens = sum(_approximate_tokens(_message_text(m)) for m in body.get("messages") or [])
+        self.stats.completed += 1
+        return web.json_response(
+            {
+                "id": f"stub-{self.stats.requests}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body.get("model") or "stub",
+                "choices": [{
+                    "index": 0,
+                    "finish_reason": "stop",
+                    "message": {"role": "assistant", "content": content},
+                }],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": self.completion_tokens,
+                    "total_tokens": prompt_tokens + self.completion_tokens,
+                },
+            },
+            headers={"openai-processing-ms": f"{(time.perf_counter() - started) * 1000:.1f}"},
+        )
+
+    def application(self) -> web.Application:
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_post("/{tail:.*}", self.handle)
+        return app
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8790) -> str:
+        self._runner = web.AppRunner(self.application(), access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        # Port 0 binds a free port, so report the one actually bound
+        return f"http://{host}:{self._runner.addresses[0][1]}"
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+def add_stub_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--latency", type=float, default=0.2, help="median stub latency in seconds")
+    parser.add_argument("--latency-dist", choices=["fixed", "uniform", "lognormal"], default="lognormal")
+    parser.add_argument("--latency-spread", type=float, default=0.5,
+                        help="relative spread (uniform) or sigma (lognormal) of the latency")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="fraction of calls answered with 429")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of calls answered with 500")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="retry-after sent with a 429, in seconds")
+    parser.add_argument("--seed", type=int, default=None)
+
+
+def stub_from_arguments(args: argparse.Namespace) -> StubModelServer:
+    return StubModelServer(
+        LatencyModel(args.latency, args.latency_dist, args.latency_spread),
+        throttle_rate=args.throttle_rate,
+        error_rate=args.error_rate,
+        retry_after=args.retry_after,
+        seed=args.seed,
+    )
+
+
+async def serve(args: argparse.Namespace) -> None:
+    stub = stub_from_arguments(args)
+    url = await stub.start(port=args.port)
+    print(f"Stub model endpoint listening on {url}")
+    try:
+        while True:
+            await asyncio.sleep(3600)
+    finally:
+        await stub.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8790)
+    add_stub_arguments(parser)
+    try:
+        asyncio.run(serve(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,189 @@
+"""Bulk mode: run the skill over a JSONL file of records through a batch API.
+
+For full reindexes, records are turned into batch request files with the
+same prepare_messages logic and structured output models as the function,
+submitted as batch jobs and joined back by recordId into a JSONL file of
+skill responses, one per line, ready for an index push step.
+
+Run from the skill folder:
+
+    python -m bulk run --input records.jsonl --scenario summarization --work-dir bulk-run --output responses.jsonl
+    python -m bulk run --backend local ...    # file based stand-in, no Azure calls
+
+The prepare, submit and collect steps can also be run one at a time, so a
+batch that takes hours can be collected by a later invocation.
+"""
+import argparse
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, Tuple
+
+import openai
+
+from batch_jobs import (
+    AzureOpenAIBatchBackend,
+    BatchBackend,
+    LocalBatchBackend,
+    collect,
+    prepare,
+    read_skill_records,
+    submit,
+)
+from function_app import (
+    SCENARIO_MODELS,
+    ModelConfig,
+    ScenarioType,
+    combined_response_model,
+    error_response,
+    format_response,
+    parse_scenarios,
+    prepare_images,
+    prepare_messages,
+)
+from response_cache import record_content
+
+
+def response_model_for(scenario: str) -> Tuple[str, type]:
+    scenarios = parse_scenarios(scenario)
+    if len(scenarios) > 1:
+        return ",".join(scenarios), combined_response_model(tuple(scenarios))
+    if scenario not in SCENARIO_MODELS:
+        raise ValueError(f"Unknown scenario: {scenario}")
+    return scenario, SCENARIO_MODELS[scenario]
+
+
+def strict_json_schema(schema: Any) -> Any:
+    """The schema with every object closed and all of its properties required, as strict mode expects."""
+    if isinstance(schema, list):
+        return [strict_json_schema(item) for item in schema]
+    if not isinstance(schema, dict):
+        return schema
+    strict = {key: strict_json_schema(value) for key, value in schema.items()}
+    if "properties" in strict:
+        strict["required"] = list(strict["properties"])
+        strict["additionalProperties"] = False
+    return strict
+
+
+def response_format_param(response_model) -> Dict[str, Any]:
+    """The json_schema response_format of a structured output model, like the parse call sends it."""
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": response_model.__name__,
+            "schema": strict_json_schema(response_model.model_json_schema()),
+            "strict": True,
+        },
+    }
+
+
+def request_body_builder(scenario: str, response_model, deployment: str, config: ModelConfig):
+    response_format = response_format_param(response_model)
+
+    def request_body(record: Dict[str, Any]) -> Dict[str, Any]:
+        messages = prepare_messages(record, scenario, config)
+        if scenario == ScenarioType.IMAGE_CAPTIONING.value and config.image_prep:
+            # Validated and downscaled as in the function, so bad images are not submitted
+            messages = prepare_images(messages, config)
+        return {
+            "model": deployment,
+            # The azure.ai.inference message types are mappings
+            "messages": [dict(message) for message in messages],
+            "response_format": response_format,
+            "temperature": config.temperature,
+            "top_p": config.top_p,
+            "max_tokens": config.max_tokens,
+        }
+    return request_body
+
+
+def record_response_builder(response_model):
+    def record_response(request_body: Dict[str, Any], completion: Dict[str, Any]) -> Dict[str, Any]:
+        message = completion["choices"][0]["message"]
+        if message.get("refusal"):
+            raise ValueError(f"The model refused to answer: {message['refusal']}")
+        return format_response(request_body, response_model.model_validate_json(message["content"]))
+    return record_response
+
+
+def local_answer(body: Dict[str, Any]) -> Dict[str, Any]:
+    """Chat completion of the local stub model for a batch request body."""
+    from benchmarks.stub_server import LatencyModel, StubModelServer
+
+    return {
+        "id": "local",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model"),
+        "choices": [{
+            "index": 0,
+            "finish_reason": "stop",
+            "message": {"role": "assistant", "content": StubModelServer(LatencyModel(0)).content(body)},
+        }],
+    }
+
+
+def backend_from_arguments(args) -> BatchBackend:
+    if args.backend == "local":
+        return LocalBatchBackend(os.path.join(args.work_dir, "local-jobs"), local_answer)
+    client = openai.AzureOpenAI(
+        api_key=os.getenv("AZURE_INFERENCE_CREDENTIAL"),
+        azure_endpoint=os.getenv("AZURE_CHAT_COMPLETION_ENDPOINT"),
+        api_version=args.api_version,
+    )
+    return AzureOpenAIBatchBackend(client, completion_window=args.completion_window)
+
+
+def main(args) -> None:
+    scenario, response_model = response_model_for(args.scenario)
+    config = ModelConfig()
+    if args.step in ("prepare", "run"):
+        stats = prepare(
+            read_skill_records(args.input),
+            request_body_builder(scenario, response_model, args.deployment, config),
+            error_response,
+            args.work_dir,
+            key=record_content if config.dedup_records else None,
+        )
+        print(f"prepared: {json.dumps(stats.as_dict())}")
+    backend = backend_from_arguments(args) if args.step != "prepare" else None
+    if args.step in ("submit", "run"):
+        print(f"submitted: {submit(backend, args.work_dir)}")
+    if args.step in ("collect", "run"):
+        stats = collect(
+            backend,
+            args.work_dir,
+            args.output,
+            record_response_builder(response_model),
+            error_response,
+            poll_interval=args.poll_interval,
+            timeout=args.timeout,
+        )
+        print(f"collected: {json.dumps(stats.as_dict())}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("step", choices=["prepare", "submit", "collect", "run"])
+    parser.add_argument("--input", help="skill-style JSONL: one record, or one {\"values\": [...]} body, per line")
+    parser.add_argument("--scenario", required=True, help="scenario, or comma separated text scenarios")
+    parser.add_argument("--work-dir", required=True, help="folder for the request files and job state")
+    parser.add_argument("--output", help="skill response JSONL written by collect")
+    parser.add_argument("--backend", choices=["azure-openai", "local"], default="azure-openai")
+    parser.add_argument("--deployment",
+                        default=os.getenv("AZURE_OPENAI_BATCH_DEPLOYMENT") or os.getenv("AZURE_OPENAI_DEPLOYMENT", "gpt-4o"),
+                        help="batch deployment the requests are sent to")
+    parser.add_argument("--api-version", default="2024-10-21")
+    parser.add_argument("--completion-window", default="24h")
+    parser.add_argument("--poll-interval", type=float, default=60.0, help="seconds between status checks")
+    parser.add_argument("--timeout", type=float, default=None, help="give up collecting after this many seconds")
+    arguments = parser.parse_args()
+    if arguments.step in ("prepare", "run") and not arguments.input:
+        parser.error("--input is required to prepare requests")
+    if arguments.step in ("collect", "run") and not arguments.output:
+        parser.error("--output is required to collect results")
+    # The function app configures debug logging on import
+    logging.getLogger().setLevel(logging.INFO)
+    main(arguments)
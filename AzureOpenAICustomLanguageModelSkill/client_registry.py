@@ -0,0 +1,93 @@
+import asyncio
+import atexit
+import hashlib
+import logging
+from dataclasses import dataclass
+from typing import Dict, Tuple
+
+import httpx
+from openai import AsyncAzureOpenAI
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class _PooledClient:
+    client: AsyncAzureOpenAI
+    loop: asyncio.AbstractEventLoop
+
+
+# One keep-alive client per (endpoint, credential, api version) for the lifetime of the worker process
+_clients: Dict[Tuple[str, str, str], _PooledClient] = {}
+
+
+def _registry_key(endpoint: str, api_key: str, api_version: str) -> Tuple[str, str, str]:
+    # Only a digest of the credential is kept as part of the key
+    return endpoint, hashlib.sha256((api_key or "").encode("utf-8")).hexdigest(), api_version
+
+
+def get_client(
+    endpoint: str,
+    api_key: str,
+    api_version: str,
+    pool_size: int,
+    keepalive_timeout: float,
+) -> AsyncAzureOpenAI:
+    """Return the shared connection-pooled Azure OpenAI client for this endpoint.
+
+    The client and its httpx connection pool are created on first use and
+    reused by every later invocation running on the same event loop, so TCP
+    and TLS set-up is paid once per pooled connection instead of per request.
+    """
+    key = _registry_key(endpoint, api_key, api_version)
+    loop = asyncio.get_running_loop()
+    pooled = _clients.get(key)
+    if pooled and not pooled.client.is_closed() and pooled.loop is loop:
+        return pooled.client
+
+    # httpx connection pools are bound to the loop that created them, so a new
+    # loop (e.g. a fresh asyncio.run in local tooling) gets its own client
+    http_client = httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=pool_size,
+            max_keepalive_connections=pool_size,
+            keepalive_expiry=keepalive_timeout,
+        ),
+    )
+    client = AsyncAzureOpenAI(
+        api_key=api_key,
+        azure_endpoint=endpoint,
+        api_version=api_version,
+        http_client=http_client,
+        # Retries and backoff are owned by the rate limiter so they share one budget
+        max_retries=0,
+    )
+    _clients[key] = _PooledClient(client=client, loop=loop)
+    logger.info(f"Created pooled Azure OpenAI client for {endpoint} (pool size {pool_size})")
+    return client
+
+
+async def close_all() -> None:
+    """Close every pooled client owned by the running event loop."""
+    loop = asyncio.get_running_loop()
+    for key, pooled in list(_clients.items()):
+        if pooled.loop is loop:
+            await pooled.client.close()
+            del _clients[key]
+
+
+def _close_at_exit() -> None:
+    # The functions host gives no async shutdown hook, so drain each client on
+    # the loop that owns it when that loop is idle at interpreter exit.
+    for key, pooled in list(_clients.items()):
+        loop = pooled.loop
+        if pooled.client.is_closed() or loop.is_closed() or loop.is_running():
+            continue
+        try:
+            loop.run_until_complete(pooled.client.close())
+        except Exception as e:
+            logger.warning(f"Failed to close pooled client for {key[0]}: {e}")
+    _clients.clear()
+
+
+atexit.register(_close_at_exit)
@@ -0,0 +1,37 @@
+from typing import Any, Callable, Dict, List, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+
+
+def group_duplicates(records: List[T], key: Callable[[T], Optional[str]]) -> Tuple[List[T], List[int]]:
+    """Collapse records with the same key to the first of them.
+
+    Returns the unique records, in input order, and for every input record
+    the index of the unique record that stands for it. Records whose key is
+    None are never treated as duplicates.
+    """
+    unique: List[T] = []
+    owners: List[int] = []
+    seen: Dict[str, int] = {}
+    for record in records:
+        record_key = key(record)
+        if record_key is not None and record_key in seen:
+            owners.append(seen[record_key])
+            continue
+        if record_key is not None:
+            seen[record_key] = len(unique)
+        owners.append(len(unique))
+        unique.append(record)
+    return unique, owners
+
+
+def fan_out(records: List[Dict[str, Any]], unique_responses: List[Dict[str, Any]],
+            owners: List[int]) -> List[Dict[str, Any]]:
+    """Give every input record the response of the unique record that stands for it."""
+    responses = []
+    for record, owner in zip(records, owners):
+        response = unique_responses[owner]
+        if response.get("recordId") != record.get("recordId"):
+            response = {**response, "recordId": record.get("recordId")}
+        responses.append(response)
+    return responses
@@ -2,13 +2,33 @@ import azure.functions as func
 import json
 import logging
 import os
-from typing import Dict, Any, List
-from dataclasses import dataclass
+import asyncio
+import functools
+import math
+from typing import Dict, Any, List, Optional, Tuple, Union
+from dataclasses import dataclass, field
 from enum import Enum
 import base64
 import time
-from openai import AzureOpenAI
-from pydantic import BaseModel, Field
+import openai
+from batch_executor import BudgetStats, Deadline, run_bounded
+from client_registry import get_client
+from response_cache import ResponseCache, cache_key, record_content
+from rate_limiter import (
+    RateLimitConfig,
+    RetryableError,
+    describe_schedulers,
+    get_scheduler,
+    parse_retry_after,
+)
+from tokens import estimate_message_tokens, estimate_tokens, split_by_tokens
+from chunked_summary import map_reduce_summarize, summary_call_rounds
+from record_packing import answers_by_record_id, pack_records, packed_user_content
+from image_prep import ImagePrepConfig, ImagePrepError, prepare_message_images
+from dedup import fan_out, group_duplicates
+from metrics import SkillMetrics
+from model_routing import LATENCY_SLO, LatencyWindow, Route, RoutingPolicy, choose_route
+from pydantic import BaseModel, Field, create_model
 from azure.ai.inference.models import (
         SystemMessage,
         UserMessage,
@@ -19,6 +39,19 @@ logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
 
+SUMMARY_SYSTEM_PROMPT = "You are an expert summarizer. Create a structured summary of the following text."
+SUMMARY_REDUCE_SYSTEM_PROMPT = (
+    "You are an expert summarizer. The following are summaries of consecutive sections "
+    "of one document. Combine them into a single structured summary of the whole document."
+)
+ENTITY_SYSTEM_PROMPT = "Extract and classify all named entities from the text with confidence scores."
+ENTITY_PACKED_SYSTEM_PROMPT = (
+    "Extract and classify all named entities with confidence scores from each of the records "
+    "in the following JSON array of records. Answer with exactly one entry for every input "
+    "record, using its recordId, and keep the entities of different records apart."
+)
+
+
 class ScenarioType(Enum):
     SUMMARIZATION = "summarization"
     ENTITY_RECOGNITION = "entity-recognition"
@@ -33,6 +66,126 @@ class ModelConfig:
     timeout: int = 30
     retry_attempts: int = 3
     retry_delay: float = 0.5
+    # Upper bound on model calls in flight for a single skill request
+    max_concurrency: int = field(
+        default_factory=lambda: int(os.getenv("MAX_CONCURRENT_REQUESTS", "10"))
+    )
+    # Size of the process-wide keep-alive connection pool per endpoint
+    http_pool_size: int = field(
+        default_factory=lambda: int(os.getenv("HTTP_POOL_SIZE", "100"))
+    )
+    http_keepalive_timeout: float = field(
+        default_factory=lambda: float(os.getenv("HTTP_KEEPALIVE_SECONDS", "60"))
+    )
+    # Deployment quota shared by all requests on this instance, 0 means unlimited
+    requests_per_minute: int = field(
+        default_factory=lambda: int(os.getenv("RATE_LIMIT_RPM", "0"))
+    )
+    tokens_per_minute: int = field(
+        default_factory=lambda: int(os.getenv("RATE_LIMIT_TPM", "0"))
+    )
+    # Time budget for a whole request, kept under the 230 second custom skill limit;
+    # a "deadline-seconds" request header overrides it
+    request_deadline: float = field(
+        default_factory=lambda: float(os.getenv("REQUEST_DEADLINE_SECONDS", "225"))
+    )
+    # Part of the budget reserved for building and sending the response
+    deadline_margin: float = field(
+        default_factory=lambda: float(os.getenv("DEADLINE_MARGIN_SECONDS", "2"))
+    )
+    # Long summarization inputs are split into chunks that are summarized
+    # concurrently and then combined (map-reduce)
+    summary_chunking: bool = field(
+        default_factory=lambda: os.getenv("SUMMARY_CHUNKING", "false").lower() == "true"
+    )
+    summary_chunk_tokens: int = field(
+        default_factory=lambda: int(os.getenv("SUMMARY_CHUNK_TOKENS", "4000"))
+    )
+    summary_chunk_overlap_tokens: int = field(
+        default_factory=lambda: int(os.getenv("SUMMARY_CHUNK_OVERLAP_TOKENS", "200"))
+    )
+    summary_fan_out: int = field(
+        default_factory=lambda: int(os.getenv("SUMMARY_FAN_OUT", "4"))
+    )
+    # Short entity recognition records can be sent several to a model call
+    entity_packing: bool = field(
+        default_factory=lambda: os.getenv("ENTITY_PACKING", "false").lower() == "true"
+    )
+    entity_pack_max_records: int = field(
+        default_factory=lambda: int(os.getenv("ENTITY_PACK_MAX_RECORDS", "20"))
+    )
+    entity_pack_max_tokens: int = field(
+        default_factory=lambda: int(os.getenv("ENTITY_PACK_MAX_TOKENS", "1000"))
+    )
+    # Records of a batch with the same content are sent to the model once
+    dedup_records: bool = field(
+        default_factory=lambda: os.getenv("DEDUP_RECORDS", "true").lower() == "true"
+    )
+    # Short inputs go to this faster, cheaper deployment when it is set, and long
+    # ones too while the p95 latency of the main deployment is above the SLO
+    fast_deployment: str = field(
+        default_factory=lambda: os.getenv("AZURE_OPENAI_FAST_DEPLOYMENT", "")
+    )
+    route_fast_max_tokens: int = field(
+        default_factory=lambda: int(os.getenv("ROUTE_FAST_MAX_TOKENS", "500"))
+    )
+    latency_slo: float = field(
+        default_factory=lambda: float(os.getenv("LATENCY_SLO_SECONDS", "0"))
+    )
+    latency_slo_window: float = field(
+        default_factory=lambda: float(os.getenv("LATENCY_SLO_WINDOW_SECONDS", "60"))
+    )
+    # Ceiling for the adaptive concurrency limit across all requests on this instance
+    instance_max_concurrency: int = field(
+        default_factory=lambda: int(os.getenv("INSTANCE_MAX_CONCURRENCY", "50"))
+    )
+    # Images for captioning are downscaled to what the model can use before upload
+    image_prep: bool = field(
+        default_factory=lambda: os.getenv("IMAGE_PREP", "true").lower() == "true"
+    )
+    image_max_pixels: int = field(
+        default_factory=lambda: int(os.getenv("IMAGE_MAX_PIXELS", "50000000"))
+    )
+    image_max_long_side: int = field(
+        default_factory=lambda: int(os.getenv("IMAGE_MAX_LONG_SIDE", "2048"))
+    )
+    image_max_short_side: int = field(
+        default_factory=lambda: int(os.getenv("IMAGE_MAX_SHORT_SIDE", "768"))
+    )
+    image_format: str = field(
+        default_factory=lambda: os.getenv("IMAGE_FORMAT", "jpeg")
+    )
+    image_quality: int = field(
+        default_factory=lambda: int(os.getenv("IMAGE_QUALITY", "85"))
+    )
+
+    def rate_limit_config(self) -> RateLimitConfig:
+        return RateLimitConfig(
+            requests_per_minute=self.requests_per_minute,
+            tokens_per_minute=self.tokens_per_minute,
+            retry_attempts=self.retry_attempts,
+            retry_delay=self.retry_delay,
+            initial_concurrency=self.max_concurrency,
+            max_concurrency=self.instance_max_concurrency,
+        )
+
+    def routing_policy(self, deployment: str) -> RoutingPolicy:
+        return RoutingPolicy(
+            deployment=deployment,
+            fast_deployment=self.fast_deployment or None,
+            fast_max_tokens=self.route_fast_max_tokens,
+            latency_slo=self.latency_slo,
+            slo_window=self.latency_slo_window,
+        )
+
+    def image_prep_config(self) -> ImagePrepConfig:
+        return ImagePrepConfig(
+            max_pixels=self.image_max_pixels,
+            max_long_side=self.image_max_long_side,
+            max_short_side=self.image_max_short_side,
+            output_format=self.image_format,
+            quality=self.image_quality,
+        )
 
 
 # Pydantic models for structured outputs
@@ -56,6 +209,16 @@ class EntityResponse(BaseModel):
     )
 
 
+class RecordEntityResponse(EntityResponse):
+    recordId: str = Field(description="The recordId of the input record the entities were extracted from")
+
+
+class PackedEntityResponse(BaseModel):
+    records: List[RecordEntityResponse] = Field(
+        description="The entities of every input record, one entry per record"
+    )
+
+
 class ImageCaptionResponse(BaseModel):
     caption: str = Field(description="A detailed description of the image content")
     tags: List[str] = Field(
@@ -72,14 +235,69 @@ class CustomSkillException(Exception):
         super().__init__(self.message)
 
 
+SCENARIO_MODELS = {
+    ScenarioType.SUMMARIZATION.value: SummaryResponse,
+    ScenarioType.ENTITY_RECOGNITION.value: EntityResponse,
+    ScenarioType.IMAGE_CAPTIONING.value: ImageCaptionResponse,
+}
+# Text scenarios that can be answered together by a single model call
+SCENARIO_SYSTEM_PROMPTS = {
+    ScenarioType.SUMMARIZATION.value: SUMMARY_SYSTEM_PROMPT,
+    ScenarioType.ENTITY_RECOGNITION.value: ENTITY_SYSTEM_PROMPT,
+}
+
+
+def parse_scenarios(header_value: str) -> List[str]:
+    """Scenarios of the scenario header, which may list several text scenarios separated by commas.
+
+    Combined scenarios come back in a fixed order, so the same combination
+    always makes the same prompt and cache key.
+    """
+    names = [name.strip() for name in header_value.split(",") if name.strip()]
+    if len(set(names)) <= 1:
+        return names[:1] or [header_value]
+    unknown = sorted(set(names) - {s.value for s in ScenarioType})
+    if unknown:
+        raise CustomSkillException(f"Unknown scenario: {', '.join(unknown)}", 400)
+    not_combinable = sorted(set(names) - set(SCENARIO_SYSTEM_PROMPTS))
+    if not_combinable:
+        raise CustomSkillException(
+            f"Scenario {', '.join(not_combinable)} cannot be combined with other scenarios", 400
+        )
+    return [s.value for s in ScenarioType if s.value in names]
+
+
+@functools.lru_cache(maxsize=None)
+def combined_response_model(scenarios: Tuple[str, ...]) -> type[BaseModel]:
+    """One structured output model with the fields of every scenario's response model."""
+    models = tuple(SCENARIO_MODELS[scenario] for scenario in scenarios)
+    if len(models) == 1:
+        return models[0]
+    name = "".join(model.__name__.removesuffix("Response") for model in models) + "Response"
+    return create_model(name, __base__=models)
+
+
 app = func.FunctionApp()
 
+# Process-wide cache of structured model answers, shared by all invocations on this worker
+RESPONSE_CACHE = ResponseCache.from_env()
+# Deadline budget used by the batches handled on this worker
+BUDGET_STATS = BudgetStats()
+# Stage latency, token and outcome metrics, exposed by the metrics endpoint
+METRICS = SkillMetrics()
+# Recent model call latencies per deployment, checked against the latency SLO
+DEPLOYMENT_LATENCY = LatencyWindow()
+
+TIMEOUT_ERROR = "Request timeout"
+DEADLINE_WARNING = "Deadline exceeded: the record was not processed within the request time budget"
+SLO_ROUTE_WARNING = "Routed to the fast deployment {deployment} because the main deployment is above its latency SLO"
+
 
 def validate_environment() -> tuple[str, str, str, str]:
     """Validate required environment variables."""
     api_key = os.getenv("AZURE_INFERENCE_CREDENTIAL")
     endpoint = os.getenv("AZURE_CHAT_COMPLETION_ENDPOINT")
-    deployment_name = "gpt-4o"  # Make sure this is your GPT-4o deployment name
+    deployment_name = os.getenv("AZURE_OPENAI_DEPLOYMENT", "gpt-4o")  # Make sure this is your GPT-4o deployment name
     api_version = "2024-08-01-preview"
 
     if not api_key or not endpoint or not deployment_name or not api_version:
@@ -90,15 +308,27 @@ def validate_environment() -> tuple[str, str, str, str]:
 
 
 def prepare_messages(
-    request_body: Dict[str, Any], scenario: str
+    request_body: Dict[str, Any], scenario: str, config: Optional[ModelConfig] = None
 ) -> List[Dict[str, Any]]:
     """Prepare messages based on scenario."""
     try:
-        if scenario == ScenarioType.SUMMARIZATION.value:
+        scenarios = scenario.split(",")
+        if len(scenarios) > 1:
+            text = request_body.get("data", {}).get("text", "")
+            if not text:
+                raise CustomSkillException(f"Missing text for {' and '.join(scenarios)}", 400)
+            # One instruction per scenario, answered together in the combined response model
+            system_message = SystemMessage(
+                content=" ".join(SCENARIO_SYSTEM_PROMPTS[name] for name in scenarios)
+            )
+            user_message = UserMessage(content=text)
+            return [ system_message, user_message ]
+
+        elif scenario == ScenarioType.SUMMARIZATION.value:
             text = request_body.get("data", {}).get("text", "")
             if not text:
                 raise CustomSkillException("Missing text for summarization", 400)
-            system_message = SystemMessage(content="You are an expert summarizer. Create a structured summary of the following text.")
+            system_message = SystemMessage(content=SUMMARY_SYSTEM_PROMPT)
             user_message = UserMessage(content=text)
             return [ system_message, user_message ]
 
@@ -106,7 +336,7 @@ def prepare_messages(
             text = request_body.get("data", {}).get("text", "")
             if not text:
                 raise CustomSkillException("Missing text for entity recognition", 400)
-            system_message = SystemMessage(content="Extract and classify all named entities from the text with confidence scores.")
+            system_message = SystemMessage(content=ENTITY_SYSTEM_PROMPT)
             user_message = UserMessage(content=text)
             return [ system_message, user_message ]
 
@@ -131,11 +361,13 @@ def prepare_messages(
                     },
                 ]
             elif image_data and image_type:
-                try:
-                    base64.b64decode(image_data)
-                except Exception as e:
-                    raise CustomSkillException("Invalid base64 encoding", 400)
-
+                if config is None or not config.image_prep:
+                    # Prepared images are validated when they are decoded
+                    try:
+                        base64.b64decode(image_data)
+                    except Exception as e:
+                        raise CustomSkillException("Invalid base64 encoding", 400)
+                # Downscaled by prepare_images once the response cache has been checked
                 image_base64encoded = f"data:{image_type};base64,{image_data}"
                 return [
                     {"role": "system", "content": system_image_verbalization_message},
@@ -165,6 +397,22 @@ def prepare_messages(
         raise CustomSkillException(f"Failed to prepare messages: {str(e)}", 500)
 
 
+def system_prompt_text(messages: List[Any]) -> str:
+    """Return the text of the system message, which is part of the cache key."""
+    for message in messages:
+        if message["role"] == "system":
+            return message["content"]
+    return ""
+
+
+def prepare_images(messages: List[Any], config: ModelConfig) -> List[Any]:
+    """Decode, downscale and re-encode the images of prepared messages."""
+    try:
+        return prepare_message_images(messages, config.image_prep_config())
+    except ImagePrepError as e:
+        raise CustomSkillException(str(e), 400)
+
+
 def format_response(
     request_body: Dict[str, Any], parsed_response: BaseModel
 ) -> Dict[str, Any]:
@@ -177,26 +425,25 @@ def format_response(
             "data": {},
         }
 
-        # Since we're using Pydantic models, we can access the fields directly
+        # Since we're using Pydantic models, we can access the fields directly;
+        # a combined response model is an instance of every scenario's model
         if isinstance(parsed_response, SummaryResponse):
-            response_body["data"] = {"generative-summary": parsed_response.summary}
-        elif isinstance(parsed_response, EntityResponse):
-            response_body["data"] = {
-                "entities": [
-                    {
-                        "name": entity.name,
-                        "type": entity.type,
-                        "confidence": entity.confidence,
-                    }
-                    for entity in parsed_response.entities
-                ]
-            }
-        elif isinstance(parsed_response, ImageCaptionResponse):
-            response_body["data"] = {
+            response_body["data"]["generative-summary"] = parsed_response.summary
+        if isinstance(parsed_response, EntityResponse):
+            response_body["data"]["entities"] = [
+                {
+                    "name": entity.name,
+                    "type": entity.type,
+                    "confidence": entity.confidence,
+                }
+                for entity in parsed_response.entities
+            ]
+        if isinstance(parsed_response, ImageCaptionResponse):
+            response_body["data"].update({
                 "generative-caption": parsed_response.caption,
                 "tags": parsed_response.tags,
                 "confidence": parsed_response.confidence,
-            }
+            })
 
         return response_body
     except Exception as e:
@@ -209,11 +456,83 @@ def format_response(
         }
 
 
+def merge_entity_responses(responses: List[EntityResponse]) -> EntityResponse:
+    """Entities of several chunks of a text, each name and type once with its best confidence."""
+    entities: Dict[Tuple[str, str], Entity] = {}
+    for response in responses:
+        for entity in response.entities:
+            key = (entity.name.strip().casefold(), entity.type.strip().casefold())
+            if key not in entities:
+                entities[key] = entity
+            elif entity.confidence > entities[key].confidence:
+                # The first spelling is kept, with the best confidence
+                entities[key] = entities[key].model_copy(update={"confidence": entity.confidence})
+    return EntityResponse(entities=list(entities.values()))
+
+
+def timeout_response(request_body: Dict[str, Any]) -> Dict[str, Any]:
+    """Build the record response for a model call that ran out of time."""
+    logger.error(f"Timeout processing record {request_body.get('recordId')}")
+    return {
+        "recordId": request_body.get("recordId"),
+        "errors": [TIMEOUT_ERROR],
+        "warnings": None,
+        "data": None,
+    }
+
+
+def deadline_response(request_body: Dict[str, Any]) -> Dict[str, Any]:
+    """Build the record response for a record cancelled at the request deadline."""
+    logger.warning(
+        f"Deadline exceeded before record {request_body.get('recordId')} was processed"
+    )
+    return {
+        "recordId": request_body.get("recordId"),
+        "errors": [],
+        "warnings": [DEADLINE_WARNING],
+        "data": {},
+    }
+
+
+def parse_deadline(header_value: str, config: ModelConfig) -> float:
+    """Request time budget in seconds, from the deadline-seconds header or config."""
+    if not header_value:
+        return config.request_deadline
+    try:
+        budget = float(header_value)
+    except ValueError:
+        raise CustomSkillException("Invalid deadline-seconds header", 400)
+    if budget <= 0:
+        raise CustomSkillException("Invalid deadline-seconds header", 400)
+    return budget
+
+
+def record_outcome(response_body: Dict[str, Any]) -> str:
+    """Outcome label of a record response for the metrics endpoint."""
+    if response_body.get("errors"):
+        return "timeout" if response_body["errors"] == [TIMEOUT_ERROR] else "error"
+    if DEADLINE_WARNING in (response_body.get("warnings") or []):
+        return "deadline"
+    return "ok"
+
+
+def error_response(request_body: Dict[str, Any], error: Exception) -> Dict[str, Any]:
+    """Build the record response for a model call that failed."""
+    logger.error(f"Error processing record {request_body.get('recordId')}: {error}")
+    return {
+        "recordId": request_body.get("recordId"),
+        "errors": [str(error)],
+        "warnings": None,
+        "data": None,
+    }
+
+
 @app.function_name(name="AOAICustomSkill")
 @app.route(route="custom_skill", auth_level=func.AuthLevel.ANONYMOUS)
 async def custom_skill(req: func.HttpRequest) -> func.HttpResponse:
     """Main custom skill endpoint using structured outputs."""
     start_time = time.time()
+    started_at = time.monotonic()
 
     try:
         request_json = req.get_json()
@@ -221,6 +540,9 @@ async def custom_skill(req: func.HttpRequest) -> func.HttpResponse:
         scenario = req.headers.get("scenario")
         if not scenario:
             raise CustomSkillException("Missing scenario in headers", 400)
+        # Several text scenarios can be answered by one model call per record
+        scenarios = parse_scenarios(scenario)
+        scenario = ",".join(scenarios)
 
         input_values = request_json.get("values", [])
         if not input_values:
@@ -228,57 +550,413 @@ async def custom_skill(req: func.HttpRequest) -> func.HttpResponse:
 
         api_key, endpoint, deployment_name, api_version = validate_environment()
         config = ModelConfig()
+        # Scenario label of the metrics, kept to the known scenarios
+        metric_scenario = (
+            scenario if set(scenarios) <= {s.value for s in ScenarioType} else "unknown"
+        )
+        deadline = Deadline(
+            budget=parse_deadline(req.headers.get("deadline-seconds"), config),
+            margin=config.deadline_margin,
+            started_at=started_at,
+        )
 
-        client = AzureOpenAI(
-            api_key=api_key, azure_endpoint=endpoint, api_version=api_version
+        # Shared keep-alive client, reused across invocations of this worker
+        client = get_client(
+            endpoint,
+            api_key,
+            api_version,
+            pool_size=config.http_pool_size,
+            keepalive_timeout=config.http_keepalive_timeout,
         )
 
-        response_values = []
-        for request_body in input_values:
+        routing_policy = config.routing_policy(deployment_name)
+
+        def route_for(messages: List[Any]) -> Route:
+            return choose_route(routing_policy, estimate_message_tokens(messages), DEPLOYMENT_LATENCY)
+
+        async def complete(
+            messages: List[Any], response_model: type[BaseModel], deployment: str
+        ) -> BaseModel:
+            # Shared request/token budgets and adaptive concurrency for this deployment
+            scheduler = get_scheduler(f"{endpoint}/{deployment}", config.rate_limit_config())
+            submitted_at = time.monotonic()
+            attempts = 0
+            # Round trip of the attempt that answered, without admission waits and backoff
+            round_trip = 0.0
+            last_sent_at: Optional[float] = None
+
+            async def call_model():
+                nonlocal attempts, round_trip, last_sent_at
+                sent_at = time.monotonic()
+                last_sent_at = sent_at
+                if attempts == 0:
+                    METRICS.observe_stage(metric_scenario, "admission", sent_at - submitted_at)
+                attempts += 1
+                try:
+                    # Use parse method to get structured output; the raw response
+                    # gives access to the headers and times parsing separately
+                    raw_response = await client.beta.chat.completions.with_raw_response.parse(
+                        model=deployment,
+                        messages=messages,
+                        response_format=response_model,
+                        temperature=config.temperature,
+                        top_p=config.top_p,
+                        max_tokens=config.max_tokens,
+                    )
+                except (openai.RateLimitError, openai.InternalServerError) as e:
+                    raise RetryableError(
+                        str(e),
+                        status_code=e.status_code,
+                        retry_after=parse_retry_after(e.response.headers),
+                    )
+                except openai.APIConnectionError as e:
+                    raise RetryableError(str(e))
+                round_trip = time.monotonic() - sent_at
+                METRICS.observe_round_trip(metric_scenario, round_trip, raw_response.headers)
+                with METRICS.stage(metric_scenario, "parse"):
+                    return raw_response.parse()
+
+            # The service counts max_tokens against the TPM limit until the call reports its usage
+            estimated_tokens = estimate_message_tokens(messages) + config.max_tokens
             try:
-                messages = prepare_messages(request_body, scenario)
-
-                # Select appropriate response model based on scenario
-                response_model = {
-                    ScenarioType.SUMMARIZATION.value: SummaryResponse,
-                    ScenarioType.ENTITY_RECOGNITION.value: EntityResponse,
-                    ScenarioType.IMAGE_CAPTIONING.value: ImageCaptionResponse,
-                }[scenario]
-
-                # Use parse method to get structured output
-                completion = client.beta.chat.completions.parse(
-                    model=deployment_name,
-                    messages=messages,
-                    response_format=response_model,
-                    temperature=config.temperature,
-                    top_p=config.top_p,
-                    max_tokens=config.max_tokens,
-                )
+                completion = await scheduler.run(call_model, estimated_tokens)
+            except (Exception, asyncio.CancelledError):
+                # Calls that time out, are cancelled at the deadline or fail count against
+                # the SLO too, with the time since their last request was sent; otherwise
+                # only the calls fast enough to answer would ever reach the window
+                if last_sent_at is not None:
+                    DEPLOYMENT_LATENCY.observe(deployment, time.monotonic() - last_sent_at)
+                raise
+            DEPLOYMENT_LATENCY.observe(deployment, round_trip)
+            scheduler.record_usage(
+                estimated_tokens,
+                completion.usage.total_tokens if completion.usage else None,
+            )
+            if completion.usage:
+                METRICS.add_usage(metric_scenario, completion.usage.model_dump())
+            parsed_response = completion.choices[0].message.parsed
+            logger.debug(f"Parsed response: {parsed_response}")
+            return parsed_response
+
+        async def summarize_text(
+            system_prompt: str, text: str, deployment: str, calls: asyncio.Semaphore
+        ) -> str:
+            messages = [SystemMessage(content=system_prompt), UserMessage(content=text)]
+            async with calls:
+                return (await complete(messages, SummaryResponse, deployment)).summary
+
+        async def summarize_long_text(
+            text: str, deployment: str, calls: asyncio.Semaphore
+        ) -> SummaryResponse:
+            summary = await map_reduce_summarize(
+                text,
+                summarize=lambda chunk: summarize_text(SUMMARY_SYSTEM_PROMPT, chunk, deployment, calls),
+                combine=lambda summaries: summarize_text(
+                    SUMMARY_REDUCE_SYSTEM_PROMPT, "\n\n".join(summaries), deployment, calls
+                ),
+                chunk_tokens=config.summary_chunk_tokens,
+                overlap_tokens=config.summary_chunk_overlap_tokens,
+                fan_out=config.summary_fan_out,
+            )
+            return SummaryResponse(summary=summary)
+
+        async def extract_entities(
+            chunk: str, deployment: str, calls: asyncio.Semaphore
+        ) -> Optional[EntityResponse]:
+            messages = [SystemMessage(content=ENTITY_SYSTEM_PROMPT), UserMessage(content=chunk)]
+            async with calls:
+                return await complete(messages, EntityResponse, deployment)
+
+        async def extract_long_text_entities(
+            text: str, deployment: str, calls: asyncio.Semaphore
+        ) -> EntityResponse:
+            # Entities are extracted from the same chunks as the summary, so no call
+            # exceeds the context, and merged
+            chunks = split_by_tokens(
+                text, config.summary_chunk_tokens, config.summary_chunk_overlap_tokens
+            )
+            responses = await asyncio.gather(
+                *(extract_entities(chunk, deployment, calls) for chunk in chunks)
+            )
+            return merge_entity_responses([response for response in responses if response is not None])
+
+        async def long_text_response(
+            text: str, deployment: str
+        ) -> Tuple[Optional[BaseModel], List[str]]:
+            """The answer for a text above the summary chunk size, and warnings about it."""
+            # The summary and entity calls of the record share one fan-out bound
+            calls = asyncio.Semaphore(max(1, config.summary_fan_out))
+            if len(scenarios) == 1:
+                return await summarize_long_text(text, deployment, calls), []
+
+            async def entities_or_error() -> Union[EntityResponse, Exception]:
+                try:
+                    return await extract_long_text_entities(text, deployment, calls)
+                except Exception as e:
+                    # The summary is still returned when the entities fail
+                    logger.warning(f"Entity extraction of a long text failed: {e}")
+                    return e
+
+            summary, entities = await asyncio.gather(
+                summarize_long_text(text, deployment, calls), entities_or_error()
+            )
+            if isinstance(entities, Exception):
+                return response_model(**summary.model_dump(), entities=[]), [
+                    f"Entity extraction failed: {entities}"
+                ]
+            return response_model(**summary.model_dump(), **entities.model_dump()), []
 
-                parsed_response = completion.choices[0].message.parsed
-                logger.debug(f"Parsed response: {parsed_response}")
-                response_values.append(format_response(request_body, parsed_response))
+        # Select appropriate response model based on scenario; combined scenarios
+        # get one model with the fields of each
+        if len(scenarios) > 1:
+            response_model = combined_response_model(tuple(scenarios))
+        else:
+            response_model = SCENARIO_MODELS.get(scenario)
 
-            except Exception as e:
-                logger.error(
-                    f"Error processing record {request_body.get('recordId')}: {e}"
+        def is_long_summary(request_body: Dict[str, Any]) -> bool:
+            text = request_body.get("data", {}).get("text", "")
+            return (
+                ScenarioType.SUMMARIZATION.value in scenarios
+                and config.summary_chunking
+                and estimate_tokens(text) > config.summary_chunk_tokens
+            )
+
+        def record_timeout(request_body: Dict[str, Any]) -> float:
+            if not is_long_summary(request_body):
+                return config.timeout
+            # A chunked summary makes several rounds of calls, each allowed the per-call timeout
+            chunks = split_by_tokens(
+                request_body["data"]["text"],
+                config.summary_chunk_tokens,
+                config.summary_chunk_overlap_tokens,
+            )
+            rounds = summary_call_rounds(len(chunks), config.summary_fan_out)
+            if ScenarioType.ENTITY_RECOGNITION.value in scenarios:
+                # The entity calls take their turns under the same fan-out bound
+                rounds += math.ceil(len(chunks) / max(1, config.summary_fan_out))
+            return config.timeout * rounds
+
+        def record_cache_key(
+            request_body: Dict[str, Any], messages: List[Any], deployment: str
+        ) -> Optional[str]:
+            content = record_content(request_body)
+            if content is None or not RESPONSE_CACHE.enabled_for(config.temperature):
+                return None
+            if scenario == ScenarioType.IMAGE_CAPTIONING.value and config.image_prep:
+                # The model sees the prepared image, so its settings address the answer too
+                content += "\n" + config.image_prep_config().cache_material()
+            return cache_key(
+                scenario,
+                system_prompt_text(messages),
+                deployment,
+                config.temperature,
+                content,
+            )
+
+        def format_record(
+            request_body: Dict[str, Any], parsed_response: BaseModel, route: Route
+        ) -> Dict[str, Any]:
+            METRICS.routes.inc(
+                scenario=metric_scenario, deployment=route.deployment, reason=route.reason
+            )
+            with METRICS.stage(metric_scenario, "format"):
+                response_body = format_response(request_body, parsed_response)
+            if route.reason == LATENCY_SLO:
+                # Answers from the fast model under load are flagged for auditing
+                response_body["warnings"] = (response_body["warnings"] or []) + [
+                    SLO_ROUTE_WARNING.format(deployment=route.deployment)
+                ]
+            return response_body
+
+        async def process_record(
+            request_body: Dict[str, Any], lookup_cache: bool = True
+        ) -> Dict[str, Any]:
+            with METRICS.stage(metric_scenario, "prepare"):
+                messages = prepare_messages(request_body, scenario, config)
+                route = route_for(messages)
+                key = record_cache_key(request_body, messages, route.deployment)
+
+            if key is not None and lookup_cache:
+                cached_response = RESPONSE_CACHE.get(key)
+                if cached_response is not None:
+                    parsed_response = response_model.model_validate_json(cached_response)
+                    return format_record(request_body, parsed_response, route)
+            if scenario == ScenarioType.IMAGE_CAPTIONING.value and config.image_prep:
+                with METRICS.stage(metric_scenario, "prepare"):
+                    # Decoding and resizing images is CPU bound, keep it off the event loop
+                    messages = await asyncio.to_thread(prepare_images, messages, config)
+
+            warnings = []
+            if is_long_summary(request_body):
+                parsed_response, warnings = await long_text_response(
+                    request_body["data"]["text"], route.deployment
                 )
-                response_values.append(
-                    {
-                        "recordId": request_body.get("recordId"),
-                        "errors": [str(e)],
-                        "warnings": None,
-                        "data": None,
-                    }
+            else:
+                parsed_response = await complete(messages, response_model, route.deployment)
+            # Partial answers are not cached, so the next call tries the missing part again
+            if key is not None and parsed_response is not None and not warnings:
+                RESPONSE_CACHE.set(key, parsed_response.model_dump_json())
+            response_body = format_record(request_body, parsed_response, route)
+            if warnings:
+                response_body["warnings"] = (response_body["warnings"] or []) + warnings
+            return response_body
+
+        async def process_pack(pack: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+            if len(pack) == 1:
+                return [await process_record(pack[0])]
+
+            # Answers are cached per record, under the same key as a single-record call
+            responses = {}
+            messages = {}
+            pending = []
+            for request_body in pack:
+                record_id = str(request_body.get("recordId"))
+                with METRICS.stage(metric_scenario, "prepare"):
+                    messages[record_id] = prepare_messages(request_body, scenario, config)
+                    route = route_for(messages[record_id])
+                    key = record_cache_key(request_body, messages[record_id], route.deployment)
+                cached_response = RESPONSE_CACHE.get(key) if key is not None else None
+                if cached_response is not None:
+                    responses[record_id] = format_record(
+                        request_body, EntityResponse.model_validate_json(cached_response), route
+                    )
+                else:
+                    pending.append(request_body)
+
+            answers = {}
+            if len(pending) > 1:
+                packed_messages = [
+                    SystemMessage(content=ENTITY_PACKED_SYSTEM_PROMPT),
+                    UserMessage(content=packed_user_content(pending)),
+                ]
+                # The pack is routed as one call, by its combined size
+                pack_route = route_for(packed_messages)
+                try:
+                    async with asyncio.timeout(config.timeout):
+                        packed_response = await complete(
+                            packed_messages, PackedEntityResponse, pack_route.deployment
+                        )
+                    if packed_response is not None:
+                        answers = answers_by_record_id(
+                            pending,
+                            (
+                                (record.recordId, EntityResponse(entities=record.entities))
+                                for record in packed_response.records
+                            ),
+                        )
+                except Exception as e:
+                    # A failed or unparsable packed call costs a round trip, not the records
+                    logger.warning(
+                        f"Packed call for {len(pending)} records failed, falling back: {e!r}"
+                    )
+
+            fallback = []
+            for request_body in pending:
+                record_id = str(request_body.get("recordId"))
+                if record_id not in answers:
+                    fallback.append(request_body)
+                    continue
+                key = record_cache_key(request_body, messages[record_id], pack_route.deployment)
+                if key is not None:
+                    RESPONSE_CACHE.set(key, answers[record_id].model_dump_json())
+                responses[record_id] = format_record(request_body, answers[record_id], pack_route)
+
+            if fallback:
+                if len(pending) > 1:
+                    logger.info(
+                        f"{len(fallback)} of {len(pending)} packed records fall back to a call of their own"
+                    )
+                results = await asyncio.gather(
+                    *(fallback_record(request_body) for request_body in fallback)
                 )
+                for request_body, result in zip(fallback, results):
+                    responses[str(request_body.get("recordId"))] = result
+            return [responses[str(request_body.get("recordId"))] for request_body in pack]
+
+        async def fallback_record(request_body: Dict[str, Any]) -> Dict[str, Any]:
+            # Each fallback gets a timeout of its own; the pack already looked it up in the cache
+            try:
+                async with asyncio.timeout(config.timeout):
+                    return await process_record(request_body, lookup_cache=False)
+            except TimeoutError:
+                return timeout_response(request_body)
+            except Exception as e:
+                return error_response(request_body, e)
+
+        def pack_timeout(pack: List[Dict[str, Any]]) -> float:
+            # The packed call and the fallbacks after it are each allowed the per-call timeout
+            return config.timeout if len(pack) == 1 else 2 * config.timeout
+
+        def timed(worker, records=lambda item: 1):
+            async def run(item):
+                # Every record of the request is queued when the batch starts
+                for _ in range(records(item)):
+                    METRICS.observe_stage(metric_scenario, "queue", time.monotonic() - started_at)
+                try:
+                    return await worker(item)
+                finally:
+                    for _ in range(records(item)):
+                        METRICS.record_seconds.observe(
+                            time.monotonic() - started_at, scenario=metric_scenario
+                        )
+            return run
+
+        # Duplicate records are answered from the first record with the same content
+        unique_values, owners = group_duplicates(
+            input_values,
+            record_content if config.dedup_records else lambda request_body: None,
+        )
+        skipped_calls = len(input_values) - len(unique_values)
+
+        if scenario == ScenarioType.ENTITY_RECOGNITION.value and config.entity_packing:
+            # Short records share one model call; each pack keeps the input order
+            packs = pack_records(
+                unique_values, config.entity_pack_max_tokens, config.entity_pack_max_records
+            )
+            pack_values = await run_bounded(
+                packs,
+                timed(process_pack, records=len),
+                max_concurrency=config.max_concurrency,
+                timeout=config.timeout,
+                on_timeout=lambda pack: [timeout_response(request_body) for request_body in pack],
+                on_error=lambda pack, e: [error_response(request_body, e) for request_body in pack],
+                deadline=deadline,
+                on_deadline=lambda pack: [deadline_response(request_body) for request_body in pack],
+                item_records=len,
+                item_timeout=pack_timeout,
+            )
+            unique_responses = [
+                response for pack_responses in pack_values for response in pack_responses
+            ]
+        else:
+            # Records are sent to the model concurrently; results keep the input order
+            unique_responses = await run_bounded(
+                unique_values,
+                timed(process_record),
+                max_concurrency=config.max_concurrency,
+                timeout=config.timeout,
+                on_timeout=timeout_response,
+                on_error=error_response,
+                deadline=deadline,
+                on_deadline=deadline_response,
+                item_timeout=record_timeout,
+            )
+        response_values = fan_out(input_values, unique_responses, owners)
+        BUDGET_STATS.record(deadline, len(input_values))
+        METRICS.deduplicated.inc(skipped_calls, scenario=metric_scenario)
+        for response_body in response_values:
+            METRICS.records.inc(scenario=metric_scenario, outcome=record_outcome(response_body))
 
         processing_time = time.time() - start_time
         logger.info(
-            f"Processed {len(input_values)} records in {processing_time:.2f} seconds."
+            f"Processed {len(input_values)} records in {processing_time:.2f} seconds"
+            f" ({skipped_calls} duplicate records answered without a model call)."
         )
 
         return func.HttpResponse(
-            json.dumps({"values": response_values}), mimetype="application/json"
+            json.dumps({"values": response_values}),
+            mimetype="application/json",
+            headers={"deduplicated-records": str(skipped_calls)},
         )
 
     except CustomSkillException as e:
@@ -296,6 +974,7 @@ async def health_check(req: func.HttpRequest) -> func.HttpResponse:
     """Enhanced health check endpoint."""
     try:
         api_key, endpoint, deployment_name, api_version = validate_environment()
+        config = ModelConfig()
         
         response_body = {
             "status": "Healthy",
@@ -306,7 +985,15 @@ async def health_check(req: func.HttpRequest) -> func.HttpResponse:
                 "deployment": deployment_name,
                 "api_version": api_version,
                 "api_key_present": bool(api_key)  # Don't expose the actual key
-            }
+            },
+            "cache": RESPONSE_CACHE.describe(),
+            "rate_limiter": describe_schedulers(),
+            "deadline": BUDGET_STATS.describe(),
+            "routing": {
+                "fast_deployment": config.fast_deployment or None,
+                "latency_slo": config.latency_slo,
+                "latency": DEPLOYMENT_LATENCY.describe(config.latency_slo_window),
+            },
         }
         logger.info("Health check successful.")
         return func.HttpResponse(json.dumps(response_body), mimetype="application/json")
@@ -316,4 +1003,14 @@ async def health_check(req: func.HttpRequest) -> func.HttpResponse:
             json.dumps({"status": "Unhealthy", "error": str(e)}),
             mimetype="application/json",
             status_code=500
-        )
\ No newline at end of file
+        )
+
+
+@app.function_name(name="AOAIMetrics")
+@app.route(route="metrics", auth_level=func.AuthLevel.ANONYMOUS)
+async def prometheus_metrics(req: func.HttpRequest) -> func.HttpResponse:
+    """Prometheus metrics endpoint."""
+    body = METRICS.render(
+        schedulers=describe_schedulers(), cache=RESPONSE_CACHE.stats.as_dict()
+    )
+    return func.HttpResponse(body, mimetype="text/plain; version=0.0.4")
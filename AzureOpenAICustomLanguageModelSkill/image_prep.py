@@ -0,0 +1,135 @@
+import base64
+import binascii
+import io
+import json
+import logging
+from dataclasses import asdict, dataclass
+from typing import Any, List, Tuple
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+logger = logging.getLogger(__name__)
+
+# Formats the vision models accept as they are, so they can be sent without re-encoding
+PASSTHROUGH_FORMATS = {"JPEG", "PNG", "WEBP", "GIF"}
+OUTPUT_FORMATS = {"jpeg": ("JPEG", "image/jpeg"), "webp": ("WEBP", "image/webp")}
+
+
+class ImagePrepError(ValueError):
+    """The image payload cannot be decoded or is too large to process."""
+
+
+@dataclass
+class ImagePrepConfig:
+    # Images with more pixels than this are rejected before they are decoded
+    max_pixels: int = 50_000_000
+    # Vision models scale images to fit these bounds anyway, so anything larger
+    # only costs upload bytes and latency
+    max_long_side: int = 2048
+    max_short_side: int = 768
+    output_format: str = "jpeg"
+    quality: int = 85
+
+    def cache_material(self) -> str:
+        """The settings that shape the prepared image, for keys of cached answers."""
+        return json.dumps(asdict(self), sort_keys=True)
+
+
+@dataclass
+class PreparedImage:
+    data_url: str
+    content_type: str
+    width: int
+    height: int
+    original_bytes: int
+    encoded_bytes: int
+    reencoded: bool
+
+
+def target_size(width: int, height: int, max_long_side: int, max_short_side: int) -> Tuple[int, int]:
+    """Largest size with the same aspect ratio that fits both side limits."""
+    long_side, short_side = max(width, height), min(width, height)
+    scale = min(1.0, max_long_side / long_side, max_short_side / short_side)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def prepare_image(image_data: str, content_type: str, config: ImagePrepConfig) -> PreparedImage:
+    """Decode a base64 image once, downscale it and build the data URL sent to the model.
+
+    The image is only re-encoded (as config.output_format at config.quality)
+    when it has to be downscaled or is in a format the model does not take;
+    otherwise the original payload is reused for the data URL as it is.
+    """
+    try:
+        raw = base64.b64decode(image_data)
+    except (binascii.Error, ValueError):
+        raise ImagePrepError("Invalid base64 encoding")
+
+    try:
+        # Opening only reads the header, so the pixel limit is checked before decoding
+        image = Image.open(io.BytesIO(raw))
+    except (UnidentifiedImageError, Image.DecompressionBombError) as e:
+        raise ImagePrepError(f"Unsupported image: {e}")
+    if image.width * image.height > config.max_pixels:
+        raise ImagePrepError(
+            f"Image of {image.width}x{image.height} pixels exceeds the limit of {config.max_pixels} pixels"
+        )
+
+    width, height = target_size(image.width, image.height, config.max_long_side, config.max_short_side)
+    if (width, height) == image.size and image.format in PASSTHROUGH_FORMATS:
+        return PreparedImage(
+            data_url=f"data:{content_type};base64,{image_data}",
+            content_type=content_type,
+            width=width,
+            height=height,
+            original_bytes=len(raw),
+            encoded_bytes=len(raw),
+            reencoded=False,
+        )
+
+    pil_format, output_type = OUTPUT_FORMATS[config.output_format.lower()]
+    try:
+        # Lets the JPEG decoder scale by a power of two while decoding
+        image.draft("RGB", (width, height))
+        image = ImageOps.exif_transpose(image)
+        width, height = target_size(image.width, image.height, config.max_long_side, config.max_short_side)
+        if image.mode not in ("RGB", "RGBA") or (pil_format == "JPEG" and image.mode == "RGBA"):
+            image = image.convert("RGBA" if pil_format == "WEBP" and image.has_transparency_data else "RGB")
+        if (width, height) != image.size:
+            image = image.resize((width, height), Image.Resampling.LANCZOS, reducing_gap=3.0)
+        buffer = io.BytesIO()
+        image.save(buffer, format=pil_format, quality=config.quality)
+    except (OSError, ValueError) as e:
+        raise ImagePrepError(f"Failed to process image: {e}")
+
+    encoded = buffer.getbuffer()
+    logger.debug(f"Re-encoded image from {len(raw)} to {len(encoded)} bytes at {width}x{height}")
+    return PreparedImage(
+        data_url=f"data:{output_type};base64,{base64.b64encode(encoded).decode('ascii')}",
+        content_type=output_type,
+        width=width,
+        height=height,
+        original_bytes=len(raw),
+        encoded_bytes=len(encoded),
+        reencoded=True,
+    )
+
+
+def prepare_message_images(messages: List[Any], config: ImagePrepConfig) -> List[Any]:
+    """Replace the base64 data URLs of images in chat messages with prepared ones.
+
+    Runs after the cache lookup, so a cached answer does not pay for decoding
+    the image. Images passed by URL are left for the model service to fetch.
+    """
+    for message in messages:
+        content = message["content"]
+        if isinstance(content, str):
+            continue
+        for part in content:
+            url = part["image_url"]["url"] if part.get("type") == "image_url" else ""
+            if not url.startswith("data:"):
+                continue
+            header, _, image_data = url.partition(",")
+            content_type = header[len("data:"):].split(";")[0]
+            part["image_url"]["url"] = prepare_image(image_data, content_type, config).data_url
+    return messages
@@ -0,0 +1,91 @@
+import math
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+# Why a record went to the deployment it did
+SINGLE_DEPLOYMENT = "single-deployment"
+SHORT_INPUT = "short-input"
+LONG_INPUT = "long-input"
+LATENCY_SLO = "latency-slo"
+
+
+@dataclass(frozen=True)
+class Route:
+    deployment: str
+    reason: str
+
+
+@dataclass
+class RoutingPolicy:
+    deployment: str
+    # Faster, cheaper deployment for short inputs; None sends everything to deployment
+    fast_deployment: Optional[str] = None
+    fast_max_tokens: int = 500
+    # p95 latency in seconds of the large deployment above which long inputs
+    # go to the fast deployment too; 0 disables the check
+    latency_slo: float = 0.0
+    slo_window: float = 60.0
+    slo_min_samples: int = 20
+
+
+class LatencyWindow:
+    """Recent call latencies per deployment, with the time they were observed.
+
+    Samples older than the window a percentile is asked for are left out, so
+    a deployment that gets no traffic has no percentile once its samples age
+    out.
+    """
+
+    def __init__(self, max_samples: int = 1000):
+        self.max_samples = max_samples
+        self._samples: Dict[str, Deque[Tuple[float, float]]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, deployment: str, seconds: float, now: Optional[float] = None) -> None:
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            samples = self._samples.setdefault(deployment, deque(maxlen=self.max_samples))
+            samples.append((now, seconds))
+
+    def recent(self, deployment: str, window: float, now: Optional[float] = None) -> List[float]:
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            return [seconds for at, seconds in self._samples.get(deployment, ()) if now - at <= window]
+
+    def percentile(self, deployment: str, q: float, window: float, min_samples: int = 1,
+                   now: Optional[float] = None) -> Optional[float]:
+        samples = sorted(self.recent(deployment, window, now))
+        if not samples or len(samples) < min_samples:
+            return None
+        return samples[min(len(samples) - 1, max(0, math.ceil(q / 100 * len(samples)) - 1))]
+
+    def describe(self, window: float) -> Dict[str, Any]:
+        result = {}
+        for deployment in list(self._samples):
+            p95 = self.percentile(deployment, 95, window)
+            result[deployment] = {
+                "samples": len(self.recent(deployment, window)),
+                "p95_seconds": round(p95, 4) if p95 is not None else None,
+            }
+        return result
+
+
+def choose_route(policy: RoutingPolicy, estimated_tokens: int, latencies: LatencyWindow) -> Route:
+    """Pick the deployment for a model call of estimated_tokens input tokens.
+
+    Short inputs go to the fast deployment. Long inputs go to the large one,
+    unless its recent p95 latency is above the SLO, in which case they are
+    moved to the fast deployment until the slow samples age out of the window.
+    """
+    if not policy.fast_deployment or policy.fast_deployment == policy.deployment:
+        return Route(policy.deployment, SINGLE_DEPLOYMENT)
+    if estimated_tokens <= policy.fast_max_tokens:
+        return Route(policy.fast_deployment, SHORT_INPUT)
+    if policy.latency_slo > 0:
+        p95 = latencies.percentile(policy.deployment, 95, policy.slo_window, policy.slo_min_samples)
+        if p95 is not None and p95 > policy.latency_slo:
+            return Route(policy.fast_deployment, LATENCY_SLO)
+    return Route(policy.deployment, LONG_INPUT)
@@ -0,0 +1,243 @@
+import asyncio
+import email.utils
+import logging
+import random
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, Mapping, Optional, Tuple, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class RetryableError(Exception):
+    """A model call failed in a way that is worth retrying (throttling or a transient server error)."""
+
+    def __init__(self, message: str, status_code: Optional[int] = None,
+                 retry_after: Optional[float] = None):
+        self.message = message
+        self.status_code = status_code
+        self.retry_after = retry_after
+        super().__init__(self.message)
+
+    @property
+    def throttled(self) -> bool:
+        return self.status_code == 429
+
+
+def parse_retry_after(headers: Optional[Mapping[str, str]]) -> Optional[float]:
+    """Seconds to wait according to the retry-after-ms or retry-after response headers."""
+    if not headers:
+        return None
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return max(0.0, float(retry_after_ms) / 1000)
+        except ValueError:
+            pass
+    retry_after = headers.get("retry-after")
+    if not retry_after:
+        return None
+    try:
+        return max(0.0, float(retry_after))
+    except ValueError:
+        pass
+    try:
+        # retry-after may also be an HTTP date
+        retry_at = email.utils.parsedate_to_datetime(retry_after)
+        return max(0.0, retry_at.timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """Refills continuously at rate_per_minute, holding at most one minute of budget."""
+
+    def __init__(self, rate_per_minute: float):
+        self.capacity = float(rate_per_minute)
+        self.rate_per_second = rate_per_minute / 60
+        self.available = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.available = min(self.capacity, self.available + (now - self._updated) * self.rate_per_second)
+        self._updated = now
+
+    async def acquire(self, amount: float) -> None:
+        # A single request larger than the bucket must still be able to go once it is full
+        amount = min(float(amount), self.capacity)
+        while True:
+            self._refill()
+            if self.available >= amount:
+                self.available -= amount
+                return
+            await asyncio.sleep((amount - self.available) / self.rate_per_second)
+
+    def adjust(self, amount: float) -> None:
+        """Charge (or refund, when negative) the difference between estimated and actual use."""
+        self._refill()
+        self.available = min(self.capacity, self.available - amount)
+
+
+class AdaptiveConcurrency:
+    """Concurrency limit tuned additive-increase / multiplicative-decrease.
+
+    Every success raises the limit by 1/limit (about +1 per round of calls);
+    a throttled call halves it, at most once per cooldown so that one burst of
+    429s does not collapse the limit to the minimum.
+    """
+
+    def __init__(self, initial: int, minimum: int, maximum: int,
+                 decrease_factor: float = 0.5, cooldown: float = 1.0):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.limit = float(min(max(initial, self.minimum), self.maximum))
+        self.decrease_factor = decrease_factor
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        self._condition = asyncio.Condition()
+
+    async def acquire(self) -> None:
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    async def release(self) -> None:
+        async with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    def on_success(self) -> None:
+        self.limit = min(float(self.maximum), self.limit + 1 / self.limit)
+
+    def on_throttle(self) -> None:
+        now = time.monotonic()
+        if now - self._last_decrease < self.cooldown:
+            return
+        self._last_decrease = now
+        self.limit = max(float(self.minimum), self.limit * self.decrease_factor)
+
+
+@dataclass
+class RateLimitConfig:
+    requests_per_minute: int = 0  # 0 disables the limit
+    tokens_per_minute: int = 0  # 0 disables the limit
+    retry_attempts: int = 3
+    retry_delay: float = 0.5
+    max_retry_delay: float = 30.0
+    initial_concurrency: int = 10
+    max_concurrency: int = 50
+
+
+@dataclass
+class SchedulerStats:
+    calls: int = 0
+    retries: int = 0
+    throttled: int = 0
+    failures: int = 0
+
+
+@dataclass
+class ModelScheduler:
+    """Admits model calls against request and token budgets and retries them with backoff."""
+
+    config: RateLimitConfig
+    stats: SchedulerStats = field(default_factory=SchedulerStats)
+
+    def __post_init__(self):
+        self.requests = TokenBucket(self.config.requests_per_minute) if self.config.requests_per_minute else None
+        self.tokens = TokenBucket(self.config.tokens_per_minute) if self.config.tokens_per_minute else None
+        self.concurrency = AdaptiveConcurrency(
+            initial=self.config.initial_concurrency,
+            minimum=1,
+            maximum=self.config.max_concurrency,
+        )
+        self._resume_at = 0.0
+
+    def backoff_delay(self, attempt: int) -> float:
+        """Exponential backoff with equal jitter for the given (zero based) retry attempt."""
+        delay = min(self.config.max_retry_delay, self.config.retry_delay * (2 ** attempt))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    async def _admit(self, estimated_tokens: int) -> None:
+        # A retry-after from the service pauses every caller, not just the throttled one
+        pause = self._resume_at - time.monotonic()
+        if pause > 0:
+            await asyncio.sleep(pause)
+        if self.requests is not None:
+            await self.requests.acquire(1)
+        if self.tokens is not None and estimated_tokens:
+            await self.tokens.acquire(estimated_tokens)
+        await self.concurrency.acquire()
+
+    async def run(self, call: Callable[[], Awaitable[T]], estimated_tokens: int = 0) -> T:
+        """Run call once admitted, retrying RetryableError up to retry_attempts times."""
+        attempt = 0
+        while True:
+            await self._admit(estimated_tokens)
+            self.stats.calls += 1
+            try:
+                result = await call()
+            except RetryableError as e:
+                if e.throttled:
+                    self.stats.throttled += 1
+                    self.concurrency.on_throttle()
+                if attempt >= self.config.retry_attempts:
+                    self.stats.failures += 1
+                    raise
+                if e.retry_after is not None:
+                    delay = e.retry_after + random.uniform(0, self.config.retry_delay)
+                    self._resume_at = max(self._resume_at, time.monotonic() + e.retry_after)
+                else:
+                    delay = self.backoff_delay(attempt)
+                logger.warning(f"Retrying model call in {delay:.2f}s after {e.status_code or 'error'}: {e.message}")
+            else:
+                self.concurrency.on_success()
+                return result
+            finally:
+                await self.concurrency.release()
+            attempt += 1
+            self.stats.retries += 1
+            await asyncio.sleep(delay)
+
+    def record_usage(self, estimated_tokens: int, actual_tokens: Optional[int]) -> None:
+        """Correct the token budget once the service reports how many tokens a call used.
+
+        estimated_tokens is what the call was admitted with, its prompt estimate plus
+        its max_tokens completion budget, and actual_tokens the total_tokens it used,
+        so the unused part of the completion budget is refunded.
+        """
+        if self.tokens is not None and actual_tokens is not None:
+            self.tokens.adjust(actual_tokens - estimated_tokens)
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "concurrency_limit": round(self.concurrency.limit, 2),
+            "in_flight": self.concurrency.in_flight,
+            "calls": self.stats.calls,
+            "retries": self.stats.retries,
+            "throttled": self.stats.throttled,
+            "failures": self.stats.failures,
+        }
+
+
+# One scheduler per model endpoint, shared by every invocation on this worker
+_schedulers: Dict[str, Tuple[ModelScheduler, asyncio.AbstractEventLoop]] = {}
+
+
+def get_scheduler(name: str, config: RateLimitConfig) -> ModelScheduler:
+    """Return the process-wide scheduler for a model endpoint, creating it on first use."""
+    loop = asyncio.get_running_loop()
+    entry = _schedulers.get(name)
+    # asyncio primitives are bound to one loop, so a new loop gets a new scheduler
+    if entry is None or entry[1] is not loop:
+        entry = (ModelScheduler(config), loop)
+        _schedulers[name] = entry
+    return entry[0]
+
+
+def describe_schedulers() -> Dict[str, Any]:
+    return {name: scheduler.describe() for name, (scheduler, _) in _schedulers.items()}
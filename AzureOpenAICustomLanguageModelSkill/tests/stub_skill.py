@@ -0,0 +1,107 @@
+"""Test case that runs the skill's HTTP handler against a local stub model endpoint."""
+import asyncio
+import importlib
+import json
+import os
+import unittest
+from typing import Any, Dict, List, Optional, Tuple, Union
+from unittest import mock
+
+import azure.functions as func
+
+from benchmarks.stub_server import LatencyModel, StubModelServer
+from client_registry import close_all
+from response_cache import ResponseCache
+
+
+def skill_request(records: List[Union[str, Dict[str, Any]]], scenario: str,
+                  headers: Optional[Dict[str, str]] = None) -> func.HttpRequest:
+    """A skillset request with one record per text (or data dict), numbered from 0."""
+    values = [
+        {"recordId": str(index), "data": {"text": record} if isinstance(record, str) else record}
+        for index, record in enumerate(records)
+    ]
+    return func.HttpRequest(
+        "POST", "/api/custom_skill",
+        headers={"scenario": scenario, **(headers or {})},
+        body=json.dumps({"values": values}).encode("utf-8"),
+    )
+
+
+class StubSkillTestCase(unittest.IsolatedAsyncioTestCase):
+    """Calls the custom_skill handler with every model call answered by a stub endpoint.
+
+    Each call is recorded in self.calls as (path, request body) and then passed to
+    answer(), which tests override to delay or fail a call (by raising an aiohttp
+    HTTP exception) or to return the answer content. Calls that should hang can
+    wait on self.release, which is set before the stub stops.
+    """
+
+    # Response cache mode of the tests, canonical so answers are cached at any temperature
+    cache_mode = "canonical"
+
+    async def asyncSetUp(self):
+        self.calls: List[Tuple[str, Dict[str, Any]]] = []
+        self.release = asyncio.Event()
+        self.stub = StubModelServer(LatencyModel(0), responder=self.respond)
+        url = await self.stub.start(port=0)
+        self.set_environment(
+            AZURE_CHAT_COMPLETION_ENDPOINT=url,
+            AZURE_INFERENCE_CREDENTIAL="test-key",
+            AZURE_OPENAI_DEPLOYMENT="large",
+            RESPONSE_CACHE_MODE=self.cache_mode,
+        )
+        self.function_app = importlib.import_module("function_app")
+        # A fresh cache per test, so answers are not shared between tests
+        cache = mock.patch.object(self.function_app, "RESPONSE_CACHE", ResponseCache.from_env())
+        cache.start()
+        self.addCleanup(cache.stop)
+        self.handler = self.function_app.custom_skill.build().get_user_function()
+
+    async def asyncTearDown(self):
+        self.release.set()
+        await close_all()
+        await self.stub.stop()
+
+    def set_environment(self, **values: str) -> None:
+        patcher = mock.patch.dict(os.environ, values)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def respond(self, path: str, body: Dict[str, Any]) -> Optional[str]:
+        self.calls.append((path, body))
+        return await self.answer(path, body)
+
+    async def answer(self, path: str, body: Dict[str, Any]) -> Optional[str]:
+        return None
+
+    async def run_skill(self, records: List[Union[str, Dict[str, Any]]], scenario: str,
+                        headers: Optional[Dict[str, str]] = None) -> Tuple[func.HttpResponse, List[Dict[str, Any]]]:
+        """The response to a request with these records, and its output values."""
+        response = await self.handler(skill_request(records, scenario, headers))
+        return response, json.loads(response.get_body()).get("values")
+
+
+def system_prompt(body: Dict[str, Any]) -> str:
+    """Text of the system message of a recorded model call."""
+    content = body["messages"][0]["content"]
+    if isinstance(content, str):
+        return content
+    return " ".join(part.get("text") or "" for part in content)
+
+
+def user_text(body: Dict[str, Any]) -> str:
+    """Text of the last message of a recorded model call."""
+    content = body["messages"][-1]["content"]
+    if isinstance(content, str):
+        return content
+    return " ".join(part.get("text") or "" for part in content if isinstance(part, dict))
+
+
+def packed_records(body: Dict[str, Any]) -> Optional[List[Dict[str, Any]]]:
+    """The records of a recorded packed call, or None for a call about a single record."""
+    try:
+        records = json.loads(user_text(body))
+    except ValueError:
+        return None
+    return records if isinstance(records, list) else None
@@ -0,0 +1,110 @@
+import asyncio
+import unittest
+
+from chunked_summary import group_by_tokens, map_reduce_summarize, summary_call_rounds
+from tokens import estimate_tokens, split_by_tokens
+
+LONG_TEXT = " ".join(f"Sentence {i} is about Contoso." for i in range(400))
+
+
+class TestSplitByTokens(unittest.TestCase):
+    def test_short_text_is_a_single_chunk(self):
+        self.assertEqual(split_by_tokens("A short text.", 100, 10), ["A short text."])
+
+    def test_chunks_respect_size_and_cover_the_text(self):
+        chunks = split_by_tokens(LONG_TEXT, chunk_tokens=100, overlap_tokens=20)
+        self.assertGreater(len(chunks), 1)
+        for chunk in chunks:
+            self.assertLessEqual(estimate_tokens(chunk), 100)
+            self.assertIn(chunk, LONG_TEXT)
+        self.assertTrue(LONG_TEXT.startswith(chunks[0]))
+        self.assertTrue(LONG_TEXT.endswith(chunks[-1]))
+
+    def test_consecutive_chunks_overlap(self):
+        chunks = split_by_tokens(LONG_TEXT, chunk_tokens=100, overlap_tokens=20)
+        for previous, current in zip(chunks, chunks[1:]):
+            head = current[:20]
+            self.assertIn(head, previous)
+
+    def test_overlap_must_be_smaller_than_chunk(self):
+        with self.assertRaises(ValueError):
+            split_by_tokens(LONG_TEXT, chunk_tokens=10, overlap_tokens=10)
+
+
+class TestMapReduceSummarize(unittest.IsolatedAsyncioTestCase):
+    async def test_short_text_uses_a_single_call(self):
+        calls = []
+
+        async def summarize(text):
+            calls.append(text)
+            return "summary"
+
+        async def combine(summaries):
+            raise AssertionError("combine should not be called")
+
+        result = await map_reduce_summarize("Short text.", summarize, combine, 100, 10, 4)
+        self.assertEqual((result, calls), ("summary", ["Short text."]))
+
+    async def test_chunks_are_summarized_concurrently_then_combined(self):
+        in_flight = 0
+        peak = 0
+
+        async def summarize(chunk):
+            nonlocal in_flight, peak
+            in_flight += 1
+            peak = max(peak, in_flight)
+            await asyncio.sleep(0.01)
+            in_flight -= 1
+            return f"part {len(chunk)}"
+
+        combined = []
+
+        async def combine(summaries):
+            combined.append(list(summaries))
+            return "whole document"
+
+        result = await map_reduce_summarize(LONG_TEXT, summarize, combine, 100, 20, fan_out=3)
+        self.assertEqual(result, "whole document")
+        self.assertEqual(peak, 3)
+        self.assertEqual(len(combined), 1)
+        self.assertEqual(len(combined[0]), len(split_by_tokens(LONG_TEXT, 100, 20)))
+
+    async def test_reduce_runs_in_rounds_when_summaries_do_not_fit(self):
+        rounds = []
+
+        async def summarize(chunk):
+            return "word " * 30
+
+        async def combine(summaries):
+            rounds.append(len(summaries))
+            return "word " * 30
+
+        await map_reduce_summarize(LONG_TEXT, summarize, combine, 100, 20, fan_out=4)
+        self.assertGreater(len(rounds), 1)
+
+    async def test_summaries_that_do_not_pair_up_are_truncated_to_fit(self):
+        combined = []
+
+        async def summarize(chunk):
+            return "word " * 80
+
+        async def combine(summaries):
+            combined.append(sum(estimate_tokens(summary) for summary in summaries))
+            return "word " * 80
+
+        await map_reduce_summarize(LONG_TEXT, summarize, combine, 100, 20, fan_out=4)
+        self.assertTrue(combined)
+        self.assertLessEqual(max(combined), 100)
+
+    def test_summary_call_rounds(self):
+        self.assertEqual(summary_call_rounds(2, 4), 2)
+        # 3 map rounds, then 5, 3, 2 and 1 summaries combined in 2 + 1 + 1 + 1 rounds
+        self.assertEqual(summary_call_rounds(10, 4), 8)
+
+    def test_group_by_tokens(self):
+        groups = group_by_tokens(["one two", "three four", "five six"], max_tokens=4)
+        self.assertEqual(groups, [["one two", "three four"], ["five six"]])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,27 @@
+import unittest
+
+from client_registry import close_all, get_client
+
+
+class TestClientRegistry(unittest.IsolatedAsyncioTestCase):
+    async def asyncTearDown(self):
+        await close_all()
+
+    async def test_client_is_reused_for_same_endpoint_and_key(self):
+        first = get_client("https://example.openai.azure.com", "key-1", "2024-08-01-preview", 10, 30)
+        second = get_client("https://example.openai.azure.com", "key-1", "2024-08-01-preview", 10, 30)
+        self.assertIs(first, second)
+
+    async def test_separate_clients_per_credential(self):
+        first = get_client("https://example.openai.azure.com", "key-1", "2024-08-01-preview", 10, 30)
+        second = get_client("https://example.openai.azure.com", "key-2", "2024-08-01-preview", 10, 30)
+        self.assertIsNot(first, second)
+
+    async def test_close_all_closes_clients(self):
+        client = get_client("https://example.openai.azure.com", "key-1", "2024-08-01-preview", 10, 30)
+        await close_all()
+        self.assertTrue(client.is_closed())
+
+
+if __name__ == "__main__":
+    unittest.main()
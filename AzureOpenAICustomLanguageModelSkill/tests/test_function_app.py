@@ -0,0 +1,235 @@
+import asyncio
+import json
+import unittest
+from unittest import mock
+
+from aiohttp import web
+
+from model_routing import LatencyWindow
+from tests.stub_skill import StubSkillTestCase, packed_records, skill_request
+
+LONG_TEXT = " ".join(f"Sentence {index} of a long report about Contoso." for index in range(60))
+TITLES = ["Contoso, Ltd. opens in Seattle", "Fabrikam moves to Redmond", "Northwind hires in Tokyo"]
+PACKED_ENTITY = {"name": "Contoso, Ltd.", "type": "ORGANIZATION", "confidence": 0.8}
+# What the stub answers for a single record
+STUB_ENTITY = {"name": "stub name", "type": "stub type", "confidence": 0.9}
+
+
+def answer_fields(body):
+    """Fields of the structured output a recorded model call asks for."""
+    return set(body["response_format"]["json_schema"]["schema"]["properties"])
+
+
+class TestSummaryChunking(StubSkillTestCase):
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        self.set_environment(SUMMARY_CHUNK_TOKENS="50", SUMMARY_CHUNK_OVERLAP_TOKENS="0", SUMMARY_FAN_OUT="2")
+        self.in_flight = 0
+        self.most_in_flight = 0
+
+    async def answer(self, path, body):
+        self.in_flight += 1
+        self.most_in_flight = max(self.most_in_flight, self.in_flight)
+        await asyncio.sleep(0.01)
+        self.in_flight -= 1
+        return None
+
+    async def test_long_texts_are_summarized_in_one_call_by_default(self):
+        _, values = await self.run_skill([LONG_TEXT], "summarization")
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(values[0]["errors"], [])
+
+    async def test_summary_and_entity_calls_of_a_record_share_the_fan_out(self):
+        self.set_environment(SUMMARY_CHUNKING="true")
+        _, values = await self.run_skill([LONG_TEXT], "summarization,entity-recognition")
+        self.assertEqual(values[0]["errors"], [])
+        self.assertEqual(values[0]["data"]["generative-summary"], "stub summary")
+        self.assertGreater(len(self.calls), 10)
+        self.assertEqual(self.most_in_flight, 2)
+
+
+class TestEntityPacking(StubSkillTestCase):
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        self.set_environment(ENTITY_PACKING="true")
+        # recordIds the packed answer has an entry for, by default every record once
+        self.answered = None
+        self.fail_pack = False
+
+    async def answer(self, path, body):
+        records = packed_records(body)
+        if records is None:
+            return None
+        if self.fail_pack:
+            raise web.HTTPBadRequest()
+        record_ids = self.answered if self.answered is not None else [r["recordId"] for r in records]
+        return json.dumps({"records": [
+            {"recordId": record_id, "entities": [PACKED_ENTITY]} for record_id in record_ids
+        ]})
+
+    async def test_packed_records_get_their_own_entities(self):
+        _, values = await self.run_skill(TITLES, "entity-recognition")
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual([value["recordId"] for value in values], ["0", "1", "2"])
+        for value in values:
+            self.assertEqual(value["data"]["entities"], [PACKED_ENTITY])
+
+    async def test_records_missing_or_repeated_in_the_answer_fall_back(self):
+        self.answered = ["0", "1", "1", "unknown"]
+        _, values = await self.run_skill(TITLES, "entity-recognition")
+        packed = [body for _, body in self.calls if packed_records(body) is not None]
+        self.assertEqual(len(packed), 1)
+        self.assertEqual(len(self.calls), 3)
+        self.assertEqual([value["recordId"] for value in values], ["0", "1", "2"])
+        self.assertEqual(values[0]["data"]["entities"], [PACKED_ENTITY])
+        self.assertEqual(values[1]["data"]["entities"], [STUB_ENTITY])
+        self.assertEqual(values[2]["data"]["entities"], [STUB_ENTITY])
+
+    async def test_a_failed_pack_falls_back_to_a_call_per_record(self):
+        self.fail_pack = True
+        _, values = await self.run_skill(TITLES, "entity-recognition")
+        self.assertEqual(len(self.calls), 4)
+        self.assertEqual([value["recordId"] for value in values], ["0", "1", "2"])
+        for value in values:
+            self.assertEqual(value["errors"], [])
+            self.assertEqual(value["data"]["entities"], [STUB_ENTITY])
+
+    async def test_packed_answers_are_cached_per_record(self):
+        await self.run_skill(TITLES, "entity-recognition")
+        _, values = await self.run_skill([TITLES[2], TITLES[0]], "entity-recognition")
+        _, single = await self.run_skill([TITLES[1]], "entity-recognition")
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(values[1]["data"]["entities"], [PACKED_ENTITY])
+        self.assertEqual(single[0]["data"]["entities"], [PACKED_ENTITY])
+
+
+class TestDuplicateRecords(StubSkillTestCase):
+    # Without the cache, only deduplication can save the calls
+    cache_mode = "off"
+
+    async def test_duplicate_records_share_one_model_call(self):
+        response, values = await self.run_skill(
+            [TITLES[0], TITLES[1], TITLES[0], TITLES[0]], "entity-recognition")
+        self.assertEqual(len(self.calls), 2)
+        self.assertEqual([value["recordId"] for value in values], ["0", "1", "2", "3"])
+        self.assertEqual(values[2]["data"], values[0]["data"])
+        self.assertEqual(values[3]["data"], values[0]["data"])
+        self.assertEqual(response.headers["deduplicated-records"], "2")
+
+    async def test_duplicates_are_called_separately_when_deduplication_is_off(self):
+        self.set_environment(DEDUP_RECORDS="false")
+        response, values = await self.run_skill([TITLES[0], TITLES[0]], "entity-recognition")
+        self.assertEqual(len(self.calls), 2)
+        self.assertEqual([value["recordId"] for value in values], ["0", "1"])
+        self.assertEqual(response.headers["deduplicated-records"], "0")
+
+
+class TestCombinedScenarios(StubSkillTestCase):
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        self.set_environment(SUMMARY_CHUNK_TOKENS="50", SUMMARY_CHUNK_OVERLAP_TOKENS="0")
+        self.entity_calls = 0
+        self.fail_entities = False
+
+    async def answer(self, path, body):
+        if answer_fields(body) != {"entities"}:
+            return None
+        if self.fail_entities:
+            raise web.HTTPBadRequest()
+        # Every chunk names Contoso, spelled and scored differently, and an entity of its own
+        self.entity_calls += 1
+        call = self.entity_calls
+        return json.dumps({"entities": [
+            {"name": "Contoso" if call % 2 else " contoso", "type": "ORGANIZATION", "confidence": 0.5 + call / 100},
+            {"name": f"Chunk {call}", "type": "MISC", "confidence": 0.7},
+        ]})
+
+    async def test_one_call_answers_both_scenarios(self):
+        response, values = await self.run_skill(TITLES[:2], "entity-recognition, summarization")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(self.calls), 2)
+        for _, body in self.calls:
+            self.assertEqual(answer_fields(body), {"summary", "entities"})
+        self.assertEqual([value["recordId"] for value in values], ["0", "1"])
+        for value in values:
+            self.assertEqual(value["errors"], [])
+            self.assertEqual(value["data"]["generative-summary"], "stub summary")
+            self.assertEqual(value["data"]["entities"], [STUB_ENTITY])
+
+    async def test_entities_of_long_texts_are_merged_across_chunks(self):
+        self.set_environment(SUMMARY_CHUNKING="true")
+        _, values = await self.run_skill([LONG_TEXT], "summarization,entity-recognition")
+        self.assertGreater(self.entity_calls, 2)
+        self.assertEqual(values[0]["errors"], [])
+        self.assertEqual(values[0]["data"]["generative-summary"], "stub summary")
+        entities = values[0]["data"]["entities"]
+        contoso = [e for e in entities if e["name"].strip().casefold() == "contoso"]
+        self.assertEqual(len(contoso), 1)
+        self.assertEqual(contoso[0]["confidence"], 0.5 + self.entity_calls / 100)
+        self.assertEqual(sorted(e["name"] for e in entities if e["type"] == "MISC"),
+                         sorted(f"Chunk {call}" for call in range(1, self.entity_calls + 1)))
+
+    async def test_failed_entity_extraction_keeps_the_summary_with_a_warning(self):
+        self.set_environment(SUMMARY_CHUNKING="true")
+        self.fail_entities = True
+        _, values = await self.run_skill([LONG_TEXT], "summarization,entity-recognition")
+        self.assertEqual(values[0]["errors"], [])
+        self.assertEqual(values[0]["data"]["generative-summary"], "stub summary")
+        self.assertEqual(values[0]["data"]["entities"], [])
+        self.assertEqual(len(values[0]["warnings"]), 1)
+        self.assertTrue(values[0]["warnings"][0].startswith("Entity extraction failed"))
+
+        # The incomplete answer is not cached
+        calls = len(self.calls)
+        self.fail_entities = False
+        _, values = await self.run_skill([LONG_TEXT], "summarization,entity-recognition")
+        self.assertGreater(len(self.calls), calls)
+        self.assertNotEqual(values[0]["data"]["entities"], [])
+        self.assertIsNone(values[0]["warnings"])
+
+    async def test_image_captioning_cannot_be_combined(self):
+        response = await self.handler(skill_request(TITLES[:1], "summarization,image-captioning"))
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("image-captioning cannot be combined", response.get_body().decode("utf-8"))
+        self.assertEqual(self.calls, [])
+
+
+class TestLatencySlo(StubSkillTestCase):
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        self.set_environment(
+            AZURE_OPENAI_FAST_DEPLOYMENT="fast",
+            ROUTE_FAST_MAX_TOKENS="1",
+            LATENCY_SLO_SECONDS="0.2",
+            MAX_CONCURRENT_REQUESTS="30",
+            DEADLINE_MARGIN_SECONDS="0",
+        )
+        window = mock.patch.object(self.function_app, "DEPLOYMENT_LATENCY", LatencyWindow())
+        window.start()
+        self.addCleanup(window.stop)
+
+    async def answer(self, path, body):
+        if "/deployments/large/" in path:
+            # The main deployment stalls well past the deadline; the odd call the
+            # HTTP client fails to cancel in time still gets an answer
+            try:
+                await asyncio.wait_for(self.release.wait(), timeout=1)
+            except TimeoutError:
+                pass
+        return None
+
+    async def test_long_inputs_move_to_the_fast_deployment_after_the_large_one_times_out(self):
+        texts = [f"Quarterly report {index} of Contoso" for index in range(20)]
+        _, values = await self.run_skill(texts, "summarization", headers={"deadline-seconds": "0.3"})
+        self.assertTrue(any(self.function_app.DEADLINE_WARNING in (value["warnings"] or []) for value in values))
+        self.assertGreater(self.function_app.DEPLOYMENT_LATENCY.percentile("large", 95, window=60), 0.2)
+
+        _, values = await self.run_skill(["Annual report of Contoso"], "summarization")
+        self.assertEqual(values[0]["errors"], [])
+        self.assertEqual(values[0]["data"]["generative-summary"], "stub summary")
+        self.assertEqual(values[0]["warnings"], [self.function_app.SLO_ROUTE_WARNING.format(deployment="fast")])
+        self.assertIn("/deployments/fast/", self.calls[-1][0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,96 @@
+import base64
+import io
+import unittest
+
+from PIL import Image
+
+from image_prep import ImagePrepConfig, ImagePrepError, prepare_image, prepare_message_images, target_size
+
+
+def encoded_image(size, format="JPEG", mode="RGB"):
+    buffer = io.BytesIO()
+    Image.new(mode, size, color="red" if mode != "RGBA" else (255, 0, 0, 128)).save(buffer, format=format)
+    return base64.b64encode(buffer.getvalue()).decode("ascii")
+
+
+def decoded(data_url):
+    return Image.open(io.BytesIO(base64.b64decode(data_url.split(",", 1)[1])))
+
+
+class TestTargetSize(unittest.TestCase):
+    def test_small_images_are_kept(self):
+        self.assertEqual(target_size(640, 480, 2048, 768), (640, 480))
+
+    def test_short_side_limit(self):
+        self.assertEqual(target_size(4000, 3000, 2048, 768), (1024, 768))
+
+    def test_long_side_limit(self):
+        self.assertEqual(target_size(8000, 1000, 2048, 768), (2048, 256))
+
+
+class TestPrepareImage(unittest.TestCase):
+    def test_small_image_reuses_the_original_payload(self):
+        data = encoded_image((320, 200))
+        prepared = prepare_image(data, "image/jpeg", ImagePrepConfig())
+        self.assertFalse(prepared.reencoded)
+        self.assertEqual(prepared.data_url, f"data:image/jpeg;base64,{data}")
+
+    def test_large_image_is_downscaled_and_reencoded(self):
+        data = encoded_image((3000, 2000), format="PNG")
+        prepared = prepare_image(data, "image/png", ImagePrepConfig(output_format="webp", quality=70))
+        self.assertTrue(prepared.reencoded)
+        self.assertTrue(prepared.data_url.startswith("data:image/webp;base64,"))
+        self.assertEqual((prepared.width, prepared.height), (1152, 768))
+        self.assertLess(prepared.encoded_bytes, prepared.original_bytes)
+        image = decoded(prepared.data_url)
+        self.assertEqual((image.format, image.size), ("WEBP", (1152, 768)))
+
+    def test_transparent_image_is_flattened_for_jpeg(self):
+        data = encoded_image((2000, 1000), format="PNG", mode="RGBA")
+        prepared = prepare_image(data, "image/png", ImagePrepConfig())
+        image = decoded(prepared.data_url)
+        self.assertEqual((image.format, image.mode), ("JPEG", "RGB"))
+
+    def test_unsupported_format_is_reencoded(self):
+        data = encoded_image((100, 100), format="BMP")
+        prepared = prepare_image(data, "image/bmp", ImagePrepConfig())
+        self.assertTrue(prepared.reencoded)
+        self.assertEqual(prepared.content_type, "image/jpeg")
+
+    def test_pixel_limit(self):
+        data = encoded_image((1000, 1000))
+        with self.assertRaises(ImagePrepError):
+            prepare_image(data, "image/jpeg", ImagePrepConfig(max_pixels=500_000))
+
+    def test_invalid_payloads(self):
+        with self.assertRaises(ImagePrepError):
+            prepare_image("not base64!", "image/jpeg", ImagePrepConfig())
+        with self.assertRaises(ImagePrepError):
+            prepare_image(base64.b64encode(b"not an image").decode("ascii"), "image/jpeg", ImagePrepConfig())
+
+    def test_cache_material_changes_with_the_settings(self):
+        self.assertEqual(ImagePrepConfig().cache_material(), ImagePrepConfig().cache_material())
+        self.assertNotEqual(ImagePrepConfig().cache_material(), ImagePrepConfig(quality=70).cache_material())
+
+
+class TestPrepareMessageImages(unittest.TestCase):
+    def test_data_urls_are_prepared_and_other_parts_kept(self):
+        data = encoded_image((3000, 2000), format="PNG")
+        messages = [
+            {"role": "system", "content": "Describe images."},
+            {"role": "user", "content": [
+                {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{data}"}},
+                {"type": "image_url", "image_url": {"url": "https://contoso.com/image.png"}},
+                {"type": "text", "text": "Describe this image."},
+            ]},
+        ]
+        prepare_message_images(messages, ImagePrepConfig())
+        parts = messages[1]["content"]
+        self.assertTrue(parts[0]["image_url"]["url"].startswith("data:image/jpeg;base64,"))
+        self.assertEqual(decoded(parts[0]["image_url"]["url"]).size, (1152, 768))
+        self.assertEqual(parts[1]["image_url"]["url"], "https://contoso.com/image.png")
+        self.assertEqual(parts[2]["text"], "Describe this image.")
+
+
+if __name__ == "__main__":
+    unittest.main()
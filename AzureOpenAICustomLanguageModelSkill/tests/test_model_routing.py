@@ -0,0 +1,72 @@
+import unittest
+
+from model_routing import (
+    LATENCY_SLO,
+    LONG_INPUT,
+    SHORT_INPUT,
+    SINGLE_DEPLOYMENT,
+    LatencyWindow,
+    Route,
+    RoutingPolicy,
+    choose_route,
+)
+
+
+def policy(**overrides):
+    values = dict(deployment="gpt-4o", fast_deployment="gpt-4o-mini", fast_max_tokens=500,
+                  latency_slo=2.0, slo_window=60.0, slo_min_samples=5)
+    values.update(overrides)
+    return RoutingPolicy(**values)
+
+
+class TestLatencyWindow(unittest.TestCase):
+    def test_percentile_of_recent_samples(self):
+        window = LatencyWindow()
+        for i in range(1, 21):
+            window.observe("a", float(i), now=100.0)
+        self.assertEqual(window.percentile("a", 95, window=60, now=100.0), 19.0)
+        self.assertEqual(window.percentile("a", 50, window=60, now=100.0), 10.0)
+
+    def test_old_samples_age_out(self):
+        window = LatencyWindow()
+        window.observe("a", 5.0, now=0.0)
+        window.observe("a", 1.0, now=50.0)
+        self.assertEqual(window.recent("a", window=60, now=70.0), [1.0])
+        self.assertIsNone(window.percentile("a", 95, window=60, now=200.0))
+
+    def test_min_samples(self):
+        window = LatencyWindow()
+        window.observe("a", 1.0)
+        self.assertIsNone(window.percentile("a", 95, window=60, min_samples=2))
+        self.assertIsNone(window.percentile("unknown", 95, window=60))
+
+
+class TestChooseRoute(unittest.TestCase):
+    def test_single_deployment_without_fast_deployment(self):
+        route = choose_route(policy(fast_deployment=None), 10, LatencyWindow())
+        self.assertEqual(route, Route("gpt-4o", SINGLE_DEPLOYMENT))
+
+    def test_short_inputs_go_to_the_fast_deployment(self):
+        self.assertEqual(choose_route(policy(), 500, LatencyWindow()), Route("gpt-4o-mini", SHORT_INPUT))
+        self.assertEqual(choose_route(policy(), 501, LatencyWindow()), Route("gpt-4o", LONG_INPUT))
+
+    def test_long_inputs_move_to_the_fast_deployment_above_the_slo(self):
+        latencies = LatencyWindow()
+        for _ in range(4):
+            latencies.observe("gpt-4o", 5.0)
+        # Too few samples to judge yet
+        self.assertEqual(choose_route(policy(), 2000, latencies).reason, LONG_INPUT)
+        latencies.observe("gpt-4o", 5.0)
+        self.assertEqual(choose_route(policy(), 2000, latencies), Route("gpt-4o-mini", LATENCY_SLO))
+        # No SLO configured
+        self.assertEqual(choose_route(policy(latency_slo=0), 2000, latencies).reason, LONG_INPUT)
+
+    def test_within_the_slo_long_inputs_stay_on_the_large_deployment(self):
+        latencies = LatencyWindow()
+        for _ in range(20):
+            latencies.observe("gpt-4o", 1.0)
+        self.assertEqual(choose_route(policy(), 2000, latencies), Route("gpt-4o", LONG_INPUT))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,127 @@
+import asyncio
+import time
+import unittest
+
+from rate_limiter import (
+    AdaptiveConcurrency,
+    ModelScheduler,
+    RateLimitConfig,
+    RetryableError,
+    TokenBucket,
+    parse_retry_after,
+)
+from tokens import IMAGE_TOKENS, estimate_message_tokens, estimate_tokens
+
+
+class TestParseRetryAfter(unittest.TestCase):
+    def test_milliseconds_header_wins(self):
+        self.assertEqual(parse_retry_after({"retry-after-ms": "250", "retry-after": "3"}), 0.25)
+
+    def test_seconds_header(self):
+        self.assertEqual(parse_retry_after({"retry-after": "3"}), 3.0)
+
+    def test_missing_or_invalid(self):
+        self.assertIsNone(parse_retry_after({}))
+        self.assertIsNone(parse_retry_after({"retry-after": "soon"}))
+
+
+class TestTokenEstimates(unittest.TestCase):
+    def test_words_and_punctuation(self):
+        self.assertEqual(estimate_tokens("Hello, world!"), 4)
+
+    def test_images_use_fixed_cost(self):
+        messages = [{"role": "user", "content": [{"type": "image_url", "image_url": {"url": "data:"}}]}]
+        self.assertGreaterEqual(estimate_message_tokens(messages), IMAGE_TOKENS)
+
+
+class TestTokenBucket(unittest.IsolatedAsyncioTestCase):
+    async def test_waits_for_refill(self):
+        bucket = TokenBucket(rate_per_minute=600)  # 10 per second
+        await bucket.acquire(600)
+        start = time.monotonic()
+        await bucket.acquire(2)
+        self.assertGreaterEqual(time.monotonic() - start, 0.15)
+
+
+class TestAdaptiveConcurrency(unittest.TestCase):
+    def test_additive_increase_multiplicative_decrease(self):
+        limiter = AdaptiveConcurrency(initial=4, minimum=1, maximum=8, cooldown=0)
+        for _ in range(4):
+            limiter.on_success()
+        self.assertGreater(limiter.limit, 4.9)
+        limiter.on_throttle()
+        self.assertLess(limiter.limit, 2.6)
+
+    def test_decrease_respects_cooldown(self):
+        limiter = AdaptiveConcurrency(initial=8, minimum=1, maximum=8, cooldown=60)
+        limiter.on_throttle()
+        limiter.on_throttle()
+        self.assertEqual(limiter.limit, 4)
+
+
+class TestModelScheduler(unittest.IsolatedAsyncioTestCase):
+    async def test_retries_throttled_calls_honoring_retry_after(self):
+        scheduler = ModelScheduler(RateLimitConfig(retry_attempts=3, retry_delay=0.001))
+        attempts = []
+
+        async def call():
+            attempts.append(time.monotonic())
+            if len(attempts) < 3:
+                raise RetryableError("throttled", status_code=429, retry_after=0.05)
+            return "ok"
+
+        self.assertEqual(await scheduler.run(call), "ok")
+        self.assertEqual(len(attempts), 3)
+        self.assertGreaterEqual(attempts[1] - attempts[0], 0.05)
+        self.assertEqual((scheduler.stats.retries, scheduler.stats.throttled), (2, 2))
+
+    async def test_gives_up_after_retry_attempts(self):
+        scheduler = ModelScheduler(RateLimitConfig(retry_attempts=2, retry_delay=0.001))
+
+        async def call():
+            raise RetryableError("unavailable", status_code=503)
+
+        with self.assertRaises(RetryableError):
+            await scheduler.run(call)
+        self.assertEqual((scheduler.stats.calls, scheduler.stats.failures), (3, 1))
+
+    async def test_other_errors_are_not_retried(self):
+        scheduler = ModelScheduler(RateLimitConfig(retry_attempts=3))
+
+        async def call():
+            raise ValueError("bad request")
+
+        with self.assertRaises(ValueError):
+            await scheduler.run(call)
+        self.assertEqual(scheduler.stats.calls, 1)
+
+    async def test_concurrency_limit_applies_across_callers(self):
+        scheduler = ModelScheduler(RateLimitConfig(initial_concurrency=2, max_concurrency=2))
+        in_flight = 0
+        peak = 0
+
+        async def call():
+            nonlocal in_flight, peak
+            in_flight += 1
+            peak = max(peak, in_flight)
+            await asyncio.sleep(0.01)
+            in_flight -= 1
+
+        await asyncio.gather(*(scheduler.run(call) for _ in range(10)))
+        self.assertEqual(peak, 2)
+
+    async def test_unused_completion_budget_is_refunded(self):
+        scheduler = ModelScheduler(RateLimitConfig(tokens_per_minute=6000))
+
+        async def call():
+            return "ok"
+
+        # 100 prompt tokens plus a max_tokens of 900
+        await scheduler.run(call, 1000)
+        available = scheduler.tokens.available
+        scheduler.record_usage(1000, 300)
+        self.assertAlmostEqual(scheduler.tokens.available - available, 700, delta=1)
+
+
+if __name__ == "__main__":
+    unittest.main()
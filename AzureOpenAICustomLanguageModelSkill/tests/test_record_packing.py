@@ -0,0 +1,51 @@
+import json
+import unittest
+
+from record_packing import answers_by_record_id, pack_records, packed_user_content
+
+
+def record(record_id, text):
+    return {"recordId": record_id, "data": {"text": text}}
+
+
+class TestPackRecords(unittest.TestCase):
+    def test_short_records_are_packed_up_to_max_records(self):
+        records = [record(str(i), f"Title {i}") for i in range(7)]
+        packs = pack_records(records, max_tokens=1000, max_records=3)
+        self.assertEqual([len(pack) for pack in packs], [3, 3, 1])
+        self.assertEqual([r for pack in packs for r in pack], records)
+
+    def test_packs_stop_at_the_token_budget(self):
+        records = [record(str(i), "word " * 20) for i in range(5)]
+        packs = pack_records(records, max_tokens=70, max_records=10)
+        self.assertEqual([len(pack) for pack in packs], [2, 2, 1])
+
+    def test_unpackable_records_go_alone(self):
+        records = [
+            record("0", "short"),
+            {"recordId": "1", "data": {}},
+            record("2", "short"),
+            record("3", "word " * 200),
+            record("4", "short"),
+            record("4", "short again"),
+        ]
+        packs = pack_records(records, max_tokens=100, max_records=10)
+        self.assertEqual(
+            [[r["recordId"] for r in pack] for pack in packs],
+            [["0"], ["1"], ["2"], ["3"], ["4"], ["4"]],
+        )
+
+    def test_packed_user_content(self):
+        content = json.loads(packed_user_content([record(1, "Contoso"), record("b", "Fabrikam")]))
+        self.assertEqual(content, [{"recordId": "1", "text": "Contoso"}, {"recordId": "b", "text": "Fabrikam"}])
+
+
+class TestAnswersByRecordId(unittest.TestCase):
+    def test_unknown_and_repeated_records_are_dropped(self):
+        records = [record("1", "a"), record("2", "b"), record("3", "c")]
+        answers = answers_by_record_id(records, [("1", "x"), (2, "y"), ("2", "z"), ("9", "w")])
+        self.assertEqual(answers, {"1": "x"})
+
+
+if __name__ == "__main__":
+    unittest.main()
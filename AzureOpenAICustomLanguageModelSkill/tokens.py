@@ -0,0 +1,86 @@
+import math
+import re
+from typing import Any, List, Tuple
+
+# Word pieces and single punctuation marks, roughly how BPE tokenizers split English text
+_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+
+# Tokens charged per message for role and separators
+MESSAGE_OVERHEAD_TOKENS = 4
+# What a high-detail image tile costs a GPT-4o class model
+IMAGE_TOKENS = 765
+
+
+def _piece_tokens(piece: str) -> int:
+    # Common words are a single token; longer words split every ~4 characters
+    return max(1, math.ceil(len(piece) / 4) if len(piece) > 6 else 1)
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimate how many model tokens a text uses, without calling a tokenizer service."""
+    if not text:
+        return 0
+    return sum(_piece_tokens(match.group()) for match in _TOKEN_PATTERN.finditer(text))
+
+
+def estimate_message_tokens(messages: List[Any]) -> int:
+    """Estimate the prompt tokens of a chat completion request."""
+    total = 0
+    for message in messages:
+        total += MESSAGE_OVERHEAD_TOKENS
+        content = message["content"]
+        if isinstance(content, str):
+            total += estimate_tokens(content)
+            continue
+        for part in content or []:
+            if part.get("type") == "image_url":
+                total += IMAGE_TOKENS
+            else:
+                total += estimate_tokens(part.get("text") or "")
+    return total
+
+
+def _token_spans(text: str) -> List[Tuple[int, int, int]]:
+    """(start, end, tokens) for every word piece and punctuation mark in text."""
+    return [
+        (match.start(), match.end(), _piece_tokens(match.group()))
+        for match in _TOKEN_PATTERN.finditer(text)
+    ]
+
+
+def split_by_tokens(text: str, chunk_tokens: int, overlap_tokens: int) -> List[str]:
+    """Split text into chunks of at most chunk_tokens estimated tokens.
+
+    Consecutive chunks share about overlap_tokens tokens so that sentences cut
+    at a chunk boundary are seen whole by at least one chunk. Chunks are
+    slices of the original text, so its formatting is kept.
+    """
+    if chunk_tokens <= 0:
+        raise ValueError("chunk_tokens must be positive")
+    if not 0 <= overlap_tokens < chunk_tokens:
+        raise ValueError("overlap_tokens must be smaller than chunk_tokens")
+
+    spans = _token_spans(text)
+    if sum(tokens for _, _, tokens in spans) <= chunk_tokens:
+        return [text]
+
+    chunks = []
+    start = 0
+    while start < len(spans):
+        end = start
+        count = 0
+        # Always take at least one piece so an oversized word cannot stall the split
+        while end < len(spans) and (end == start or count + spans[end][2] <= chunk_tokens):
+            count += spans[end][2]
+            end += 1
+        chunks.append(text[spans[start][0]:spans[end - 1][1]])
+        if end == len(spans):
+            break
+        # Step back over the overlap, but always move forward by at least one piece
+        next_start = end
+        overlap = 0
+        while next_start - 1 > start and overlap + spans[next_start - 1][2] <= overlap_tokens:
+            next_start -= 1
+            overlap += spans[next_start][2]
+        start = next_start
+    return chunks
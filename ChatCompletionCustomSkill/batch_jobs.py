@@ -0,0 +1,392 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+import uuid
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Endpoint of the batch requests, relative to the deployment
+REQUEST_URL = "/chat/completions"
+# Azure OpenAI takes up to 100,000 requests and 200 MB per batch input file
+MAX_FILE_REQUESTS = 100_000
+MAX_FILE_BYTES = 190 * 1024 * 1024
+TERMINAL_STATES = {"completed", "failed", "expired", "cancelled"}
+# Files of a bulk run in its work folder
+MANIFEST_FILE = "manifest.json"
+OWNERS_FILE = "owners.jsonl"
+INVALID_FILE = "invalid.jsonl"
+JOBS_FILE = "jobs.json"
+NO_RESULT_ERROR = "No result for the record in the batch output"
+
+
+class BatchJobError(Exception):
+    """A batch job could not be submitted or did not finish."""
+
+
+def read_skill_records(path: str) -> Iterator[Dict[str, Any]]:
+    """Records of a skill-style JSONL file.
+
+    Every line is either one record ({"recordId": ..., "data": {...}}) or a
+    whole skill request body ({"values": [records]}).
+    """
+    with open(path, "r", encoding="utf-8") as file:
+        for line_number, line in enumerate(file, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                raise ValueError(f"{path}:{line_number}: invalid JSON: {e}")
+            if isinstance(row, dict) and isinstance(row.get("values"), list):
+                yield from row["values"]
+            elif isinstance(row, dict) and "recordId" in row:
+                yield row
+            else:
+                raise ValueError(f"{path}:{line_number}: expected a record or a request body with values")
+
+
+def batch_request(custom_id: str, body: Dict[str, Any]) -> Dict[str, Any]:
+    """One line of a batch input file."""
+    return {"custom_id": custom_id, "method": "POST", "url": REQUEST_URL, "body": body}
+
+
+def write_request_files(requests: Iterable[Dict[str, Any]], directory: str, prefix: str = "requests",
+                        max_requests: int = MAX_FILE_REQUESTS, max_bytes: int = MAX_FILE_BYTES) -> List[str]:
+    """Write batch request lines to as many JSONL files as the per-file limits need."""
+    os.makedirs(directory, exist_ok=True)
+    paths: List[str] = []
+    file = None
+    count = size = 0
+    try:
+        for request in requests:
+            line = (json.dumps(request, ensure_ascii=False) + "\n").encode("utf-8")
+            if file is None or count >= max_requests or (count and size + len(line) > max_bytes):
+                if file is not None:
+                    file.close()
+                paths.append(os.path.join(directory, f"{prefix}-{len(paths):04d}.jsonl"))
+                file = open(paths[-1], "wb")
+                count = size = 0
+            file.write(line)
+            count += 1
+            size += len(line)
+    finally:
+        if file is not None:
+            file.close()
+    return paths
+
+
+@dataclass
+class JobStatus:
+    job_id: str
+    state: str
+    error: Optional[str] = None
+
+    @property
+    def done(self) -> bool:
+        return self.state in TERMINAL_STATES
+
+
+class BatchBackend(ABC):
+    """Where batch input files are submitted and their results read back from."""
+
+    @abstractmethod
+    def submit(self, request_file: str) -> str:
+        """Submit a batch input file and return the job id."""
+
+    @abstractmethod
+    def status(self, job_id: str) -> JobStatus:
+        """Current state of a job."""
+
+    @abstractmethod
+    def results(self, job_id: str) -> Iterator[Dict[str, Any]]:
+        """Output and error lines of a finished job."""
+
+
+class LocalBatchBackend(BatchBackend):
+    """File based stand-in for a batch API, for tests and dry runs.
+
+    A job is a folder holding a copy of the input file. It is answered line
+    by line with the answer callable (a request body to a chat completion)
+    the first time its status is asked for, and the output is written in the
+    same format a batch API uses.
+    """
+
+    def __init__(self, directory: str, answer: Callable[[Dict[str, Any]], Dict[str, Any]]):
+        self.directory = directory
+        self.answer = answer
+
+    def _job_dir(self, job_id: str) -> str:
+        return os.path.join(self.directory, job_id)
+
+    def submit(self, request_file: str) -> str:
+        job_id = f"batch_{uuid.uuid4().hex}"
+        os.makedirs(self._job_dir(job_id))
+        shutil.copyfile(request_file, os.path.join(self._job_dir(job_id), "input.jsonl"))
+        return job_id
+
+    def status(self, job_id: str) -> JobStatus:
+        job_dir = self._job_dir(job_id)
+        if not os.path.isdir(job_dir):
+            return JobStatus(job_id, "failed", "Unknown job")
+        output_path = os.path.join(job_dir, "output.jsonl")
+        if not os.path.exists(output_path):
+            with open(os.path.join(job_dir, "input.jsonl"), "r", encoding="utf-8") as requests, \
+                    open(output_path + ".tmp", "w", encoding="utf-8") as output:
+                for line in requests:
+                    request = json.loads(line)
+                    output.write(json.dumps(self._result(request), ensure_ascii=False) + "\n")
+            os.replace(output_path + ".tmp", output_path)
+        return JobStatus(job_id, "completed")
+
+    def _result(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        try:
+            body = self.answer(request["body"])
+        except Exception as e:
+            return {"custom_id": request["custom_id"], "response": None,
+                    "error": {"code": "local_error", "message": str(e)}}
+        return {"custom_id": request["custom_id"], "response": {"status_code": 200, "body": body}, "error": None}
+
+    def results(self, job_id: str) -> Iterator[Dict[str, Any]]:
+        with open(os.path.join(self._job_dir(job_id), "output.jsonl"), "r", encoding="utf-8") as file:
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+
+
+class AzureOpenAIBatchBackend(BatchBackend):
+    """The Azure OpenAI batch API, through an openai (Azure)OpenAI client.
+
+    The deployment named in the requests has to be a batch deployment
+    (for example of the Global-Batch type).
+    """
+
+    def __init__(self, client: Any, completion_window: str = "24h"):
+        self.client = client
+        self.completion_window = completion_window
+
+    def submit(self, request_file: str) -> str:
+        with open(request_file, "rb") as file:
+            uploaded = self.client.files.create(file=file, purpose="batch")
+        batch = self.client.batches.create(
+            input_file_id=uploaded.id,
+            endpoint=REQUEST_URL,
+            completion_window=self.completion_window,
+        )
+        return batch.id
+
+    def status(self, job_id: str) -> JobStatus:
+        batch = self.client.batches.retrieve(job_id)
+        error = None
+        if batch.errors and batch.errors.data:
+            error = "; ".join(str(item.message) for item in batch.errors.data)
+        return JobStatus(job_id, batch.status, error)
+
+    def results(self, job_id: str) -> Iterator[Dict[str, Any]]:
+        batch = self.client.batches.retrieve(job_id)
+        # Failed requests are in the error file, in the same line format
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if not file_id:
+                continue
+            for line in self.client.files.content(file_id).text.splitlines():
+                if line.strip():
+                    yield json.loads(line)
+
+
+def wait_for_jobs(backend: BatchBackend, job_ids: List[str], poll_interval: float = 60.0,
+                  timeout: Optional[float] = None,
+                  sleep: Callable[[float], None] = time.sleep) -> Dict[str, JobStatus]:
+    """Poll the jobs until every one of them has finished, failed or expired."""
+    started = time.monotonic()
+    statuses: Dict[str, JobStatus] = {}
+    while True:
+        for job_id in job_ids:
+            if job_id not in statuses or not statuses[job_id].done:
+                statuses[job_id] = backend.status(job_id)
+        running = [job_id for job_id in job_ids if not statuses[job_id].done]
+        if not running:
+            return statuses
+        if timeout is not None and time.monotonic() - started > timeout:
+            raise BatchJobError(f"{len(running)} batch jobs still running after {timeout:g}s: {', '.join(running)}")
+        logger.info(f"{len(running)} of {len(job_ids)} batch jobs still running")
+        sleep(poll_interval)
+
+
+def result_completion(result: Dict[str, Any]) -> Tuple[str, Optional[Dict[str, Any]], Optional[str]]:
+    """custom_id, chat completion body and error message of a batch output line."""
+    custom_id = result.get("custom_id")
+    error = result.get("error")
+    response = result.get("response") or {}
+    if error:
+        return custom_id, None, f"{error.get('code')}: {error.get('message')}"
+    if response.get("status_code") != 200:
+        body = response.get("body") or {}
+        message = (body.get("error") or {}).get("message") or "no response"
+        return custom_id, None, f"Batch request failed with status {response.get('status_code')}: {message}"
+    return custom_id, response.get("body"), None
+
+
+@dataclass
+class BulkStats:
+    records: int = 0
+    requests: int = 0
+    deduplicated: int = 0
+    invalid: int = 0
+    failed: int = 0
+    jobs: List[str] = field(default_factory=list)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return dict(self.__dict__)
+
+
+def _write_json(path: str, value: Any) -> None:
+    with open(path + ".tmp", "w", encoding="utf-8") as file:
+        json.dump(value, file)
+    os.replace(path + ".tmp", path)
+
+
+def _read_json(path: str) -> Any:
+    with open(path, "r", encoding="utf-8") as file:
+        return json.load(file)
+
+
+def prepare(records: Iterable[Dict[str, Any]], request_body: Callable[[Dict[str, Any]], Dict[str, Any]],
+            error_response: Callable[[Dict[str, Any], Exception], Dict[str, Any]], work_dir: str,
+            key: Optional[Callable[[Dict[str, Any]], Optional[str]]] = None) -> BulkStats:
+    """Write the batch request files for records into work_dir.
+
+    request_body builds the chat completion body of a record and raises for
+    records it cannot be built for; those get error_response in the output
+    without being submitted. Records with the same key share one request;
+    only a digest of each key is kept, so memory does not grow with the size
+    of the records. The owners file maps every request back to the recordIds
+    it answers, one line per record, written as the records are read.
+    """
+    os.makedirs(work_dir, exist_ok=True)
+    stats = BulkStats()
+    by_key: Dict[bytes, str] = {}
+
+    with open(os.path.join(work_dir, INVALID_FILE), "w", encoding="utf-8") as invalid, \
+            open(os.path.join(work_dir, OWNERS_FILE), "w", encoding="utf-8") as owners:
+        def own(custom_id: str, record_id: Any) -> None:
+            owners.write(json.dumps({"custom_id": custom_id, "recordId": record_id}, ensure_ascii=False) + "\n")
+
+        def requests() -> Iterator[Dict[str, Any]]:
+            for record in records:
+                stats.records += 1
+                record_id = record.get("recordId")
+                record_key = key(record) if key is not None else None
+                digest = hashlib.sha256(record_key.encode("utf-8")).digest() if record_key is not None else None
+                if digest is not None and digest in by_key:
+                    own(by_key[digest], record_id)
+                    stats.deduplicated += 1
+                    continue
+                try:
+                    body = request_body(record)
+                except Exception as e:
+                    stats.invalid += 1
+                    invalid.write(json.dumps(error_response(record, e), ensure_ascii=False) + "\n")
+                    continue
+                # recordIds are not unique across a whole reindex, so requests are numbered
+                custom_id = f"request-{stats.requests}"
+                stats.requests += 1
+                own(custom_id, record_id)
+                if digest is not None:
+                    by_key[digest] = custom_id
+                yield batch_request(custom_id, body)
+
+        request_files = write_request_files(requests(), work_dir)
+
+    _write_json(os.path.join(work_dir, MANIFEST_FILE), {
+        "request_files": [os.path.basename(path) for path in request_files],
+        "stats": stats.as_dict(),
+    })
+    logger.info(f"Wrote {stats.requests} requests for {stats.records} records to {len(request_files)} files")
+    return stats
+
+
+def read_owners(work_dir: str) -> Dict[str, List[str]]:
+    """recordIds answered by each request of work_dir, in the order they were read."""
+    owners: Dict[str, List[str]] = {}
+    with open(os.path.join(work_dir, OWNERS_FILE), "r", encoding="utf-8") as file:
+        for line in file:
+            entry = json.loads(line)
+            owners.setdefault(entry["custom_id"], []).append(entry["recordId"])
+    return owners
+
+
+def submit(backend: BatchBackend, work_dir: str) -> List[str]:
+    """Submit every request file of work_dir that has not been submitted yet."""
+    manifest = _read_json(os.path.join(work_dir, MANIFEST_FILE))
+    jobs_path = os.path.join(work_dir, JOBS_FILE)
+    jobs: Dict[str, str] = _read_json(jobs_path) if os.path.exists(jobs_path) else {}
+    for request_file in manifest["request_files"]:
+        if request_file not in jobs:
+            jobs[request_file] = backend.submit(os.path.join(work_dir, request_file))
+            # Saved after every submission, so a failed run can be resumed
+            _write_json(jobs_path, jobs)
+            logger.info(f"Submitted {request_file} as batch job {jobs[request_file]}")
+    return list(jobs.values())
+
+
+def collect(backend: BatchBackend, work_dir: str, output_path: str,
+            record_response: Callable[[Dict[str, Any], Dict[str, Any]], Dict[str, Any]],
+            error_response: Callable[[Dict[str, Any], Exception], Dict[str, Any]],
+            poll_interval: float = 60.0, timeout: Optional[float] = None,
+            sleep: Callable[[float], None] = time.sleep) -> BulkStats:
+    """Wait for the jobs of work_dir and write one skill response per record to output_path.
+
+    record_response turns a chat completion body into the skill response of
+    a record; every recordId a request answers gets the response under its
+    own recordId. Records without a result get error_response.
+    """
+    manifest = _read_json(os.path.join(work_dir, MANIFEST_FILE))
+    jobs: Dict[str, str] = _read_json(os.path.join(work_dir, JOBS_FILE))
+    owners = read_owners(work_dir)
+    stats = BulkStats(**{**manifest["stats"], "failed": 0, "jobs": list(jobs.values())})
+    statuses = wait_for_jobs(backend, list(jobs.values()), poll_interval, timeout, sleep)
+    for status in statuses.values():
+        if status.state != "completed":
+            logger.error(f"Batch job {status.job_id} ended as {status.state}: {status.error}")
+
+    answered = set()
+    with open(output_path, "w", encoding="utf-8") as output:
+        def write(response: Dict[str, Any]) -> None:
+            if response.get("errors"):
+                stats.failed += 1
+            output.write(json.dumps(response, ensure_ascii=False) + "\n")
+
+        with open(os.path.join(work_dir, INVALID_FILE), "r", encoding="utf-8") as invalid:
+            for line in invalid:
+                write(json.loads(line))
+
+        for job_id, status in statuses.items():
+            if status.state not in ("completed", "expired", "cancelled"):
+                continue
+            # Expired and cancelled jobs still have results for the requests they finished
+            for result in backend.results(job_id):
+                custom_id, completion, error = result_completion(result)
+                if custom_id not in owners or custom_id in answered:
+                    continue
+                answered.add(custom_id)
+                for record_id in owners[custom_id]:
+                    request_body = {"recordId": record_id}
+                    if completion is None:
+                        write(error_response(request_body, BatchJobError(error)))
+                        continue
+                    try:
+                        write(record_response(request_body, completion))
+                    except Exception as e:
+                        write(error_response(request_body, e))
+
+        for custom_id, record_ids in owners.items():
+            if custom_id not in answered:
+                for record_id in record_ids:
+                    write(error_response({"recordId": record_id}, BatchJobError(NO_RESULT_ERROR)))
+    logger.info(f"Wrote {stats.records} record responses to {output_path}, {stats.failed} with errors")
+    return stats
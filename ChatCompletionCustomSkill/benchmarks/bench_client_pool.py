@@ -0,0 +1,98 @@
+"""Compare a per-invocation HTTP session with the pooled client registry.
+
+Starts a local stub chat completion endpoint that counts new TCP connections,
+then sends the same skill batches through both strategies and reports how many
+connections (TCP/TLS handshakes against a real endpoint) each batch needed.
+
+Run from the skill folder:
+
+    python -m benchmarks.bench_client_pool --batches 10 --batch-size 50
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+import weakref
+
+import aiohttp
+from aiohttp import web
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from batch_executor import run_bounded  # noqa: E402
+from client_registry import close_all, get_session  # noqa: E402
+
+COMPLETION = {"choices": [{"message": {"content": "[Contoso, Seattle]"}}]}
+
+
+class ConnectionCountingStub:
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.connections = 0
+        self._seen = weakref.WeakSet()
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if request.transport not in self._seen:
+            self._seen.add(request.transport)
+            self.connections += 1
+        await request.read()
+        await asyncio.sleep(self.latency)
+        return web.json_response(COMPLETION)
+
+
+async def send_batch(session: aiohttp.ClientSession, url: str, batch_size: int, concurrency: int):
+    async def call(record_id: int):
+        payload = {"messages": [{"role": "user", "content": f"record {record_id}"}]}
+        async with session.post(url, json=payload) as response:
+            response.raise_for_status()
+            return await response.json()
+
+    return await run_bounded(
+        list(range(batch_size)), call, max_concurrency=concurrency, timeout=30,
+        on_timeout=lambda item: None, on_error=lambda item, e: None,
+    )
+
+
+async def run_strategy(name, stub, url, args, pooled):
+    stub.connections = 0
+    start = time.perf_counter()
+    for _ in range(args.batches):
+        if pooled:
+            session = get_session(url, "bench-key", args.pool_size, keepalive_timeout=60)
+            await send_batch(session, url, args.batch_size, args.concurrency)
+        else:
+            # Legacy behaviour: a fresh session (and connections) for every invocation
+            async with aiohttp.ClientSession(headers={"api-key": "bench-key"}) as session:
+                await send_batch(session, url, args.batch_size, args.concurrency)
+    elapsed = time.perf_counter() - start
+    print(f"{name:<22} connections/batch={stub.connections / args.batches:7.2f} "
+          f"total={stub.connections:5d} elapsed={elapsed:6.2f}s")
+
+
+async def main(args):
+    stub = ConnectionCountingStub(args.latency)
+    app = web.Application()
+    app.router.add_post("/chat/completions", stub.handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", args.port)
+    await site.start()
+    url = f"http://127.0.0.1:{args.port}/chat/completions"
+    try:
+        await run_strategy("per-invocation session", stub, url, args, pooled=False)
+        await run_strategy("pooled registry", stub, url, args, pooled=True)
+    finally:
+        await close_all()
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--batches", type=int, default=10)
+    parser.add_argument("--batch-size", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--pool-size", type=int, default=100)
+    parser.add_argument("--latency", type=float, default=0.02, help="stub latency in seconds")
+    parser.add_argument("--port", type=int, default=8799)
+    asyncio.run(main(parser.parse_args()))
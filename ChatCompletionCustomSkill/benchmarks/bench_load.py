@@ -0,0 +1,156 @@
+"""Load test the skill's function handler against the local stub model endpoint.
+
+Sends skillset-shaped batches of several sizes and text lengths through the
+custom_skill handler, the way the indexer does, with a number of requests in
+flight at once. Reports records per second, p50/p95/p99 request latency and
+the record error rate for every combination, so changes to the concurrency,
+retry and caching code show up as numbers.
+
+Run from the skill folder:
+
+    python -m benchmarks.bench_load --batch-sizes 1,10,50 --text-lengths short,long --throttle-rate 0.05
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import time
+from typing import Any, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.stub_server import add_stub_arguments, stub_from_arguments  # noqa: E402
+
+# Words per record for each text length
+TEXT_LENGTHS = {"short": 12, "medium": 250, "long": 2500}
+WORDS = (
+    "Contoso Fabrikam Seattle Redmond the of and a to in is for on with as by at from "
+    "indexer document search skill enrichment pipeline contract invoice report quarterly revenue "
+    "customer support agreement policy section clause summary"
+).split()
+
+
+def make_text(words: int, rng: random.Random) -> str:
+    sentences = []
+    while words > 0:
+        length = min(words, rng.randint(8, 20))
+        sentences.append(" ".join(rng.choice(WORDS) for _ in range(length)).capitalize() + ".")
+        words -= length
+    return " ".join(sentences)
+
+
+def make_batch(batch_size: int, words: int, rng: random.Random, offset: int) -> Dict[str, Any]:
+    return {"values": [
+        {"recordId": str(offset + i), "data": {"text": make_text(words, rng)}} for i in range(batch_size)
+    ]}
+
+
+def expired(value: Dict[str, Any]) -> bool:
+    return any(warning.startswith("Deadline exceeded") for warning in value.get("warnings") or [])
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(q / 100 * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+async def run_case(handler, func, scenario: str, batch_size: int, length: str, args, rng) -> Dict[str, Any]:
+    latencies: List[float] = []
+    records = 0
+    failed_records = 0
+    failed_requests = 0
+    semaphore = asyncio.Semaphore(args.parallel_requests)
+
+    async def send(index: int) -> None:
+        nonlocal records, failed_records, failed_requests
+        body = make_batch(batch_size, TEXT_LENGTHS[length], rng, index * batch_size)
+        request = func.HttpRequest(
+            "POST", "/api/custom_skill", headers={"scenario": scenario}, body=json.dumps(body).encode(),
+        )
+        async with semaphore:
+            started = time.perf_counter()
+            response = await handler(request)
+            latencies.append(time.perf_counter() - started)
+        records += batch_size
+        if response.status_code != 200:
+            failed_requests += 1
+            failed_records += batch_size
+            return
+        values = json.loads(response.get_body())["values"]
+        failed_records += sum(1 for value in values if value.get("errors") or expired(value))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(send(index) for index in range(args.requests)))
+    elapsed = time.perf_counter() - started
+    return {
+        "scenario": scenario,
+        "batch_size": batch_size,
+        "text_length": length,
+        "requests": args.requests,
+        "records_per_second": round(records / elapsed, 2),
+        "p50": round(percentile(latencies, 50), 4),
+        "p95": round(percentile(latencies, 95), 4),
+        "p99": round(percentile(latencies, 99), 4),
+        "error_rate": round(failed_records / records, 4) if records else 0.0,
+        "failed_requests": failed_requests,
+    }
+
+
+async def main(args) -> None:
+    stub = stub_from_arguments(args)
+    base_url = await stub.start(port=args.port)
+    # The stub answers on every path, so the same URL serves both endpoint styles
+    os.environ["AZURE_CHAT_COMPLETION_ENDPOINT"] = base_url
+    os.environ.setdefault("AZURE_INFERENCE_CREDENTIAL", "bench-key")
+    # Repeated texts would otherwise be answered from the response cache
+    os.environ.setdefault("RESPONSE_CACHE_MODE", "off")
+
+    import azure.functions as func
+    import function_app
+    from client_registry import close_all
+
+    # The function app configures verbose logging on import, and every
+    # injected 429 would log a retry warning
+    logging.getLogger().setLevel(logging.ERROR)
+    handler = function_app.custom_skill.build().get_user_function()
+    rng = random.Random(args.seed)
+    results = []
+    print(f"{'scenario':<20} {'batch':>5} {'text':<7} {'rec/s':>9} {'p50':>8} {'p95':>8} {'p99':>8} {'errors':>7}")
+    try:
+        for scenario in args.scenarios.split(","):
+            for batch_size in (int(size) for size in args.batch_sizes.split(",")):
+                for length in args.text_lengths.split(","):
+                    result = await run_case(handler, func, scenario, batch_size, length, args, rng)
+                    results.append(result)
+                    print(f"{scenario:<20} {batch_size:>5} {length:<7} {result['records_per_second']:>9.1f} "
+                          f"{result['p50']:>8.3f} {result['p95']:>8.3f} {result['p99']:>8.3f} "
+                          f"{result['error_rate']:>7.2%}")
+    finally:
+        await close_all()
+        await stub.stop()
+    print(f"stub: {json.dumps(stub.stats.as_dict())}")
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump({"stub": stub.stats.as_dict(), "results": results}, file, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenarios", default="entity-recognition",
+                        help="comma separated scenarios sent in the scenario header")
+    parser.add_argument("--batch-sizes", default="1,10,50")
+    parser.add_argument("--text-lengths", default="short,medium",
+                        help=f"comma separated, from {', '.join(TEXT_LENGTHS)}")
+    parser.add_argument("--requests", type=int, default=20, help="skill requests per combination")
+    parser.add_argument("--parallel-requests", type=int, default=4,
+                        help="requests in flight at once, like indexer parallelism")
+    parser.add_argument("--port", type=int, default=8790)
+    parser.add_argument("--output", help="also write the results to this JSON file")
+    add_stub_arguments(parser)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,85 @@
+import asyncio
+import logging
+import math
+from typing import Awaitable, Callable, List
+
+from tokens import estimate_tokens, split_by_tokens
+
+logger = logging.getLogger(__name__)
+
+
+def group_by_tokens(summaries: List[str], max_tokens: int) -> List[List[str]]:
+    """Pack consecutive summaries into groups that fit in max_tokens."""
+    groups: List[List[str]] = []
+    group_tokens = 0
+    for summary in summaries:
+        tokens = estimate_tokens(summary)
+        if groups and group_tokens + tokens <= max_tokens:
+            groups[-1].append(summary)
+            group_tokens += tokens
+        else:
+            groups.append([summary])
+            group_tokens = tokens
+    return groups
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """The start of text, up to max_tokens estimated tokens."""
+    return split_by_tokens(text, max(1, max_tokens), 0)[0]
+
+
+def summary_call_rounds(chunk_count: int, fan_out: int) -> int:
+    """Upper bound on the rounds of calls map_reduce_summarize makes one after the other.
+
+    The map takes chunk_count / fan_out rounds, and every reduce round combines
+    at least two summaries per call, so a record's timeout can be scaled by it.
+    """
+    fan_out = max(1, fan_out)
+    rounds = math.ceil(chunk_count / fan_out)
+    summaries = chunk_count
+    while summaries > 1:
+        summaries = math.ceil(summaries / 2)
+        rounds += math.ceil(summaries / fan_out)
+    return rounds
+
+
+async def map_reduce_summarize(
+    text: str,
+    summarize: Callable[[str], Awaitable[str]],
+    combine: Callable[[List[str]], Awaitable[str]],
+    chunk_tokens: int,
+    overlap_tokens: int,
+    fan_out: int,
+) -> str:
+    """Summarize text that may not fit in one model call.
+
+    The text is split into overlapping chunks by estimated token count and the
+    chunks are summarized concurrently, at most fan_out at a time (map). The
+    chunk summaries are then combined, in as many rounds as it takes for them
+    to fit in a single call (reduce).
+    """
+    chunks = split_by_tokens(text, chunk_tokens, overlap_tokens)
+    if len(chunks) == 1:
+        return await summarize(text)
+
+    semaphore = asyncio.Semaphore(max(1, fan_out))
+
+    async def bounded(call: Callable, argument) -> str:
+        async with semaphore:
+            return await call(argument)
+
+    logger.info(f"Summarizing {len(chunks)} chunks of up to {chunk_tokens} tokens")
+    summaries = list(await asyncio.gather(*(bounded(summarize, chunk) for chunk in chunks)))
+
+    while len(summaries) > 1:
+        groups = group_by_tokens(summaries, chunk_tokens)
+        if len(groups) == 1:
+            return await combine(summaries)
+        if len(groups) == len(summaries):
+            # No two summaries fit in one call; shorten them so that they pair up
+            # instead of sending a combine call that overflows the context window
+            logger.warning(f"Truncating {len(summaries)} summaries to {chunk_tokens // 2} tokens to combine them")
+            summaries = [truncate_to_tokens(summary, chunk_tokens // 2) for summary in summaries]
+            groups = group_by_tokens(summaries, chunk_tokens)
+        summaries = list(await asyncio.gather(*(bounded(combine, group) for group in groups)))
+    return summaries[0]
@@ -0,0 +1,85 @@
+import asyncio
+import atexit
+import hashlib
+import logging
+from dataclasses import dataclass
+from typing import Dict, Tuple
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class _PooledSession:
+    session: aiohttp.ClientSession
+    loop: asyncio.AbstractEventLoop
+
+
+# One keep-alive session per (endpoint, credential) for the lifetime of the worker process
+_sessions: Dict[Tuple[str, str], _PooledSession] = {}
+
+
+def _registry_key(endpoint: str, api_key: str) -> Tuple[str, str]:
+    # Only a digest of the credential is kept as part of the key
+    return endpoint, hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()
+
+
+def get_session(endpoint: str, api_key: str, pool_size: int,
+                keepalive_timeout: float) -> aiohttp.ClientSession:
+    """Return the shared connection-pooled session for this endpoint and credential.
+
+    The session is created on first use and reused by every later invocation
+    running on the same event loop, so TCP and TLS set-up is paid once per
+    pooled connection instead of once per record.
+    """
+    key = _registry_key(endpoint, api_key)
+    loop = asyncio.get_running_loop()
+    pooled = _sessions.get(key)
+    if pooled and not pooled.session.closed and pooled.loop is loop:
+        return pooled.session
+
+    # aiohttp sessions are bound to the loop that created them, so a new loop
+    # (e.g. a fresh asyncio.run in local tooling) gets its own session
+    connector = aiohttp.TCPConnector(
+        limit=pool_size,
+        limit_per_host=pool_size,
+        keepalive_timeout=keepalive_timeout,
+    )
+    session = aiohttp.ClientSession(
+        connector=connector,
+        headers={
+            "Content-Type": "application/json",
+            "api-key": api_key,
+            "Authorization": f"Bearer {api_key}"
+        },
+    )
+    _sessions[key] = _PooledSession(session=session, loop=loop)
+    logger.info(f"Created pooled HTTP session for {endpoint} (pool size {pool_size})")
+    return session
+
+
+async def close_all() -> None:
+    """Close every pooled session owned by the running event loop."""
+    loop = asyncio.get_running_loop()
+    for key, pooled in list(_sessions.items()):
+        if pooled.loop is loop:
+            await pooled.session.close()
+            del _sessions[key]
+
+
+def _close_at_exit() -> None:
+    # The functions host gives no async shutdown hook, so drain each session on
+    # the loop that owns it when that loop is idle at interpreter exit.
+    for key, pooled in list(_sessions.items()):
+        loop = pooled.loop
+        if pooled.session.closed or loop.is_closed() or loop.is_running():
+            continue
+        try:
+            loop.run_until_complete(pooled.session.close())
+        except Exception as e:
+            logger.warning(f"Failed to close pooled session for {key[0]}: {e}")
+    _sessions.clear()
+
+
+atexit.register(_close_at_exit)
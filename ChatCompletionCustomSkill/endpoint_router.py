@@ -0,0 +1,343 @@
+import asyncio
+import contextlib
+import hashlib
+import logging
+import math
+import time
+from collections import deque
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Deque, Dict, Iterator, List, Optional, Sequence, Tuple, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+@dataclass(frozen=True)
+class Endpoint:
+    url: str
+    credential: str
+
+
+def parse_endpoints(urls: Optional[str], credentials: Optional[str],
+                    default_credential: Optional[str]) -> List[Endpoint]:
+    """Endpoints from comma separated urls and credentials.
+
+    A credential list, when given, is matched to the urls by position; urls
+    without a credential of their own use default_credential.
+    """
+    url_list = [url.strip() for url in (urls or "").split(",") if url.strip()]
+    credential_list = [credential.strip() for credential in (credentials or "").split(",")]
+    return [
+        Endpoint(url, credential_list[i] if i < len(credential_list) and credential_list[i]
+                 else default_credential or "")
+        for i, url in enumerate(url_list)
+    ]
+
+
+@dataclass(frozen=True)
+class RouterConfig:
+    # Weight of the newest observation in the moving latency and error averages
+    latency_alpha: float = 0.2
+    error_alpha: float = 0.2
+    # An endpoint with an error average of 1 scores as (1 + error_penalty) times slower
+    error_penalty: float = 4.0
+    # Consecutive failures that open an endpoint's circuit, and how long it stays open
+    failure_threshold: int = 5
+    cooldown: float = 30.0
+    # Send a duplicate call to the next endpoint once the first one is slower
+    # than this percentile of its recent latencies
+    hedge: bool = False
+    hedge_percentile: float = 95.0
+    hedge_min_samples: int = 20
+    latency_window: int = 200
+
+
+class _Attempt:
+    """Whether the request of a routed call is at its endpoint, for the hedge timer."""
+
+    def __init__(self) -> None:
+        self.sent_at: Optional[float] = None
+        self.changed = asyncio.Event()
+
+    def mark(self, sent_at: Optional[float]) -> None:
+        self.sent_at = sent_at
+        self.changed.set()
+
+
+# The attempt of the routed call running in the current task
+_attempt: ContextVar[Optional[_Attempt]] = ContextVar("endpoint_attempt", default=None)
+
+
+@contextlib.contextmanager
+def in_flight() -> Iterator[None]:
+    """Mark the routed call's request as sent to its endpoint until the block exits.
+
+    The hedge timer only runs while a request is in flight, so a call that
+    first waits for admission, or backs off between attempts, wraps just the
+    request itself. Outside a routed call it does nothing.
+    """
+    attempt = _attempt.get()
+    if attempt is None:
+        yield
+        return
+    attempt.mark(time.monotonic())
+    try:
+        yield
+    finally:
+        attempt.mark(None)
+
+
+class EndpointHealth:
+    """Moving latency and error averages of an endpoint, and its circuit breaker.
+
+    The circuit opens after failure_threshold consecutive failures and the
+    endpoint is left out of routing for the cool-down. After that it is
+    half-open: one call at a time is let through as a trial, which closes the
+    circuit when it succeeds and opens it again when it fails.
+    """
+
+    def __init__(self, config: RouterConfig):
+        self.config = config
+        self.latency: Optional[float] = None
+        self.error_rate = 0.0
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self.tripped = False
+        self.trial = False
+        self.samples: Deque[float] = deque(maxlen=config.latency_window)
+        self.calls = 0
+        self.failures = 0
+        self.ejections = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def available(self, now: float) -> bool:
+        # A half-open endpoint is only available while no trial call is in flight
+        return now >= self.open_until and not (self.tripped and self.trial)
+
+    def start_trial(self, now: float) -> bool:
+        """Whether a call starting now is the trial of a half-open circuit."""
+        if self.tripped and now >= self.open_until and not self.trial:
+            self.trial = True
+            return True
+        return False
+
+    def score(self) -> float:
+        # Endpoints without a measurement yet score best, so they are probed
+        return (self.latency or 0.0) * (1 + self.config.error_penalty * self.error_rate)
+
+    def record_success(self, seconds: float) -> None:
+        self.calls += 1
+        alpha = self.config.latency_alpha
+        self.latency = seconds if self.latency is None else alpha * seconds + (1 - alpha) * self.latency
+        self.error_rate *= 1 - self.config.error_alpha
+        self.samples.append(seconds)
+        self.consecutive_failures = 0
+        self.tripped = False
+
+    def record_failure(self, now: float) -> bool:
+        """Count a failed call; returns True when it opens the circuit."""
+        self.calls += 1
+        self.failures += 1
+        self.error_rate = self.config.error_alpha + (1 - self.config.error_alpha) * self.error_rate
+        self.consecutive_failures += 1
+        # Calls that were in flight when the circuit opened do not open it again
+        if now < self.open_until:
+            return False
+        if self.tripped or self.consecutive_failures >= self.config.failure_threshold:
+            self.tripped = True
+            self.open_until = now + self.config.cooldown
+            self.ejections += 1
+            return True
+        return False
+
+    def latency_percentile(self, q: float) -> Optional[float]:
+        if len(self.samples) < max(1, self.config.hedge_min_samples):
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, max(0, math.ceil(q / 100 * len(ordered)) - 1))]
+
+    def describe(self, now: float) -> Dict[str, Any]:
+        return {
+            "latency": round(self.latency, 4) if self.latency is not None else None,
+            "error_rate": round(self.error_rate, 4),
+            "circuit": "open" if now < self.open_until else "half-open" if self.tripped else "closed",
+            "calls": self.calls,
+            "failures": self.failures,
+            "ejections": self.ejections,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+        }
+
+
+class EndpointRouter:
+    """Sends each call to the healthy endpoint with the best moving latency.
+
+    A call that fails moves on to the next endpoint. With hedging on, a call
+    whose request has been in flight longer than the hedge percentile of its
+    endpoint's latency gets a duplicate on the next endpoint, and whichever
+    answers first is used.
+    """
+
+    def __init__(self, endpoints: Sequence[Endpoint], config: RouterConfig):
+        if not endpoints:
+            raise ValueError("At least one endpoint is required")
+        self.endpoints = list(endpoints)
+        self.config = config
+        self.health = {endpoint.url: EndpointHealth(config) for endpoint in self.endpoints}
+
+    def ranked(self) -> List[Endpoint]:
+        """Available endpoints from the best score; ejected ones last, soonest to close first.
+
+        Ejected endpoints are only used when every endpoint is ejected, so a
+        call is never refused for want of a healthy endpoint.
+        """
+        now = time.monotonic()
+        available = [e for e in self.endpoints if self.health[e.url].available(now)]
+        ejected = [e for e in self.endpoints if not self.health[e.url].available(now)]
+        available.sort(key=lambda e: self.health[e.url].score())
+        ejected.sort(key=lambda e: self.health[e.url].open_until)
+        return available + ejected
+
+    def hedge_delay(self, endpoint: Endpoint) -> Optional[float]:
+        if not self.config.hedge:
+            return None
+        return self.health[endpoint.url].latency_percentile(self.config.hedge_percentile)
+
+    async def _timed(self, endpoint: Endpoint, call: Callable[[Endpoint], Awaitable[T]],
+                     is_failure: Callable[[Exception], bool],
+                     latency: Optional[Callable[[T], Optional[float]]], attempt: _Attempt) -> T:
+        # Runs in a task of its own, so in_flight() inside call marks this attempt
+        _attempt.set(attempt)
+        health = self.health[endpoint.url]
+        started = time.monotonic()
+        trial = health.start_trial(started)
+        try:
+            result = await call(endpoint)
+        except asyncio.CancelledError:
+            # A hedge that lost the race says nothing about the endpoint
+            raise
+        except Exception as e:
+            if is_failure(e):
+                if health.record_failure(time.monotonic()):
+                    logger.warning(
+                        f"Ejecting {endpoint.url} for {self.config.cooldown:g}s after "
+                        f"{health.consecutive_failures} consecutive failures: {e}"
+                    )
+            raise
+        finally:
+            if trial:
+                health.trial = False
+        seconds = latency(result) if latency is not None else None
+        health.record_success(time.monotonic() - started if seconds is None else seconds)
+        return result
+
+    async def run(self, call: Callable[[Endpoint], Awaitable[T]],
+                  is_failure: Callable[[Exception], bool] = lambda e: True,
+                  latency: Optional[Callable[[T], Optional[float]]] = None) -> T:
+        """Run call against the best endpoint, failing over and hedging as configured.
+
+        is_failure tells errors caused by the endpoint from errors caused by
+        the request; only the former count against the endpoint and fail
+        over, the latter are raised straight away. latency returns the
+        endpoint's own latency for a result, when call also spends time
+        waiting before it reaches the endpoint; by default the whole call
+        is timed. Hedging only times requests that call marks with
+        in_flight(), so a call that is still waiting is never hedged.
+        """
+        candidates = self.ranked()
+        primary = candidates.pop(0)
+        pending: Dict["asyncio.Task[T]", Endpoint] = {}
+        attempt = _Attempt()
+
+        def launch(endpoint: Endpoint, attempt: _Attempt) -> None:
+            pending[asyncio.ensure_future(self._timed(endpoint, call, is_failure, latency, attempt))] = endpoint
+
+        launch(primary, attempt)
+        hedge_after = self.hedge_delay(primary) if candidates else None
+        hedge: Optional[Endpoint] = None
+        error: Optional[Exception] = None
+        # Wakes the loop when the primary's request is sent or answered, to restart the hedge timer
+        changed: Optional["asyncio.Future[Any]"] = None
+        try:
+            while pending:
+                waiting = set(pending)
+                timeout = None
+                if hedge_after is not None:
+                    if changed is None:
+                        attempt.changed.clear()
+                        changed = asyncio.ensure_future(attempt.changed.wait())
+                    waiting.add(changed)
+                    if attempt.sent_at is not None:
+                        timeout = max(0.0, attempt.sent_at + hedge_after - time.monotonic())
+                done, _ = await asyncio.wait(waiting, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if changed in done:
+                    done.discard(changed)
+                    changed = None
+                    if not done:
+                        continue
+                if not done:
+                    # The request has been in flight longer than the hedge percentile of its endpoint
+                    hedge_after = None
+                    hedge = candidates.pop(0)
+                    self.health[primary.url].hedges += 1
+                    launch(hedge, _Attempt())
+                    continue
+                for task in done:
+                    endpoint = pending.pop(task)
+                    try:
+                        result = task.result()
+                    except Exception as e:
+                        if not is_failure(e):
+                            raise
+                        error = e
+                        continue
+                    if endpoint is hedge:
+                        self.health[primary.url].hedge_wins += 1
+                    return result
+                if not pending and candidates:
+                    fallback = candidates.pop(0)
+                    logger.info(f"Failing over from {endpoint.url} to {fallback.url}: {error}")
+                    hedge_after = None
+                    launch(fallback, _Attempt())
+            raise error
+        finally:
+            if changed is not None:
+                changed.cancel()
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+
+    def describe(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {endpoint.url: self.health[endpoint.url].describe(now) for endpoint in self.endpoints}
+
+
+# One router per endpoint list and config, so the averages outlive a single invocation
+_routers: Dict[Tuple[Tuple[Tuple[str, str], ...], RouterConfig], EndpointRouter] = {}
+
+
+def _router_key(endpoints: Sequence[Endpoint],
+                config: RouterConfig) -> Tuple[Tuple[Tuple[str, str], ...], RouterConfig]:
+    # Only a digest of the credentials is kept as part of the key
+    return tuple(
+        (endpoint.url, hashlib.sha256(endpoint.credential.encode("utf-8")).hexdigest())
+        for endpoint in endpoints
+    ), config
+
+
+def get_router(endpoints: Sequence[Endpoint], config: RouterConfig) -> EndpointRouter:
+    """Return the process-wide router for a list of endpoints and config, creating it on first use."""
+    key = _router_key(endpoints, config)
+    router = _routers.get(key)
+    if router is None:
+        router = EndpointRouter(endpoints, config)
+        _routers[key] = router
+    return router
+
+
+def describe_routers() -> Dict[str, Any]:
+    return {name: health for router in _routers.values() for name, health in router.describe().items()}
@@ -3,14 +3,26 @@ import json
 import logging
 import os
 import asyncio
+import aiohttp
 from azure.ai.inference.aio import ChatCompletionsClient
 from azure.core.credentials import AzureKeyCredential
-from typing import Dict, Any, List
-from dataclasses import dataclass
+from typing import Dict, Any, List, Optional, Tuple, Union
+from dataclasses import dataclass, field
 from enum import Enum
 import base64
+import re
 import time
-import requests
+from batch_executor import BudgetStats, Deadline, run_bounded
+from client_registry import get_session
+from response_cache import ResponseCache, cache_key, record_content
+from rate_limiter import RateLimitConfig, RetryableError, describe_schedulers, get_scheduler, parse_retry_after
+from tokens import estimate_message_tokens, estimate_tokens, split_by_tokens
+from chunked_summary import map_reduce_summarize, summary_call_rounds
+from record_packing import answers_by_record_id, pack_records, packed_user_content
+from image_prep import ImagePrepConfig, ImagePrepError, prepare_message_images
+from dedup import fan_out, group_duplicates
+from endpoint_router import Endpoint, RouterConfig, describe_routers, get_router, in_flight, parse_endpoints
+from metrics import SkillMetrics
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -27,6 +39,133 @@ class ModelConfig:
     top_p: float = 0.95
     max_tokens: int = 4096
     timeout: int = 30  # seconds
+    # Upper bound on model calls in flight for a single skill request
+    max_concurrency: int = field(
+        default_factory=lambda: int(os.getenv("MAX_CONCURRENT_REQUESTS", "10"))
+    )
+    # Size of the process-wide keep-alive connection pool per endpoint
+    http_pool_size: int = field(
+        default_factory=lambda: int(os.getenv("HTTP_POOL_SIZE", "100"))
+    )
+    http_keepalive_timeout: float = field(
+        default_factory=lambda: float(os.getenv("HTTP_KEEPALIVE_SECONDS", "60"))
+    )
+    retry_attempts: int = field(
+        default_factory=lambda: int(os.getenv("RETRY_ATTEMPTS", "3"))
+    )
+    retry_delay: float = field(
+        default_factory=lambda: float(os.getenv("RETRY_DELAY_SECONDS", "0.5"))
+    )
+    # Deployment quota shared by all requests on this instance, 0 means unlimited
+    requests_per_minute: int = field(
+        default_factory=lambda: int(os.getenv("RATE_LIMIT_RPM", "0"))
+    )
+    tokens_per_minute: int = field(
+        default_factory=lambda: int(os.getenv("RATE_LIMIT_TPM", "0"))
+    )
+    # Time budget for a whole request, kept under the 230 second custom skill limit;
+    # a "deadline-seconds" request header overrides it
+    request_deadline: float = field(
+        default_factory=lambda: float(os.getenv("REQUEST_DEADLINE_SECONDS", "225"))
+    )
+    # Part of the budget reserved for building and sending the response
+    deadline_margin: float = field(
+        default_factory=lambda: float(os.getenv("DEADLINE_MARGIN_SECONDS", "2"))
+    )
+    # Long summarization inputs are split into chunks that are summarized
+    # concurrently and then combined (map-reduce)
+    summary_chunking: bool = field(
+        default_factory=lambda: os.getenv("SUMMARY_CHUNKING", "false").lower() == "true"
+    )
+    summary_chunk_tokens: int = field(
+        default_factory=lambda: int(os.getenv("SUMMARY_CHUNK_TOKENS", "4000"))
+    )
+    summary_chunk_overlap_tokens: int = field(
+        default_factory=lambda: int(os.getenv("SUMMARY_CHUNK_OVERLAP_TOKENS", "200"))
+    )
+    summary_fan_out: int = field(
+        default_factory=lambda: int(os.getenv("SUMMARY_FAN_OUT", "4"))
+    )
+    # Short entity recognition records can be sent several to a model call
+    entity_packing: bool = field(
+        default_factory=lambda: os.getenv("ENTITY_PACKING", "false").lower() == "true"
+    )
+    entity_pack_max_records: int = field(
+        default_factory=lambda: int(os.getenv("ENTITY_PACK_MAX_RECORDS", "20"))
+    )
+    entity_pack_max_tokens: int = field(
+        default_factory=lambda: int(os.getenv("ENTITY_PACK_MAX_TOKENS", "1000"))
+    )
+    # Records of a batch with the same content are sent to the model once
+    dedup_records: bool = field(
+        default_factory=lambda: os.getenv("DEDUP_RECORDS", "true").lower() == "true"
+    )
+    # Calls go to the endpoint with the best moving latency; an endpoint is
+    # ejected for the cool-down after this many consecutive failures
+    circuit_failure_threshold: int = field(
+        default_factory=lambda: int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+    )
+    circuit_cooldown: float = field(
+        default_factory=lambda: float(os.getenv("CIRCUIT_COOLDOWN_SECONDS", "30"))
+    )
+    # Send a duplicate call to the next endpoint when the first one takes
+    # longer than this percentile of its recent latencies
+    hedge_requests: bool = field(
+        default_factory=lambda: os.getenv("HEDGE_REQUESTS", "false").lower() == "true"
+    )
+    hedge_percentile: float = field(
+        default_factory=lambda: float(os.getenv("HEDGE_PERCENTILE", "95"))
+    )
+    # Ceiling for the adaptive concurrency limit across all requests on this instance
+    instance_max_concurrency: int = field(
+        default_factory=lambda: int(os.getenv("INSTANCE_MAX_CONCURRENCY", "50"))
+    )
+    # Images for captioning are downscaled to what the model can use before upload
+    image_prep: bool = field(
+        default_factory=lambda: os.getenv("IMAGE_PREP", "true").lower() == "true"
+    )
+    image_max_pixels: int = field(
+        default_factory=lambda: int(os.getenv("IMAGE_MAX_PIXELS", "50000000"))
+    )
+    image_max_long_side: int = field(
+        default_factory=lambda: int(os.getenv("IMAGE_MAX_LONG_SIDE", "2048"))
+    )
+    image_max_short_side: int = field(
+        default_factory=lambda: int(os.getenv("IMAGE_MAX_SHORT_SIDE", "768"))
+    )
+    image_format: str = field(
+        default_factory=lambda: os.getenv("IMAGE_FORMAT", "jpeg")
+    )
+    image_quality: int = field(
+        default_factory=lambda: int(os.getenv("IMAGE_QUALITY", "85"))
+    )
+
+    def rate_limit_config(self) -> RateLimitConfig:
+        return RateLimitConfig(
+            requests_per_minute=self.requests_per_minute,
+            tokens_per_minute=self.tokens_per_minute,
+            retry_attempts=self.retry_attempts,
+            retry_delay=self.retry_delay,
+            initial_concurrency=self.max_concurrency,
+            max_concurrency=self.instance_max_concurrency,
+        )
+
+    def router_config(self) -> RouterConfig:
+        return RouterConfig(
+            failure_threshold=self.circuit_failure_threshold,
+            cooldown=self.circuit_cooldown,
+            hedge=self.hedge_requests,
+            hedge_percentile=self.hedge_percentile,
+        )
+
+    def image_prep_config(self) -> ImagePrepConfig:
+        return ImagePrepConfig(
+            max_pixels=self.image_max_pixels,
+            max_long_side=self.image_max_long_side,
+            max_short_side=self.image_max_short_side,
+            output_format=self.image_format,
+            quality=self.image_quality,
+        )
 
 class CustomSkillException(Exception):
     def __init__(self, message: str, status_code: int = 500):
@@ -35,18 +174,54 @@ class CustomSkillException(Exception):
         super().__init__(self.message)
 
 app = func.FunctionApp()
+# Process-wide cache of model answers, shared by all invocations on this worker
+RESPONSE_CACHE = ResponseCache.from_env()
+# Deadline budget used by the batches handled on this worker
+BUDGET_STATS = BudgetStats()
+# Stage latency, token and outcome metrics, exposed by the metrics endpoint
+METRICS = SkillMetrics()
+
+TIMEOUT_ERROR = "Request timeout"
+DEADLINE_WARNING = "Deadline exceeded: the record was not processed within the request time budget"
+
+def load_endpoints() -> List[Endpoint]:
+    """Model endpoints from AZURE_CHAT_COMPLETION_ENDPOINTS, or the single AZURE_CHAT_COMPLETION_ENDPOINT"""
+    return parse_endpoints(
+        os.getenv("AZURE_CHAT_COMPLETION_ENDPOINTS") or os.getenv("AZURE_CHAT_COMPLETION_ENDPOINT"),
+        os.getenv("AZURE_INFERENCE_CREDENTIALS"),
+        os.getenv("AZURE_INFERENCE_CREDENTIAL"),
+    )
 
-def load_custom_prompts() -> Dict[str, str]:
-    """Load custom prompts from JSON file"""
+def endpoint_failure(error: Exception) -> bool:
+    """Whether an error counts against the endpoint; a rejected request would fail on any endpoint"""
+    if isinstance(error, aiohttp.ClientResponseError):
+        return error.status in (408, 429) or error.status >= 500
+    return True
+
+# Built-in prompts for keys that custom_prompts.json files written before them lack
+DEFAULT_PROMPTS = {
+    "summarize-reduce-system-prompt": (
+        "You are an expert summarizer. The following are summaries of consecutive sections of one document. "
+        "Combine them into a single structured summary of the whole document."
+    ),
+    "entity-recognition-packed-system-prompt": (
+        "Extract all named entities from each of the records in the following JSON array of records. "
+        "Answer with a JSON object of the form {\"records\": [{\"recordId\": \"...\", \"entities\": [\"...\"]}]} "
+        "that has exactly one entry for every input record, using its recordId, and nothing else."
+    ),
+}
+
+def load_custom_prompts(path: str = 'custom_prompts.json') -> Dict[str, str]:
+    """Load custom prompts from JSON file, with the built-in prompt for any key it lacks"""
     try:
-        with open('custom_prompts.json', 'r') as file:
-            return json.load(file)
+        with open(path, 'r') as file:
+            return {**DEFAULT_PROMPTS, **json.load(file)}
     except Exception as e:
         logger.error(f"Failed to load custom prompts: {e}")
         raise CustomSkillException("Failed to load custom prompts", 500)
 
 def prepare_messages(request_body: Dict[str, Any], scenario: str, 
-                    custom_prompts: Dict[str, str]) -> List[Dict[str, Any]]:
+                    custom_prompts: Dict[str, str], config: Optional[ModelConfig] = None) -> List[Dict[str, Any]]:
     """Prepare messages based on scenario"""
     try:
         if scenario == ScenarioType.SUMMARIZATION.value:
@@ -108,12 +283,13 @@ def prepare_messages(request_body: Dict[str, Any], scenario: str,
             if not image_data or not image_type:
                 raise CustomSkillException("Invalid image data format", 400)
                 
-            # Validate base64 content
-            try:
-                base64.b64decode(image_data)
-            except Exception:
-                raise CustomSkillException("Invalid base64 encoding", 400)
-                
+            if config is None or not config.image_prep:
+                # Validate base64 content; prepared images are validated when they are decoded
+                try:
+                    base64.b64decode(image_data)
+                except Exception:
+                    raise CustomSkillException("Invalid base64 encoding", 400)
+            # Downscaled by prepare_images once the response cache has been checked
             image_base64encoded = f"data:{image_type};base64,{image_data}"
             system_message = {
             "role": "system",
@@ -149,9 +325,30 @@ def prepare_messages(request_body: Dict[str, Any], scenario: str,
         logger.error(f"Error preparing messages: {e}")
         raise CustomSkillException(f"Failed to prepare messages: {str(e)}", 500)
 
-def format_response(request_body: Dict[str, Any], response_text: str, 
+def prepare_images(messages: List[Dict[str, Any]], config: ModelConfig) -> List[Dict[str, Any]]:
+    """Decode, downscale and re-encode the images of prepared messages"""
+    try:
+        return prepare_message_images(messages, config.image_prep_config())
+    except ImagePrepError as e:
+        raise CustomSkillException(str(e), 400)
+
+def entity_list(response_text: str) -> List[str]:
+    """Entities of an entity recognition answer
+
+    The cache holds them as a JSON list of names; a single-record call answers
+    with a bracketed, comma separated list.
+    """
+    try:
+        entities = json.loads(response_text)
+        if isinstance(entities, list) and all(isinstance(entity, str) for entity in entities):
+            return entities
+    except ValueError:
+        pass
+    return [entity.strip() for entity in response_text.strip('[]').split(',')]
+
+def format_response(request_body: Dict[str, Any], response_text: Union[str, List[str]],
                    scenario: str) -> Dict[str, Any]:
-    """Format response based on scenario"""
+    """Format response based on scenario; entities may already be parsed into a list"""
     try:
         response_body = {
             "recordId": request_body.get("recordId"),
@@ -163,7 +360,7 @@ def format_response(request_body: Dict[str, Any], response_text: str,
         if scenario == ScenarioType.SUMMARIZATION.value:
             response_body["data"] = {"generative-summary": response_text}
         elif scenario == ScenarioType.ENTITY_RECOGNITION.value:
-            entities = [entity.strip() for entity in response_text.strip('[]').split(',')]
+            entities = response_text if isinstance(response_text, list) else entity_list(response_text)
             response_body["data"] = {"entities": entities}
         elif scenario == ScenarioType.IMAGE_CAPTIONING.value:
             response_body["data"] = {"generative-caption": response_text}
@@ -178,18 +375,121 @@ def format_response(request_body: Dict[str, Any], response_text: str,
             "data": None
         }
 
+def text_messages(system_prompt: str, text: str) -> List[Dict[str, Any]]:
+    """System and user messages for a plain text request"""
+    return [
+        {"role": "system", "content": [{"type": "text", "text": system_prompt}]},
+        {"role": "user", "content": [{"type": "text", "text": text}]}
+    ]
+
+def system_prompt_text(messages: List[Dict[str, Any]]) -> str:
+    """Return the text of the system message, which is part of the cache key"""
+    for message in messages:
+        if message["role"] == "system":
+            return " ".join(part.get("text") or "" for part in message["content"])
+    return ""
+
+def parse_packed_entities(response_text: str) -> List[Tuple[Any, List[str]]]:
+    """Split the answer of a packed entity recognition call into (recordId, entities) pairs
+
+    The entities of each record are kept as the list the model answered with,
+    so names that contain commas stay whole. Entries that are not well formed
+    are left out so that their record falls back to a call of its own.
+    """
+    text = response_text.strip()
+    fenced = re.match(r"^```(?:json)?\s*(.*?)\s*```$", text, re.DOTALL)
+    if fenced:
+        text = fenced.group(1)
+    answer = json.loads(text)
+    records = answer.get("records") if isinstance(answer, dict) else answer
+    if not isinstance(records, list):
+        raise ValueError("Packed answer has no list of records")
+    pairs = []
+    for record in records:
+        if not isinstance(record, dict) or "recordId" not in record:
+            continue
+        entities = record.get("entities")
+        if not isinstance(entities, list) or not all(isinstance(entity, str) for entity in entities):
+            continue
+        pairs.append((record["recordId"], entities))
+    return pairs
+
+def timeout_response(request_body: Dict[str, Any]) -> Dict[str, Any]:
+    """Build the record response for a model call that ran out of time"""
+    logger.error(f"Timeout processing record {request_body.get('recordId')}")
+    return {
+        "recordId": request_body.get("recordId"),
+        "errors": [TIMEOUT_ERROR],
+        "warnings": None,
+        "data": None
+    }
+
+def deadline_response(request_body: Dict[str, Any]) -> Dict[str, Any]:
+    """Build the record response for a record cancelled at the request deadline"""
+    logger.warning(f"Deadline exceeded before record {request_body.get('recordId')} was processed")
+    return {
+        "recordId": request_body.get("recordId"),
+        "errors": [],
+        "warnings": [DEADLINE_WARNING],
+        "data": {}
+    }
+
+def parse_deadline(header_value: str, config: ModelConfig) -> float:
+    """Request time budget in seconds, from the deadline-seconds header or config"""
+    if not header_value:
+        return config.request_deadline
+    try:
+        budget = float(header_value)
+    except ValueError:
+        raise CustomSkillException("Invalid deadline-seconds header", 400)
+    if budget <= 0:
+        raise CustomSkillException("Invalid deadline-seconds header", 400)
+    return budget
+
+def record_outcome(response_body: Dict[str, Any]) -> str:
+    """Outcome label of a record response for the metrics endpoint"""
+    if response_body.get("errors"):
+        return "timeout" if response_body["errors"] == [TIMEOUT_ERROR] else "error"
+    if DEADLINE_WARNING in (response_body.get("warnings") or []):
+        return "deadline"
+    return "ok"
+
+def error_response(request_body: Dict[str, Any], error: Exception) -> Dict[str, Any]:
+    """Build the record response for a model call that failed"""
+    logger.error(f"Error processing record {request_body.get('recordId')}: {error}")
+    return {
+        "recordId": request_body.get("recordId"),
+        "errors": [str(error)],
+        "warnings": None,
+        "data": None
+    }
+
 @app.function_name(name="AIStudioModelCatalogHealthCheck")
 @app.route(route="health", auth_level=func.AuthLevel.ANONYMOUS)
 async def health_check(req: func.HttpRequest) -> func.HttpResponse:
     """Health check endpoint"""
-    response_body = {"status": "Healthy"}
+    response_body = {
+        "status": "Healthy",
+        "cache": RESPONSE_CACHE.describe(),
+        "rate_limiter": describe_schedulers(),
+        "endpoints": describe_routers(),
+        "deadline": BUDGET_STATS.describe()
+    }
     return func.HttpResponse(json.dumps(response_body), mimetype="application/json")
 
+@app.function_name(name="AIStudioModelCatalogMetrics")
+@app.route(route="metrics", auth_level=func.AuthLevel.ANONYMOUS)
+async def prometheus_metrics(req: func.HttpRequest) -> func.HttpResponse:
+    """Prometheus metrics endpoint"""
+    body = METRICS.render(schedulers=describe_schedulers(), cache=RESPONSE_CACHE.stats.as_dict())
+    return func.HttpResponse(body, mimetype="text/plain; version=0.0.4")
+
 @app.function_name(name="AIStudioModelCatalogSkill")
 @app.route(route="custom_skill", auth_level=func.AuthLevel.ANONYMOUS)
 async def custom_skill(req: func.HttpRequest) -> func.HttpResponse:
     """Main custom skill endpoint"""
     start_time = time.time()
+    started_at = time.monotonic()
     
     try:
         # Validate request
@@ -202,61 +502,267 @@ async def custom_skill(req: func.HttpRequest) -> func.HttpResponse:
         if not input_values:
             raise CustomSkillException("Missing 'values' in request body", 400)
 
-        # Load prompts and create client
+        # Scenario label of the metrics, kept to the known scenarios
+        metric_scenario = scenario if scenario in {s.value for s in ScenarioType} else "unknown"
+
+        # Load prompts and get the pooled client
         custom_prompts = load_custom_prompts()
         config = ModelConfig()
+        deadline = Deadline(
+            budget=parse_deadline(req.headers.get("deadline-seconds"), config),
+            margin=config.deadline_margin,
+            started_at=started_at,
+        )
         
-        response_values = []
-        api_key = os.getenv("AZURE_INFERENCE_CREDENTIAL")
-        endpoint = os.getenv("AZURE_CHAT_COMPLETION_ENDPOINT")
-        headers = {
-        "Content-Type": "application/json",
-        "api-key": api_key,
-        "Authorization": f"Bearer {api_key}"
-        }
-        for request_body in input_values:
+        endpoints = load_endpoints()
+        if not endpoints:
+            raise CustomSkillException("No model endpoint configured", 500)
+        # Moving latency and error averages of the endpoints, shared across invocations
+        router = get_router(endpoints, config.router_config())
+        # Identifies the model for the response cache, whichever endpoint answers
+        model_name = ",".join(endpoint.url for endpoint in endpoints)
+
+        async def complete(messages: List[Dict[str, Any]]) -> str:
+            request_payload = {
+                "messages": messages,
+                "temperature": config.temperature,
+                "top_p": config.top_p,
+                "max_tokens": config.max_tokens
+            }
+
+            submitted_at = time.monotonic()
+            attempts = 0
+
+            # The service counts max_tokens against the TPM limit until the call reports its usage
+            estimated_tokens = estimate_message_tokens(messages) + config.max_tokens
+
+            async def call_endpoint(endpoint: Endpoint) -> Tuple[Dict[str, Any], float]:
+                # Shared keep-alive session, reused across invocations of this worker
+                session = get_session(endpoint.url, endpoint.credential, config.http_pool_size,
+                                      config.http_keepalive_timeout)
+                # Shared request/token budgets and adaptive concurrency for this endpoint
+                scheduler = get_scheduler(endpoint.url, config.rate_limit_config())
+                # Time of the HTTP round trip that answered, without admission waits and backoff
+                round_trip = 0.0
+
+                async def call_model() -> Dict[str, Any]:
+                    nonlocal attempts, round_trip
+                    sent_at = time.monotonic()
+                    if attempts == 0:
+                        METRICS.observe_stage(metric_scenario, "admission", sent_at - submitted_at)
+                    attempts += 1
+                    # The hedge timer only runs while the request is at the endpoint
+                    with in_flight():
+                        async with session.post(endpoint.url, json=request_payload) as vanilla_response:
+                            if vanilla_response.status == 429 or vanilla_response.status >= 500:
+                                raise RetryableError(
+                                    f"Model endpoint returned {vanilla_response.status}",
+                                    status_code=vanilla_response.status,
+                                    retry_after=parse_retry_after(vanilla_response.headers),
+                                )
+                            vanilla_response.raise_for_status()  # Will raise a ClientResponseError if the HTTP request returned an unsuccessful status code
+                            body = await vanilla_response.read()
+                            round_trip = time.monotonic() - sent_at
+                            METRICS.observe_round_trip(metric_scenario, round_trip, vanilla_response.headers)
+                    with METRICS.stage(metric_scenario, "parse"):
+                        return json.loads(body)
+
+                response_json = await scheduler.run(call_model, estimated_tokens)
+                scheduler.record_usage(estimated_tokens, (response_json.get("usage") or {}).get("total_tokens"))
+                return response_json, round_trip
+
+            # Endpoints are ranked and hedged on their round trips, not on the waits of the scheduler
+            vanilla_response_json, _ = await router.run(
+                call_endpoint, is_failure=endpoint_failure, latency=lambda result: result[1])
+            METRICS.add_usage(metric_scenario, vanilla_response_json.get("usage") or {})
+            return vanilla_response_json['choices'][0]['message']['content']
+
+        async def summarize_long_text(text: str) -> str:
+            summarize_prompt = custom_prompts.get("summarize-default-system-prompt")
+            reduce_prompt = custom_prompts.get("summarize-reduce-system-prompt")
+            return await map_reduce_summarize(
+                text,
+                summarize=lambda chunk: complete(text_messages(summarize_prompt, chunk)),
+                combine=lambda summaries: complete(text_messages(reduce_prompt, "\n\n".join(summaries))),
+                chunk_tokens=config.summary_chunk_tokens,
+                overlap_tokens=config.summary_chunk_overlap_tokens,
+                fan_out=config.summary_fan_out,
+            )
+
+        def is_long_summary(request_body: Dict[str, Any]) -> bool:
+            text = request_body.get("data", {}).get("text", "")
+            return (scenario == ScenarioType.SUMMARIZATION.value and config.summary_chunking
+                    and estimate_tokens(text) > config.summary_chunk_tokens)
+
+        def record_timeout(request_body: Dict[str, Any]) -> float:
+            if not is_long_summary(request_body):
+                return config.timeout
+            # A chunked summary makes several rounds of calls, each allowed the per-call timeout
+            chunks = split_by_tokens(request_body["data"]["text"], config.summary_chunk_tokens,
+                                     config.summary_chunk_overlap_tokens)
+            return config.timeout * summary_call_rounds(len(chunks), config.summary_fan_out)
+
+        def record_cache_key(request_body: Dict[str, Any], messages: List[Dict[str, Any]]) -> Optional[str]:
+            content = record_content(request_body)
+            if content is None or not RESPONSE_CACHE.enabled_for(config.temperature):
+                return None
+            if scenario == ScenarioType.IMAGE_CAPTIONING.value and config.image_prep:
+                # The model sees the prepared image, so its settings address the answer too
+                content += "\n" + config.image_prep_config().cache_material()
+            return cache_key(scenario, system_prompt_text(messages), model_name, config.temperature, content)
+
+        def format_record(request_body: Dict[str, Any], response_text: Union[str, List[str]]) -> Dict[str, Any]:
+            with METRICS.stage(metric_scenario, "format"):
+                return format_response(request_body, response_text, scenario)
+
+        async def process_record(request_body: Dict[str, Any], lookup_cache: bool = True) -> Dict[str, Any]:
+            with METRICS.stage(metric_scenario, "prepare"):
+                messages = prepare_messages(request_body, scenario, custom_prompts, config)
+                key = record_cache_key(request_body, messages)
+            if key is not None and lookup_cache:
+                cached_text = RESPONSE_CACHE.get(key)
+                if cached_text is not None:
+                    return format_record(request_body, cached_text)
+            if scenario == ScenarioType.IMAGE_CAPTIONING.value and config.image_prep:
+                with METRICS.stage(metric_scenario, "prepare"):
+                    # Decoding and resizing images is CPU bound, keep it off the event loop
+                    messages = await asyncio.to_thread(prepare_images, messages, config)
+
+            if is_long_summary(request_body):
+                response_text = await summarize_long_text(request_body["data"]["text"])
+            else:
+                response_text = await complete(messages)
+            if key is not None:
+                RESPONSE_CACHE.set(key, response_text)
+            return format_record(request_body, response_text)
+
+        async def process_pack(pack: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+            if len(pack) == 1:
+                return [await process_record(pack[0])]
+
+            # Answers are cached per record, under the same key as a single-record call
+            responses = {}
+            keys = {}
+            pending = []
+            for request_body in pack:
+                record_id = str(request_body.get("recordId"))
+                with METRICS.stage(metric_scenario, "prepare"):
+                    keys[record_id] = record_cache_key(
+                        request_body, prepare_messages(request_body, scenario, custom_prompts, config))
+                cached_text = RESPONSE_CACHE.get(keys[record_id]) if keys[record_id] is not None else None
+                if cached_text is not None:
+                    responses[record_id] = format_record(request_body, cached_text)
+                else:
+                    pending.append(request_body)
+
+            answers = {}
+            if len(pending) > 1:
+                packed_messages = text_messages(
+                    custom_prompts.get("entity-recognition-packed-system-prompt"),
+                    packed_user_content(pending),
+                )
+                try:
+                    async with asyncio.timeout(config.timeout):
+                        packed_text = await complete(packed_messages)
+                    answers = answers_by_record_id(pending, parse_packed_entities(packed_text))
+                except Exception as e:
+                    # A failed or unparsable packed call costs a round trip, not the records
+                    logger.warning(f"Packed call for {len(pending)} records failed, falling back: {e!r}")
+
+            fallback = []
+            for request_body in pending:
+                record_id = str(request_body.get("recordId"))
+                if record_id not in answers:
+                    fallback.append(request_body)
+                    continue
+                if keys[record_id] is not None:
+                    RESPONSE_CACHE.set(keys[record_id], json.dumps(answers[record_id]))
+                responses[record_id] = format_record(request_body, answers[record_id])
+
+            if fallback:
+                if len(pending) > 1:
+                    logger.info(f"{len(fallback)} of {len(pending)} packed records fall back to a call of their own")
+                results = await asyncio.gather(*(fallback_record(request_body) for request_body in fallback))
+                for request_body, result in zip(fallback, results):
+                    responses[str(request_body.get("recordId"))] = result
+            return [responses[str(request_body.get("recordId"))] for request_body in pack]
+
+        async def fallback_record(request_body: Dict[str, Any]) -> Dict[str, Any]:
+            # Each fallback gets a timeout of its own; the pack already looked it up in the cache
             try:
-                messages = prepare_messages(request_body, scenario, custom_prompts)
-                request_payload = {
-                    "messages": messages,
-                    "temperature": config.temperature,
-                    "top_p": config.top_p,
-                    "max_tokens": config.max_tokens
-                }
-                # Call model with timeout
                 async with asyncio.timeout(config.timeout):
-                    vanilla_response = requests.post(endpoint, headers=headers, json=request_payload)
-                    vanilla_response.raise_for_status()  # Will raise an HTTPError if the HTTP request returned an unsuccessful status code
-                    vanilla_response_json = vanilla_response.json()
-                    response_text = vanilla_response_json['choices'][0]['message']['content']
-                # Format response
-                response_values.append(format_response(request_body, response_text, scenario))
-                
-            except asyncio.TimeoutError:
-                logger.error(f"Timeout processing record {request_body.get('recordId')}")
-                response_values.append({
-                    "recordId": request_body.get("recordId"),
-                    "errors": ["Request timeout"],
-                    "warnings": None,
-                    "data": None
-                })
+                    return await process_record(request_body, lookup_cache=False)
+            except TimeoutError:
+                return timeout_response(request_body)
             except Exception as e:
-                logger.error(f"Error processing record {request_body.get('recordId')}: {e}")
-                response_values.append({
-                    "recordId": request_body.get("recordId"),
-                    "errors": [str(e)],
-                    "warnings": None,
-                    "data": None
-                })
+                return error_response(request_body, e)
+
+        def pack_timeout(pack: List[Dict[str, Any]]) -> float:
+            # The packed call and the fallbacks after it are each allowed the per-call timeout
+            return config.timeout if len(pack) == 1 else 2 * config.timeout
+
+        def timed(worker, records=lambda item: 1):
+            async def run(item):
+                # Every record of the request is queued when the batch starts
+                for _ in range(records(item)):
+                    METRICS.observe_stage(metric_scenario, "queue", time.monotonic() - started_at)
+                try:
+                    return await worker(item)
+                finally:
+                    for _ in range(records(item)):
+                        METRICS.record_seconds.observe(time.monotonic() - started_at, scenario=metric_scenario)
+            return run
+
+        # Duplicate records are answered from the first record with the same content
+        unique_values, owners = group_duplicates(
+            input_values, record_content if config.dedup_records else lambda request_body: None)
+        skipped_calls = len(input_values) - len(unique_values)
+
+        if scenario == ScenarioType.ENTITY_RECOGNITION.value and config.entity_packing:
+            # Short records share one model call; each pack keeps the input order
+            packs = pack_records(unique_values, config.entity_pack_max_tokens, config.entity_pack_max_records)
+            pack_values = await run_bounded(
+                packs,
+                timed(process_pack, records=len),
+                max_concurrency=config.max_concurrency,
+                timeout=config.timeout,
+                on_timeout=lambda pack: [timeout_response(request_body) for request_body in pack],
+                on_error=lambda pack, e: [error_response(request_body, e) for request_body in pack],
+                deadline=deadline,
+                on_deadline=lambda pack: [deadline_response(request_body) for request_body in pack],
+                item_records=len,
+                item_timeout=pack_timeout,
+            )
+            unique_responses = [response for pack_responses in pack_values for response in pack_responses]
+        else:
+            # Records are sent to the model concurrently; results keep the input order
+            unique_responses = await run_bounded(
+                unique_values,
+                timed(process_record),
+                max_concurrency=config.max_concurrency,
+                timeout=config.timeout,
+                on_timeout=timeout_response,
+                on_error=error_response,
+                deadline=deadline,
+                on_deadline=deadline_response,
+                item_timeout=record_timeout,
+            )
+        response_values = fan_out(input_values, unique_responses, owners)
+        BUDGET_STATS.record(deadline, len(input_values))
+        METRICS.deduplicated.inc(skipped_calls, scenario=metric_scenario)
+        for response_body in response_values:
+            METRICS.records.inc(scenario=metric_scenario, outcome=record_outcome(response_body))
 
         # Log processing time
         processing_time = time.time() - start_time
-        logger.info(f"Processed {len(input_values)} records in {processing_time:.2f} seconds")
+        logger.info(f"Processed {len(input_values)} records in {processing_time:.2f} seconds"
+                    f" ({skipped_calls} duplicate records answered without a model call)")
         
         # Return response
         return func.HttpResponse(
             json.dumps({"values": response_values}),
-            mimetype="application/json"
+            mimetype="application/json",
+            headers={"deduplicated-records": str(skipped_calls)}
         )
         
     except CustomSkillException as e:
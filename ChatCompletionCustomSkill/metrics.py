@@ -0,0 +1,189 @@
+import bisect
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Mapping, Optional, Sequence, Tuple
+
+# Latency buckets in seconds, from a cache hit up to the custom skill timeout
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 230)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Counter:
+    """Monotonic count, one series per combination of label values."""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[LabelValues, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(tuple(str(labels[name]) for name in self.labelnames), 0)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    """Cumulative bucket counts, sum and count, one series per combination of label values."""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per series: counts per bucket (plus one for +Inf), sum of observations
+        self._series: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._series.setdefault(key, ([0] * (len(self.buckets) + 1), [0.0]))
+            counts[index] += 1
+            total[0] += value
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def count(self, **labels: str) -> int:
+        series = self._series.get(tuple(str(labels[name]) for name in self.labelnames))
+        return sum(series[0]) if series else 0
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        names = self.labelnames + ("le",)
+        with self._lock:
+            for key, (counts, total) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (math.inf,), counts):
+                    cumulative += count
+                    labels = _format_labels(names, key + (_format_value(bound),))
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                labels = _format_labels(self.labelnames, key)
+                lines.append(f"{self.name}_sum{labels} {_format_value(total[0])}")
+                lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+def server_processing_seconds(headers: Optional[Mapping[str, str]]) -> Optional[float]:
+    """Time the model service reports it spent on a call, from the openai-processing-ms header."""
+    value = (headers or {}).get("openai-processing-ms")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value) / 1000)
+    except ValueError:
+        return None
+
+
+class SkillMetrics:
+    """Per-stage latency, token and outcome metrics of a skill, rendered in Prometheus text format.
+
+    Stages of a record are prepare (building the messages), queue (waiting for
+    a concurrency slot in the request), admission (waiting for the rate
+    limiter), network and model (the model call round trip, split by the
+    processing time the service reports), parse (decoding the answer) and
+    format (building the record response).
+    """
+
+    def __init__(self):
+        self.stage_seconds = Histogram(
+            "skill_stage_seconds", "Time records spend in each processing stage", ("scenario", "stage"))
+        self.record_seconds = Histogram(
+            "skill_record_seconds", "End to end time per record", ("scenario",))
+        self.records = Counter(
+            "skill_records_total", "Records processed by outcome", ("scenario", "outcome"))
+        self.tokens = Counter(
+            "skill_tokens_total", "Tokens reported in the usage of model calls", ("scenario", "kind"))
+        self.deduplicated = Counter(
+            "skill_deduplicated_records_total",
+            "Records answered from an identical record in the same batch, without a model call", ("scenario",))
+
+    def observe_stage(self, scenario: str, stage: str, seconds: float) -> None:
+        self.stage_seconds.observe(seconds, scenario=scenario, stage=stage)
+
+    def stage(self, scenario: str, stage: str):
+        return self.stage_seconds.time(scenario=scenario, stage=stage)
+
+    def observe_round_trip(self, scenario: str, seconds: float,
+                           headers: Optional[Mapping[str, str]]) -> None:
+        """Split a model call round trip into model and network time.
+
+        Without a processing time header from the service the whole round
+        trip is counted as model time.
+        """
+        processing = server_processing_seconds(headers)
+        if processing is None:
+            self.observe_stage(scenario, "model", seconds)
+            return
+        processing = min(processing, seconds)
+        self.observe_stage(scenario, "model", processing)
+        self.observe_stage(scenario, "network", seconds - processing)
+
+    def add_usage(self, scenario: str, usage: Optional[Mapping[str, Any]]) -> None:
+        if not usage:
+            return
+        for kind in ("prompt_tokens", "completion_tokens"):
+            if usage.get(kind) is not None:
+                self.tokens.inc(usage[kind], scenario=scenario, kind=kind.split("_")[0])
+
+    def render(self, schedulers: Optional[Mapping[str, Mapping[str, Any]]] = None,
+               cache: Optional[Mapping[str, Any]] = None) -> str:
+        """Prometheus text exposition of every metric, plus the rate limiter and cache counters."""
+        lines = []
+        for metric in (self.stage_seconds, self.record_seconds, self.records, self.tokens,
+                       self.deduplicated):
+            lines.extend(metric.render())
+        for stat, documentation in (
+            ("calls", "Model call attempts"),
+            ("retries", "Model calls retried after a throttled or transient failure"),
+            ("throttled", "Model calls throttled by the service"),
+            ("failures", "Model calls that failed after all retries"),
+        ):
+            name = f"skill_model_{stat}_total"
+            lines += [f"# HELP {name} {documentation}", f"# TYPE {name} counter"]
+            for endpoint, stats in sorted((schedulers or {}).items()):
+                lines.append(f"{name}{_format_labels(('endpoint',), (endpoint,))} {stats[stat]}")
+        if cache is not None:
+            for stat in ("hits", "misses"):
+                name = f"skill_cache_{stat}_total"
+                lines += [f"# HELP {name} Response cache {stat}", f"# TYPE {name} counter",
+                          f"{name} {cache[stat]}"]
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,87 @@
+import json
+import logging
+from typing import Any, Dict, Iterable, List, Tuple, TypeVar
+
+from tokens import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Estimated tokens of the JSON wrapping added around each packed record
+PACKED_RECORD_OVERHEAD_TOKENS = 12
+
+
+def record_text(request_body: Dict[str, Any]) -> str:
+    return (request_body.get("data") or {}).get("text") or ""
+
+
+def pack_records(
+    records: List[Dict[str, Any]], max_tokens: int, max_records: int
+) -> List[List[Dict[str, Any]]]:
+    """Group consecutive text records into packs that are sent as one model call.
+
+    A pack holds at most max_records records and max_tokens estimated input
+    tokens. Records without text, records that do not fit the token budget on
+    their own and repeated recordIds end up in a pack of their own, so they
+    take the regular one-call-per-record path. Packs keep the input order.
+    """
+    packs: List[List[Dict[str, Any]]] = []
+    pack_tokens = 0
+    pack_ids = set()
+    for record in records:
+        text = record_text(record)
+        tokens = estimate_tokens(text) + PACKED_RECORD_OVERHEAD_TOKENS
+        record_id = str(record.get("recordId"))
+        packable = bool(text) and tokens <= max_tokens
+        if (
+            packable
+            and packs
+            and pack_ids
+            and len(packs[-1]) < max_records
+            and pack_tokens + tokens <= max_tokens
+            and record_id not in pack_ids
+        ):
+            packs[-1].append(record)
+            pack_tokens += tokens
+            pack_ids.add(record_id)
+            continue
+        packs.append([record])
+        # A record that cannot be packed closes its pack right away
+        pack_tokens = tokens if packable else 0
+        pack_ids = {record_id} if packable else set()
+    return packs
+
+
+def packed_user_content(records: List[Dict[str, Any]]) -> str:
+    """User message for a pack: a JSON array of recordId and text pairs."""
+    return json.dumps(
+        [{"recordId": str(record.get("recordId")), "text": record_text(record)} for record in records],
+        ensure_ascii=False,
+    )
+
+
+def answers_by_record_id(
+    records: List[Dict[str, Any]], answers: Iterable[Tuple[Any, T]]
+) -> Dict[str, T]:
+    """Match the per-record answers of a packed call back to the packed records.
+
+    Answers for unknown recordIds are dropped, and a recordId answered more
+    than once is treated as unanswered since there is no telling which answer
+    is right; callers fall back to a call of its own for every record missing
+    from the result.
+    """
+    expected = {str(record.get("recordId")) for record in records}
+    matched: Dict[str, T] = {}
+    repeated = set()
+    for record_id, answer in answers:
+        record_id = str(record_id)
+        if record_id not in expected:
+            logger.warning(f"Packed answer for unknown record {record_id} ignored")
+        elif record_id in matched:
+            repeated.add(record_id)
+        else:
+            matched[record_id] = answer
+    for record_id in repeated:
+        del matched[record_id]
+    return matched
@@ -0,0 +1,197 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import Any, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class CacheMode(Enum):
+    OFF = "off"
+    # Only cache calls made with temperature 0, where the answer is reproducible
+    DETERMINISTIC = "deterministic"
+    # Cache every call and treat the first answer as the canonical one
+    CANONICAL = "canonical"
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    memory_hits: int = 0
+    disk_hits: int = 0
+
+    def as_dict(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+def normalize_text(text: str) -> str:
+    """Collapse whitespace so formatting-only differences share a cache entry."""
+    return " ".join(text.split())
+
+
+def cache_key(scenario: str, system_prompt: str, model: str, temperature: float,
+              content: str) -> str:
+    """Content address for a model call: a digest of everything that shapes the answer."""
+    material = json.dumps(
+        [scenario, system_prompt or "", model or "", round(float(temperature), 4), content],
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+def record_content(request_body: Dict[str, Any]) -> Optional[str]:
+    """The part of a skill record that is sent to the model, or None if there is none."""
+    data = request_body.get("data") or {}
+    text = data.get("text")
+    if text:
+        return "text:" + normalize_text(text)
+    image = data.get("image") or {}
+    if image.get("data"):
+        # The base64 payload addresses the image bytes without decoding them again
+        return "image:" + "".join(image["data"].split())
+    if image.get("url"):
+        return "image-url:" + image["url"]
+    return None
+
+
+class MemoryTier:
+    """In-process LRU with a per-entry time to live."""
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: str) -> None:
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class SqliteTier:
+    """On-disk tier that survives worker restarts."""
+
+    def __init__(self, path: str, ttl_seconds: float):
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses "
+                "(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, expires_at = row
+            if expires_at < time.time():
+                with self._conn:
+                    self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                return None
+            return value
+
+    def set(self, key: str, value: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, value, time.time() + self.ttl_seconds),
+            )
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+@dataclass
+class ResponseCache:
+    mode: CacheMode
+    memory: MemoryTier
+    disk: Optional[SqliteTier] = None
+    stats: CacheStats = field(default_factory=CacheStats)
+
+    @classmethod
+    def from_env(cls) -> "ResponseCache":
+        ttl_seconds = float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "86400"))
+        sqlite_path = os.getenv("RESPONSE_CACHE_SQLITE_PATH")
+        return cls(
+            mode=CacheMode(os.getenv("RESPONSE_CACHE_MODE", CacheMode.DETERMINISTIC.value).lower()),
+            memory=MemoryTier(int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1024")), ttl_seconds),
+            disk=SqliteTier(sqlite_path, ttl_seconds) if sqlite_path else None,
+        )
+
+    def enabled_for(self, temperature: float) -> bool:
+        if self.mode == CacheMode.CANONICAL:
+            return True
+        return self.mode == CacheMode.DETERMINISTIC and temperature == 0
+
+    def get(self, key: str) -> Optional[str]:
+        value = self.memory.get(key)
+        if value is not None:
+            self.stats.hits += 1
+            self.stats.memory_hits += 1
+            return value
+        if self.disk is not None:
+            value = self.disk.get(key)
+            if value is not None:
+                # Promote so the next lookup is served from memory
+                self.memory.set(key, value)
+                self.stats.hits += 1
+                self.stats.disk_hits += 1
+                return value
+        self.stats.misses += 1
+        return None
+
+    def set(self, key: str, value: str) -> None:
+        self.memory.set(key, value)
+        if self.disk is not None:
+            try:
+                self.disk.set(key, value)
+            except sqlite3.Error as e:
+                logger.warning(f"Failed to write response cache entry to disk: {e}")
+
+    def describe(self) -> Dict[str, Any]:
+        """Summary of the cache state for the health endpoint."""
+        return {
+            "mode": self.mode.value,
+            "memory_entries": len(self.memory),
+            "disk_tier": self.disk is not None,
+            **self.stats.as_dict(),
+        }
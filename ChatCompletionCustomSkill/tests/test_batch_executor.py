@@ -0,0 +1,172 @@
+import asyncio
+import time
+import unittest
+
+from batch_executor import BudgetStats, Deadline, run_bounded
+
+
+def on_timeout(item):
+    return ("timeout", item)
+
+
+def on_error(item, error):
+    return ("error", item, str(error))
+
+
+def on_deadline(item):
+    return ("deadline", item)
+
+
+class TestRunBounded(unittest.IsolatedAsyncioTestCase):
+    async def test_results_keep_input_order(self):
+        async def worker(item):
+            # later items finish first
+            await asyncio.sleep(0.01 * (5 - item))
+            return item * 10
+
+        results = await run_bounded(
+            list(range(5)), worker, max_concurrency=5, timeout=1,
+            on_timeout=on_timeout, on_error=on_error,
+        )
+        self.assertEqual(results, [0, 10, 20, 30, 40])
+
+    async def test_records_run_concurrently(self):
+        async def worker(item):
+            await asyncio.sleep(0.1)
+            return item
+
+        start = time.monotonic()
+        await run_bounded(
+            list(range(20)), worker, max_concurrency=20, timeout=1,
+            on_timeout=on_timeout, on_error=on_error,
+        )
+        self.assertLess(time.monotonic() - start, 0.5)
+
+    async def test_concurrency_is_bounded(self):
+        in_flight = 0
+        peak = 0
+
+        async def worker(item):
+            nonlocal in_flight, peak
+            in_flight += 1
+            peak = max(peak, in_flight)
+            await asyncio.sleep(0.01)
+            in_flight -= 1
+            return item
+
+        await run_bounded(
+            list(range(30)), worker, max_concurrency=4, timeout=1,
+            on_timeout=on_timeout, on_error=on_error,
+        )
+        self.assertEqual(peak, 4)
+
+    async def test_timeout_cancels_slow_record(self):
+        cancelled = asyncio.Event()
+
+        async def worker(item):
+            if item == 1:
+                try:
+                    await asyncio.sleep(10)
+                except asyncio.CancelledError:
+                    cancelled.set()
+                    raise
+            return item
+
+        results = await run_bounded(
+            [0, 1, 2], worker, max_concurrency=3, timeout=0.05,
+            on_timeout=on_timeout, on_error=on_error,
+        )
+        self.assertEqual(results, [0, ("timeout", 1), 2])
+        self.assertTrue(cancelled.is_set())
+
+    async def test_item_timeout_overrides_the_timeout(self):
+        async def worker(item):
+            await asyncio.sleep(0.1)
+            return item
+
+        results = await run_bounded(
+            [0, 1], worker, max_concurrency=2, timeout=0.05,
+            on_timeout=on_timeout, on_error=on_error,
+            item_timeout=lambda item: 1 if item == 1 else 0.05,
+        )
+        self.assertEqual(results, [("timeout", 0), 1])
+
+    async def test_errors_are_isolated_per_record(self):
+        async def worker(item):
+            if item == 0:
+                raise ValueError("bad record")
+            return item
+
+        results = await run_bounded(
+            [0, 1], worker, max_concurrency=2, timeout=1,
+            on_timeout=on_timeout, on_error=on_error,
+        )
+        self.assertEqual(results, [("error", 0, "bad record"), 1])
+
+
+class TestDeadline(unittest.IsolatedAsyncioTestCase):
+    async def test_pending_records_are_cancelled_at_the_deadline(self):
+        async def worker(item):
+            await asyncio.sleep(0.05 if item < 2 else 5)
+            return item
+
+        deadline = Deadline(budget=0.3, margin=0.1)
+        start = time.monotonic()
+        results = await run_bounded(
+            [0, 1, 2, 3], worker, max_concurrency=4, timeout=10,
+            on_timeout=on_timeout, on_error=on_error,
+            deadline=deadline, on_deadline=on_deadline,
+        )
+        self.assertLess(time.monotonic() - start, 0.3)
+        self.assertEqual(results, [0, 1, ("deadline", 2), ("deadline", 3)])
+        self.assertEqual(deadline.expired_records, 2)
+
+    async def test_queued_records_do_not_wait_past_the_deadline(self):
+        async def worker(item):
+            await asyncio.sleep(0.1)
+            return item
+
+        results = await run_bounded(
+            list(range(6)), worker, max_concurrency=2, timeout=10,
+            on_timeout=on_timeout, on_error=on_error,
+            deadline=Deadline(budget=0.15), on_deadline=on_deadline,
+        )
+        self.assertEqual(results[:2], [0, 1])
+        self.assertEqual(results[2:], [("deadline", item) for item in range(2, 6)])
+
+    async def test_record_timeout_is_still_reported_as_timeout(self):
+        async def worker(item):
+            await asyncio.sleep(5)
+
+        results = await run_bounded(
+            [0], worker, max_concurrency=1, timeout=0.05,
+            on_timeout=on_timeout, on_error=on_error,
+            deadline=Deadline(budget=10), on_deadline=on_deadline,
+        )
+        self.assertEqual(results, [("timeout", 0)])
+
+    async def test_expired_packs_count_each_of_their_records(self):
+        async def worker(pack):
+            await asyncio.sleep(5)
+
+        deadline = Deadline(budget=0.05)
+        results = await run_bounded(
+            [[0, 1, 2], [3]], worker, max_concurrency=2, timeout=10,
+            on_timeout=on_timeout, on_error=on_error,
+            deadline=deadline, on_deadline=on_deadline, item_records=len,
+        )
+        self.assertEqual(results, [("deadline", [0, 1, 2]), ("deadline", [3])])
+        self.assertEqual(deadline.expired_records, 4)
+
+    def test_budget_stats(self):
+        stats = BudgetStats()
+        stats.record(Deadline(budget=10, started_at=time.monotonic() - 5, expired_records=1), records=4)
+        stats.record(Deadline(budget=10, started_at=time.monotonic() - 1), records=2)
+        summary = stats.describe()
+        self.assertEqual((summary["batches"], summary["records"], summary["expired_records"]), (2, 6, 1))
+        self.assertAlmostEqual(summary["max_budget_used"], 0.5, places=2)
+        self.assertAlmostEqual(summary["mean_budget_used"], 0.3, places=2)
+
+
+if __name__ == "__main__":
+    unittest.main()
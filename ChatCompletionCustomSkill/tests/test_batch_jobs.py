@@ -0,0 +1,115 @@
+import json
+import os
+import tempfile
+import unittest
+
+from batch_jobs import (
+    NO_RESULT_ERROR,
+    LocalBatchBackend,
+    collect,
+    prepare,
+    read_skill_records,
+    submit,
+    write_request_files,
+)
+
+
+def request_body(record):
+    text = record["data"].get("text")
+    if not text:
+        raise ValueError("Missing text")
+    return {"messages": [{"role": "user", "content": text}]}
+
+
+def error_response(request_body, error):
+    return {"recordId": request_body["recordId"], "errors": [str(error)], "warnings": None, "data": None}
+
+
+def record_response(request_body, completion):
+    return {"recordId": request_body["recordId"], "errors": [], "warnings": None,
+            "data": {"text": completion["choices"][0]["message"]["content"]}}
+
+
+def echo(body):
+    content = body["messages"][0]["content"]
+    if content == "boom":
+        raise RuntimeError("model error")
+    return {"choices": [{"message": {"role": "assistant", "content": content.upper()}}]}
+
+
+def record(record_id, text):
+    return {"recordId": record_id, "data": {"text": text}}
+
+
+class TestFiles(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def test_request_files_are_split_by_count_and_size(self):
+        requests = [{"custom_id": str(i), "body": "x" * 10} for i in range(5)]
+        self.assertEqual(len(write_request_files(requests, self.directory.name, max_requests=2)), 3)
+        paths = write_request_files(requests, self.directory.name, prefix="small", max_bytes=70)
+        self.assertEqual(len(paths), 5)
+        with open(paths[0], encoding="utf-8") as file:
+            self.assertEqual(json.loads(file.read())["custom_id"], "0")
+
+    def test_reads_records_and_request_bodies(self):
+        path = os.path.join(self.directory.name, "records.jsonl")
+        with open(path, "w", encoding="utf-8") as file:
+            file.write(json.dumps(record("1", "a")) + "\n\n")
+            file.write(json.dumps({"values": [record("2", "b"), record("3", "c")]}) + "\n")
+        self.assertEqual([r["recordId"] for r in read_skill_records(path)], ["1", "2", "3"])
+
+        with open(path, "a", encoding="utf-8") as file:
+            file.write("[1, 2]\n")
+        with self.assertRaisesRegex(ValueError, "records.jsonl:4"):
+            list(read_skill_records(path))
+
+
+class TestBulkRun(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.work_dir = os.path.join(self.directory.name, "work")
+        self.output = os.path.join(self.directory.name, "output.jsonl")
+        self.backend = LocalBatchBackend(os.path.join(self.directory.name, "jobs"), echo)
+
+    def run_bulk(self, records, key=lambda r: r["data"].get("text")):
+        stats = prepare(records, request_body, error_response, self.work_dir, key=key)
+        submit(self.backend, self.work_dir)
+        collect(self.backend, self.work_dir, self.output, record_response, error_response, poll_interval=0)
+        with open(self.output, encoding="utf-8") as file:
+            return stats, {row["recordId"]: row for row in map(json.loads, file)}
+
+    def test_duplicates_share_a_request_and_every_record_gets_a_response(self):
+        stats, responses = self.run_bulk([
+            record("1", "hello"), record("2", "world"), record("3", "hello"), record("4", ""), record("5", "boom"),
+        ])
+        self.assertEqual((stats.records, stats.requests, stats.deduplicated, stats.invalid), (5, 3, 1, 1))
+        self.assertEqual(responses["1"]["data"], {"text": "HELLO"})
+        self.assertEqual(responses["3"]["data"], {"text": "HELLO"})
+        self.assertEqual(responses["2"]["data"], {"text": "WORLD"})
+        self.assertEqual(responses["4"]["errors"], ["Missing text"])
+        self.assertIn("model error", responses["5"]["errors"][0])
+
+    def test_submit_is_resumable(self):
+        prepare([record("1", "a")], request_body, error_response, self.work_dir)
+        jobs = submit(self.backend, self.work_dir)
+        self.assertEqual(submit(self.backend, self.work_dir), jobs)
+
+    def test_records_missing_from_the_output_get_an_error(self):
+        backend = self.backend
+
+        class DroppingBackend(LocalBatchBackend):
+            def results(self, job_id):
+                return (result for result in super().results(job_id) if result["custom_id"] != "request-1")
+
+        self.backend = DroppingBackend(backend.directory, echo)
+        _, responses = self.run_bulk([record("1", "a"), record("2", "b")], key=None)
+        self.assertEqual(responses["1"]["data"], {"text": "A"})
+        self.assertEqual(responses["2"]["errors"], [NO_RESULT_ERROR])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+import base64
+import io
+import json
+import os
+import tempfile
+import unittest
+
+from PIL import Image
+
+from batch_jobs import INVALID_FILE, prepare
+from bulk import request_body_builder
+from function_app import ModelConfig, error_response
+from response_cache import record_content
+
+
+def png(width, height):
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, height), (200, 10, 10)).save(buffer, "PNG")
+    return base64.b64encode(buffer.getvalue()).decode("ascii")
+
+
+def image_record(record_id, data):
+    return {"recordId": record_id, "data": {"image": {"data": data, "contentType": "image/png"}}}
+
+
+def data_urls(value):
+    """Every data URL in a request body."""
+    if isinstance(value, dict):
+        return [url for item in value.values() for url in data_urls(item)]
+    if isinstance(value, list):
+        return [url for item in value for url in data_urls(item)]
+    return [value] if isinstance(value, str) and value.startswith("data:") else []
+
+
+class TestImageRequests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def request_body(self):
+        return request_body_builder("image-captioning", "batch", ModelConfig())
+
+    def prepare_images(self, records):
+        stats = prepare(records, self.request_body(), error_response, self.directory.name, key=record_content)
+        with open(os.path.join(self.directory.name, "requests-0000.jsonl"), encoding="utf-8") as file:
+            requests = [json.loads(line) for line in file]
+        with open(os.path.join(self.directory.name, INVALID_FILE), encoding="utf-8") as file:
+            invalid = [json.loads(line) for line in file]
+        return stats, requests, invalid
+
+    def test_invalid_images_are_not_submitted(self):
+        stats, requests, invalid = self.prepare_images([image_record("1", png(20, 10)), image_record("2", "not base64!")])
+        self.assertEqual((stats.requests, stats.invalid), (1, 1))
+        self.assertEqual(len(requests), 1)
+        self.assertEqual(invalid[0]["recordId"], "2")
+        self.assertIn("Invalid base64", json.dumps(invalid[0]["errors"]))
+
+    def test_large_images_are_downscaled(self):
+        _, requests, _ = self.prepare_images([image_record("1", png(4000, 3000))])
+        url, = data_urls(requests[0]["body"])
+        self.assertTrue(url.startswith("data:image/jpeg;base64,"))
+        image = Image.open(io.BytesIO(base64.b64decode(url.split(",", 1)[1])))
+        self.assertEqual(image.size, (1024, 768))
+
+
+if __name__ == "__main__":
+    unittest.main()
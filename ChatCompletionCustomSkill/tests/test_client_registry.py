@@ -0,0 +1,38 @@
+import unittest
+
+import client_registry
+from client_registry import close_all, get_session
+
+
+class TestClientRegistry(unittest.IsolatedAsyncioTestCase):
+    async def asyncTearDown(self):
+        await close_all()
+
+    async def test_session_is_reused_for_same_endpoint_and_key(self):
+        first = get_session("https://example/chat", "key-1", pool_size=10, keepalive_timeout=30)
+        second = get_session("https://example/chat", "key-1", pool_size=10, keepalive_timeout=30)
+        self.assertIs(first, second)
+
+    async def test_separate_sessions_per_credential(self):
+        first = get_session("https://example/chat", "key-1", pool_size=10, keepalive_timeout=30)
+        second = get_session("https://example/chat", "key-2", pool_size=10, keepalive_timeout=30)
+        self.assertIsNot(first, second)
+
+    async def test_pool_is_sized_from_config(self):
+        session = get_session("https://example/chat", "key-1", pool_size=7, keepalive_timeout=30)
+        self.assertEqual(session.connector.limit, 7)
+
+    async def test_credential_is_not_stored_in_key(self):
+        get_session("https://example/chat", "secret-key", pool_size=10, keepalive_timeout=30)
+        for endpoint, credential in client_registry._sessions:
+            self.assertNotIn("secret-key", credential)
+
+    async def test_close_all_closes_sessions(self):
+        session = get_session("https://example/chat", "key-1", pool_size=10, keepalive_timeout=30)
+        await close_all()
+        self.assertTrue(session.closed)
+        self.assertIsNot(session, get_session("https://example/chat", "key-1", pool_size=10, keepalive_timeout=30))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,53 @@
+import unittest
+
+from dedup import fan_out, group_duplicates
+from response_cache import record_content
+
+
+def record(record_id, text):
+    return {"recordId": record_id, "data": {"text": text}}
+
+
+class TestGroupDuplicates(unittest.TestCase):
+    def test_records_with_the_same_content_share_the_first_record(self):
+        records = [record("a", "Disclaimer"), record("b", "Body"), record("c", "Disclaimer  "),
+                   record("d", "Body"), record("e", "Other")]
+        unique, owners = group_duplicates(records, record_content)
+        self.assertEqual([r["recordId"] for r in unique], ["a", "b", "e"])
+        self.assertEqual(owners, [0, 1, 0, 1, 2])
+
+    def test_records_without_content_are_never_duplicates(self):
+        records = [{"recordId": "a", "data": {}}, {"recordId": "b", "data": {}}, record("c", "x")]
+        unique, owners = group_duplicates(records, record_content)
+        self.assertEqual(unique, records)
+        self.assertEqual(owners, [0, 1, 2])
+
+    def test_images_are_keyed_by_their_payload(self):
+        records = [
+            {"recordId": "a", "data": {"image": {"data": "aGVsbG8=", "contentType": "image/png"}}},
+            {"recordId": "b", "data": {"image": {"data": "aGVsbG8=", "contentType": "image/png"}}},
+            {"recordId": "c", "data": {"image": {"data": "d29ybGQ=", "contentType": "image/png"}}},
+        ]
+        unique, owners = group_duplicates(records, record_content)
+        self.assertEqual(len(unique), 2)
+        self.assertEqual(owners, [0, 0, 1])
+
+
+class TestFanOut(unittest.TestCase):
+    def test_duplicates_get_the_response_under_their_own_record_id(self):
+        records = [record("a", "x"), record("b", "y"), record("c", "x")]
+        unique, owners = group_duplicates(records, record_content)
+        unique_responses = [
+            {"recordId": r["recordId"], "data": {"entities": r["data"]["text"]}, "errors": None, "warnings": None}
+            for r in unique
+        ]
+        responses = fan_out(records, unique_responses, owners)
+        self.assertEqual([r["recordId"] for r in responses], ["a", "b", "c"])
+        self.assertEqual(responses[2]["data"], {"entities": "x"})
+        # The response of the unique record itself is left untouched
+        self.assertIs(responses[0], unique_responses[0])
+        self.assertEqual(unique_responses[0]["recordId"], "a")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,234 @@
+import asyncio
+import time
+import unittest
+
+import endpoint_router
+from endpoint_router import Endpoint, EndpointRouter, RouterConfig, get_router, in_flight, parse_endpoints
+
+FAST = Endpoint("https://fast", "k1")
+SLOW = Endpoint("https://slow", "k2")
+
+
+class TestParseEndpoints(unittest.TestCase):
+    def test_credentials_are_matched_by_position(self):
+        endpoints = parse_endpoints("https://a, https://b,https://c", "ka,,", "default")
+        self.assertEqual(endpoints, [
+            Endpoint("https://a", "ka"), Endpoint("https://b", "default"), Endpoint("https://c", "default"),
+        ])
+
+    def test_no_urls(self):
+        self.assertEqual(parse_endpoints(None, None, "k"), [])
+
+
+class TestRanking(unittest.TestCase):
+    def test_unmeasured_endpoints_are_probed_then_the_fastest_wins(self):
+        router = EndpointRouter([SLOW, FAST], RouterConfig())
+        router.health[SLOW.url].record_success(2.0)
+        self.assertEqual(router.ranked()[0], FAST)
+        router.health[FAST.url].record_success(0.1)
+        self.assertEqual(router.ranked(), [FAST, SLOW])
+
+    def test_errors_push_an_endpoint_down(self):
+        router = EndpointRouter([FAST, SLOW], RouterConfig(failure_threshold=10))
+        router.health[FAST.url].record_success(0.1)
+        router.health[SLOW.url].record_success(0.25)
+        for _ in range(3):
+            router.health[FAST.url].record_failure(time.monotonic())
+        self.assertEqual(router.ranked()[0], SLOW)
+
+    def test_circuit_opens_after_consecutive_failures_and_half_opens_after_cooldown(self):
+        router = EndpointRouter([FAST, SLOW], RouterConfig(failure_threshold=2, cooldown=10))
+        health = router.health[FAST.url]
+        now = time.monotonic()
+        self.assertFalse(health.record_failure(now))
+        self.assertTrue(health.record_failure(now))
+        self.assertEqual(router.ranked(), [SLOW, FAST])
+        self.assertEqual(health.describe(now)["circuit"], "open")
+
+        # Half-open: a single failed trial opens the circuit again
+        health.open_until = now
+        self.assertEqual(health.describe(now)["circuit"], "half-open")
+        self.assertTrue(health.record_failure(now))
+        health.open_until = now
+        health.record_success(0.1)
+        self.assertEqual(health.describe(now)["circuit"], "closed")
+
+
+class TestRun(unittest.IsolatedAsyncioTestCase):
+    async def test_fails_over_to_the_next_endpoint(self):
+        router = EndpointRouter([FAST, SLOW], RouterConfig())
+        calls = []
+
+        async def call(endpoint):
+            calls.append(endpoint)
+            if endpoint is FAST:
+                raise ConnectionError("down")
+            return endpoint.url
+
+        self.assertEqual(await router.run(call), SLOW.url)
+        self.assertEqual(calls, [FAST, SLOW])
+        self.assertEqual(router.health[FAST.url].failures, 1)
+
+    async def test_request_errors_do_not_fail_over(self):
+        router = EndpointRouter([FAST, SLOW], RouterConfig())
+        calls = []
+
+        async def call(endpoint):
+            calls.append(endpoint)
+            raise ValueError("bad request")
+
+        with self.assertRaises(ValueError):
+            await router.run(call, is_failure=lambda e: not isinstance(e, ValueError))
+        self.assertEqual(calls, [FAST])
+        self.assertEqual(router.health[FAST.url].failures, 0)
+
+    async def test_raises_the_last_error_when_every_endpoint_fails(self):
+        router = EndpointRouter([FAST, SLOW], RouterConfig())
+
+        async def call(endpoint):
+            raise ConnectionError(endpoint.url)
+
+        with self.assertRaisesRegex(ConnectionError, "slow"):
+            await router.run(call)
+
+    async def test_slow_call_is_hedged_and_the_first_answer_wins(self):
+        router = EndpointRouter([FAST, SLOW], RouterConfig(hedge=True, hedge_min_samples=3))
+        for _ in range(3):
+            router.health[FAST.url].record_success(0.01)
+        router.health[SLOW.url].record_success(0.02)
+        cancelled = []
+
+        async def call(endpoint):
+            try:
+                with in_flight():
+                    # The usually fast endpoint stalls on this call
+                    await asyncio.sleep(5 if endpoint is FAST else 0.01)
+            except asyncio.CancelledError:
+                cancelled.append(endpoint)
+                raise
+            return endpoint.url
+
+        started = time.monotonic()
+        self.assertEqual(await router.run(call), SLOW.url)
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertEqual(cancelled, [FAST])
+        self.assertEqual(router.health[FAST.url].hedges, 1)
+        self.assertEqual(router.health[FAST.url].hedge_wins, 1)
+        # The cancelled call is neither a failure nor a latency sample
+        self.assertEqual(router.health[FAST.url].failures, 0)
+        self.assertEqual(len(router.health[FAST.url].samples), 3)
+
+    async def test_waits_before_and_between_requests_are_not_hedged(self):
+        router = EndpointRouter([FAST, SLOW], RouterConfig(hedge=True, hedge_min_samples=3))
+        for _ in range(3):
+            router.health[FAST.url].record_success(0.05)
+        router.health[SLOW.url].record_success(0.5)
+        calls = []
+
+        async def call(endpoint):
+            calls.append(endpoint)
+            # Admission, a throttled request, then a backoff before the retry
+            await asyncio.sleep(0.2)
+            with in_flight():
+                await asyncio.sleep(0.01)
+            await asyncio.sleep(0.2)
+            with in_flight():
+                await asyncio.sleep(0.01)
+            return endpoint.url
+
+        self.assertEqual(await router.run(call), FAST.url)
+        self.assertEqual(calls, [FAST])
+        self.assertEqual(router.health[FAST.url].hedges, 0)
+
+    async def test_no_hedge_without_enough_samples(self):
+        router = EndpointRouter([FAST, SLOW], RouterConfig(hedge=True, hedge_min_samples=3))
+        calls = []
+
+        async def call(endpoint):
+            calls.append(endpoint)
+            await asyncio.sleep(0.05)
+            return endpoint.url
+
+        self.assertEqual(await router.run(call), FAST.url)
+        self.assertEqual(calls, [FAST])
+
+    async def test_latency_of_the_result_replaces_the_time_of_the_call(self):
+        router = EndpointRouter([FAST, SLOW], RouterConfig())
+
+        async def call(endpoint):
+            # Waiting for admission before the endpoint answers in 0.01s
+            await asyncio.sleep(0.05)
+            return endpoint.url, 0.01
+
+        self.assertEqual(await router.run(call, latency=lambda result: result[1]), (FAST.url, 0.01))
+        self.assertEqual(router.health[FAST.url].latency, 0.01)
+
+    async def test_a_half_open_circuit_lets_a_single_trial_through(self):
+        router = EndpointRouter([FAST, SLOW], RouterConfig(failure_threshold=1, cooldown=10))
+        router.health[SLOW.url].record_success(0.5)
+        health = router.health[FAST.url]
+        health.record_success(0.01)
+        health.record_failure(time.monotonic())
+        health.open_until = time.monotonic()
+        release = asyncio.Event()
+        calls = []
+
+        async def call(endpoint):
+            calls.append(endpoint)
+            if endpoint is FAST:
+                await release.wait()
+            return endpoint.url
+
+        trial = asyncio.ensure_future(router.run(call))
+        await asyncio.sleep(0.01)
+        self.assertEqual(calls, [FAST])
+        # Other calls go elsewhere while the trial is in flight
+        self.assertEqual(await router.run(call), SLOW.url)
+        release.set()
+        self.assertEqual(await trial, FAST.url)
+        self.assertEqual(health.describe(time.monotonic())["circuit"], "closed")
+        self.assertEqual(router.ranked()[0], FAST)
+
+    async def test_a_cancelled_trial_leaves_the_circuit_half_open(self):
+        router = EndpointRouter([FAST, SLOW], RouterConfig(failure_threshold=1, cooldown=10))
+        router.health[SLOW.url].record_success(0.5)
+        health = router.health[FAST.url]
+        health.record_success(0.01)
+        health.record_failure(time.monotonic())
+        health.open_until = time.monotonic()
+
+        async def call(endpoint):
+            await asyncio.sleep(5)
+
+        trial = asyncio.ensure_future(router.run(call))
+        await asyncio.sleep(0.01)
+        self.assertFalse(health.available(time.monotonic()))
+        trial.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await trial
+        self.assertTrue(health.available(time.monotonic()))
+        self.assertEqual(health.describe(time.monotonic())["circuit"], "half-open")
+
+
+class TestGetRouter(unittest.TestCase):
+    def setUp(self):
+        endpoint_router._routers.clear()
+
+    def tearDown(self):
+        endpoint_router._routers.clear()
+
+    def test_routers_are_shared_per_endpoints_and_config(self):
+        router = get_router([FAST, SLOW], RouterConfig())
+        self.assertIs(get_router([FAST, SLOW], RouterConfig()), router)
+        self.assertIsNot(get_router([FAST, SLOW], RouterConfig(hedge=True)), router)
+        self.assertIsNot(get_router([FAST, Endpoint(SLOW.url, "rotated")], RouterConfig()), router)
+
+    def test_credentials_are_not_kept_in_the_keys(self):
+        get_router([FAST, SLOW], RouterConfig())
+        (urls, _), = endpoint_router._routers
+        self.assertEqual([url for url, _ in urls], [FAST.url, SLOW.url])
+        self.assertNotIn(FAST.credential, [digest for _, digest in urls])
+
+
+if __name__ == "__main__":
+    unittest.main()
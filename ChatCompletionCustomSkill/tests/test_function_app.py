@@ -0,0 +1,170 @@
+import functools
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import function_app
+from aiohttp import web
+
+from tests.stub_skill import StubSkillTestCase, packed_records, system_prompt
+
+LONG_TEXT = " ".join(f"Sentence {index} of a long report about Contoso." for index in range(60))
+TITLES = ["Contoso, Ltd. opens in Seattle", "Fabrikam moves to Redmond", "Northwind hires in Tokyo"]
+
+
+class TestSummaryChunking(StubSkillTestCase):
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        self.set_environment(SUMMARY_CHUNK_TOKENS="50", SUMMARY_CHUNK_OVERLAP_TOKENS="0")
+
+    async def test_long_texts_are_summarized_in_one_call_by_default(self):
+        _, values = await self.run_skill([LONG_TEXT], "summarization")
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(values[0]["errors"], [])
+
+    async def test_custom_prompts_without_the_reduce_prompt_use_the_built_in_one(self):
+        self.set_environment(SUMMARY_CHUNKING="true")
+        with open("custom_prompts.json") as file:
+            prompts = json.load(file)
+        del prompts["summarize-reduce-system-prompt"]
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "custom_prompts.json")
+            with open(path, "w") as file:
+                json.dump(prompts, file)
+            loader = functools.partial(function_app.load_custom_prompts, path)
+            with mock.patch.object(function_app, "load_custom_prompts", loader):
+                _, values = await self.run_skill([LONG_TEXT], "summarization")
+
+        self.assertEqual(values[0]["errors"], [])
+        prompts_sent = [system_prompt(body) for _, body in self.calls]
+        self.assertEqual(prompts_sent[-1], function_app.DEFAULT_PROMPTS["summarize-reduce-system-prompt"])
+        self.assertEqual(set(prompts_sent), {
+            prompts["summarize-default-system-prompt"],
+            function_app.DEFAULT_PROMPTS["summarize-reduce-system-prompt"],
+        })
+
+
+class TestEntityPacking(StubSkillTestCase):
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        self.set_environment(ENTITY_PACKING="true")
+        # recordIds the packed answer has an entry for, by default every record once
+        self.answered = None
+        self.fail_pack = False
+
+    async def answer(self, path, body):
+        records = packed_records(body)
+        if records is None:
+            return None
+        if self.fail_pack:
+            raise web.HTTPBadRequest()
+        record_ids = self.answered if self.answered is not None else [r["recordId"] for r in records]
+        return json.dumps({"records": [
+            {"recordId": record_id, "entities": ["Contoso, Ltd.", "Seattle"]} for record_id in record_ids
+        ]})
+
+    async def test_packed_entities_keep_names_with_commas(self):
+        _, values = await self.run_skill(TITLES, "entity-recognition")
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual([value["recordId"] for value in values], ["0", "1", "2"])
+        for value in values:
+            self.assertEqual(value["data"]["entities"], ["Contoso, Ltd.", "Seattle"])
+
+    async def test_records_missing_or_repeated_in_the_answer_fall_back(self):
+        self.answered = ["0", "1", "1", "unknown"]
+        _, values = await self.run_skill(TITLES, "entity-recognition")
+        packed = [body for _, body in self.calls if packed_records(body) is not None]
+        self.assertEqual(len(packed), 1)
+        self.assertEqual(len(self.calls), 3)
+        self.assertEqual([value["recordId"] for value in values], ["0", "1", "2"])
+        self.assertEqual(values[0]["data"]["entities"], ["Contoso, Ltd.", "Seattle"])
+        # The stub answers a single record with a bracketed list
+        self.assertEqual(values[1]["data"]["entities"], ["Contoso", "Seattle"])
+        self.assertEqual(values[2]["data"]["entities"], ["Contoso", "Seattle"])
+
+    async def test_a_failed_pack_falls_back_to_a_call_per_record(self):
+        self.fail_pack = True
+        _, values = await self.run_skill(TITLES, "entity-recognition")
+        self.assertEqual(len(self.calls), 4)
+        self.assertEqual([value["recordId"] for value in values], ["0", "1", "2"])
+        for value in values:
+            self.assertEqual(value["errors"], [])
+            self.assertEqual(value["data"]["entities"], ["Contoso", "Seattle"])
+
+    async def test_packed_answers_are_cached_per_record(self):
+        await self.run_skill(TITLES, "entity-recognition")
+        _, values = await self.run_skill([TITLES[2], TITLES[0]], "entity-recognition")
+        _, single = await self.run_skill([TITLES[1]], "entity-recognition")
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(values[1]["data"]["entities"], ["Contoso, Ltd.", "Seattle"])
+        self.assertEqual(single[0]["data"]["entities"], ["Contoso, Ltd.", "Seattle"])
+
+    async def test_custom_prompts_without_the_packed_prompt_use_the_built_in_one(self):
+        prompts = dict(function_app.load_custom_prompts())
+        del prompts["entity-recognition-packed-system-prompt"]
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "custom_prompts.json")
+            with open(path, "w") as file:
+                json.dump(prompts, file)
+            loader = functools.partial(function_app.load_custom_prompts, path)
+            with mock.patch.object(function_app, "load_custom_prompts", loader):
+                await self.run_skill(TITLES, "entity-recognition")
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(system_prompt(self.calls[0][1]),
+                         function_app.DEFAULT_PROMPTS["entity-recognition-packed-system-prompt"])
+
+
+class TestDuplicateRecords(StubSkillTestCase):
+    # Without the cache, only deduplication can save the calls
+    cache_mode = "off"
+
+    async def test_duplicate_records_share_one_model_call(self):
+        response, values = await self.run_skill(
+            [TITLES[0], TITLES[1], TITLES[0], TITLES[0]], "entity-recognition")
+        self.assertEqual(len(self.calls), 2)
+        self.assertEqual([value["recordId"] for value in values], ["0", "1", "2", "3"])
+        self.assertEqual(values[2]["data"], values[0]["data"])
+        self.assertEqual(values[3]["data"], values[0]["data"])
+        self.assertEqual(response.headers["deduplicated-records"], "2")
+
+    async def test_duplicates_are_called_separately_when_deduplication_is_off(self):
+        self.set_environment(DEDUP_RECORDS="false")
+        response, values = await self.run_skill([TITLES[0], TITLES[0]], "entity-recognition")
+        self.assertEqual(len(self.calls), 2)
+        self.assertEqual([value["recordId"] for value in values], ["0", "1"])
+        self.assertEqual(response.headers["deduplicated-records"], "0")
+
+
+class TestParsePackedEntities(unittest.TestCase):
+    def test_entities_stay_a_list(self):
+        answer = json.dumps({"records": [{"recordId": "1", "entities": ["Contoso, Ltd.", "Seattle"]}]})
+        self.assertEqual(function_app.parse_packed_entities(answer), [("1", ["Contoso, Ltd.", "Seattle"])])
+
+    def test_entries_that_are_not_well_formed_are_left_out(self):
+        answer = "```json\n" + json.dumps({"records": [
+            {"recordId": "1", "entities": ["Contoso"]},
+            {"entities": ["Fabrikam"]},
+            {"recordId": "3", "entities": "Northwind"},
+            {"recordId": "4", "entities": [{"name": "Tokyo"}]},
+        ]}) + "\n```"
+        self.assertEqual(function_app.parse_packed_entities(answer), [("1", ["Contoso"])])
+
+    def test_an_answer_without_records_is_rejected(self):
+        with self.assertRaises(ValueError):
+            function_app.parse_packed_entities(json.dumps({"entities": []}))
+
+
+class TestLoadCustomPrompts(unittest.TestCase):
+    def test_prompts_of_the_file_override_the_built_in_ones(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "custom_prompts.json")
+            with open(path, "w") as file:
+                json.dump({"summarize-reduce-system-prompt": "Combine these."}, file)
+            prompts = function_app.load_custom_prompts(path)
+        self.assertEqual(prompts["summarize-reduce-system-prompt"], "Combine these.")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,69 @@
+import unittest
+
+from metrics import Counter, Histogram, SkillMetrics, server_processing_seconds
+
+
+class TestHistogram(unittest.TestCase):
+    def test_buckets_are_cumulative(self):
+        histogram = Histogram("latency_seconds", "Latency", ("stage",), buckets=(0.1, 1))
+        for value in (0.05, 0.1, 0.5, 5):
+            histogram.observe(value, stage="model")
+        lines = histogram.render()
+        self.assertIn('latency_seconds_bucket{stage="model",le="0.1"} 2', lines)
+        self.assertIn('latency_seconds_bucket{stage="model",le="1"} 3', lines)
+        self.assertIn('latency_seconds_bucket{stage="model",le="+Inf"} 4', lines)
+        self.assertIn('latency_seconds_sum{stage="model"} 5.65', lines)
+        self.assertIn('latency_seconds_count{stage="model"} 4', lines)
+
+    def test_time_observes_the_block(self):
+        histogram = Histogram("latency_seconds", "Latency", ("stage",))
+        with self.assertRaises(ValueError):
+            with histogram.time(stage="parse"):
+                raise ValueError()
+        self.assertEqual(histogram.count(stage="parse"), 1)
+
+
+class TestCounter(unittest.TestCase):
+    def test_label_values_are_escaped(self):
+        counter = Counter("records_total", "Records", ("scenario",))
+        counter.inc(scenario='a"b')
+        counter.inc(2, scenario='a"b')
+        self.assertEqual(counter.value(scenario='a"b'), 3)
+        self.assertIn('records_total{scenario="a\\"b"} 3', counter.render())
+
+
+class TestSkillMetrics(unittest.TestCase):
+    def test_round_trip_is_split_by_processing_time(self):
+        metrics = SkillMetrics()
+        metrics.observe_round_trip("summarization", 0.5, {"openai-processing-ms": "400"})
+        metrics.observe_round_trip("summarization", 0.5, {})
+        self.assertEqual(metrics.stage_seconds.count(scenario="summarization", stage="model"), 2)
+        self.assertEqual(metrics.stage_seconds.count(scenario="summarization", stage="network"), 1)
+
+    def test_usage_tokens(self):
+        metrics = SkillMetrics()
+        metrics.add_usage("summarization", {"prompt_tokens": 100, "completion_tokens": 20, "total_tokens": 120})
+        metrics.add_usage("summarization", None)
+        self.assertEqual(metrics.tokens.value(scenario="summarization", kind="prompt"), 100)
+        self.assertEqual(metrics.tokens.value(scenario="summarization", kind="completion"), 20)
+
+    def test_render_includes_scheduler_and_cache_counters(self):
+        metrics = SkillMetrics()
+        metrics.records.inc(scenario="summarization", outcome="timeout")
+        text = metrics.render(
+            schedulers={"https://model": {"calls": 7, "retries": 2, "throttled": 1, "failures": 0}},
+            cache={"hits": 3, "misses": 4},
+        )
+        self.assertTrue(text.endswith("\n"))
+        self.assertIn('skill_records_total{scenario="summarization",outcome="timeout"} 1', text)
+        self.assertIn('skill_model_retries_total{endpoint="https://model"} 2', text)
+        self.assertIn("skill_cache_hits_total 3", text)
+
+    def test_server_processing_seconds(self):
+        self.assertEqual(server_processing_seconds({"openai-processing-ms": "250.5"}), 0.2505)
+        self.assertIsNone(server_processing_seconds({"openai-processing-ms": "n/a"}))
+        self.assertIsNone(server_processing_seconds(None))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,81 @@
+import os
+import tempfile
+import time
+import unittest
+
+from response_cache import (
+    CacheMode,
+    MemoryTier,
+    ResponseCache,
+    SqliteTier,
+    cache_key,
+    record_content,
+)
+
+
+class TestCacheKey(unittest.TestCase):
+    def test_whitespace_differences_share_a_key(self):
+        first = record_content({"data": {"text": "Contoso  opened\nan office"}})
+        second = record_content({"data": {"text": " Contoso opened an office "}})
+        self.assertEqual(first, second)
+
+    def test_key_depends_on_every_component(self):
+        base = ("summarization", "prompt", "gpt-4o", 0.0, "text:hello")
+        key = cache_key(*base)
+        for index, other in enumerate(["entity-recognition", "other prompt", "gpt-4o-mini", 0.7, "text:bye"]):
+            changed = list(base)
+            changed[index] = other
+            self.assertNotEqual(key, cache_key(*changed))
+
+    def test_image_content_is_addressed_by_payload(self):
+        content = record_content({"data": {"image": {"data": "aGVs\nbG8=", "contentType": "image/png"}}})
+        self.assertEqual(content, "image:aGVsbG8=")
+
+
+class TestMemoryTier(unittest.TestCase):
+    def test_least_recently_used_entry_is_evicted(self):
+        tier = MemoryTier(max_entries=2, ttl_seconds=60)
+        tier.set("a", "1")
+        tier.set("b", "2")
+        tier.get("a")
+        tier.set("c", "3")
+        self.assertEqual(tier.get("a"), "1")
+        self.assertIsNone(tier.get("b"))
+
+    def test_expired_entries_are_dropped(self):
+        tier = MemoryTier(max_entries=2, ttl_seconds=0.01)
+        tier.set("a", "1")
+        time.sleep(0.02)
+        self.assertIsNone(tier.get("a"))
+
+
+class TestResponseCache(unittest.TestCase):
+    def test_deterministic_mode_only_caches_temperature_zero(self):
+        cache = ResponseCache(mode=CacheMode.DETERMINISTIC, memory=MemoryTier(10, 60))
+        self.assertTrue(cache.enabled_for(0))
+        self.assertFalse(cache.enabled_for(0.7))
+
+    def test_canonical_mode_caches_any_temperature(self):
+        cache = ResponseCache(mode=CacheMode.CANONICAL, memory=MemoryTier(10, 60))
+        self.assertTrue(cache.enabled_for(0.7))
+
+    def test_disk_tier_survives_restart_and_counts_hits(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "cache.sqlite")
+            first = ResponseCache(mode=CacheMode.CANONICAL, memory=MemoryTier(10, 60), disk=SqliteTier(path, 60))
+            first.set("key", "answer")
+            first.disk.close()
+
+            second = ResponseCache(mode=CacheMode.CANONICAL, memory=MemoryTier(10, 60), disk=SqliteTier(path, 60))
+            self.assertIsNone(second.get("missing"))
+            self.assertEqual(second.get("key"), "answer")
+            self.assertEqual(second.get("key"), "answer")
+            second.disk.close()
+
+        stats = second.describe()
+        self.assertEqual((stats["hits"], stats["misses"]), (2, 1))
+        self.assertEqual((stats["disk_hits"], stats["memory_hits"]), (1, 1))
+
+
+if __name__ == "__main__":
+    unittest.main()
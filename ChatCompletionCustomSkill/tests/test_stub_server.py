@@ -0,0 +1,60 @@
+import json
+import random
+import unittest
+
+from benchmarks.stub_server import LatencyModel, SchemaInstance, StubModelServer
+
+# The shape pydantic emits for a model with nested models
+PACKED_SCHEMA = {
+    "$defs": {
+        "Entity": {
+            "properties": {"name": {"type": "string"}, "confidence": {"type": "number"}},
+            "required": ["name", "confidence"],
+            "type": "object",
+        },
+        "RecordEntities": {
+            "properties": {
+                "recordId": {"type": "string"},
+                "entities": {"items": {"$ref": "#/$defs/Entity"}, "type": "array"},
+            },
+            "required": ["recordId", "entities"],
+            "type": "object",
+        },
+    },
+    "properties": {"records": {"items": {"$ref": "#/$defs/RecordEntities"}, "type": "array"}},
+    "required": ["records"],
+    "type": "object",
+}
+
+
+class TestStubServer(unittest.TestCase):
+    def test_structured_answer_matches_the_schema(self):
+        answer = SchemaInstance(PACKED_SCHEMA, records=None).build()
+        self.assertEqual(
+            answer,
+            {"records": [{"recordId": "stub recordId", "entities": [{"name": "stub name", "confidence": 0.9}]}]},
+        )
+
+    def test_packed_answer_has_one_entry_per_record(self):
+        stub = StubModelServer(LatencyModel(0))
+        body = {
+            "messages": [
+                {"role": "system", "content": "Extract entities"},
+                {"role": "user", "content": json.dumps([{"recordId": "a", "text": "x"}, {"recordId": "b", "text": "y"}])},
+            ],
+            "response_format": {"type": "json_schema", "json_schema": {"name": "Packed", "schema": PACKED_SCHEMA}},
+        }
+        answer = json.loads(stub.content(body))
+        self.assertEqual([record["recordId"] for record in answer["records"]], ["a", "b"])
+
+    def test_latency_distributions(self):
+        rng = random.Random(0)
+        self.assertEqual(LatencyModel(0.1, "fixed").sample(rng), 0.1)
+        uniform = [LatencyModel(0.1, "uniform", 0.5).sample(rng) for _ in range(100)]
+        self.assertTrue(all(0.05 <= value <= 0.15 for value in uniform))
+        lognormal = sorted(LatencyModel(0.1, "lognormal", 0.5).sample(rng) for _ in range(1001))
+        self.assertAlmostEqual(lognormal[500], 0.1, delta=0.02)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -37,6 +37,10 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
             results = {}
             results["values"] = []
 
+            # Predictions by model input, so records with the same text are only scored once
+            predictions = {}
+            skipped = 0
+
             for value in values:
                 text = value['data']['text']
 
@@ -46,11 +50,16 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
                 # Truncate the text to a maximum of 128 (default) whitespace separated tokens
                 text = truncate_text(text)
 
-                # Compute the input tokens and attention masks for the text sequence
-                input_ids, attention_masks = get_ids_and_masks(tokenizer, text)
+                if text in predictions:
+                    flat_prediction = predictions[text]
+                    skipped += 1
+                else:
+                    # Compute the input tokens and attention masks for the text sequence
+                    input_ids, attention_masks = get_ids_and_masks(tokenizer, text)
 
-                # Call the ONNX model to perform inference on the input
-                flat_prediction = predict(ort_session, input_ids, attention_masks)
+                    # Call the ONNX model to perform inference on the input
+                    flat_prediction = predict(ort_session, input_ids, attention_masks)
+                    predictions[text] = flat_prediction
 
                 payload = (
                               {
@@ -63,9 +72,14 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
 
                 results["values"].append(payload)
 
+            logging.info(f'Scored {len(values)} records, skipping {skipped} duplicate texts.')
             result = json.dumps(results, ensure_ascii=False)
 
-            return func.HttpResponse(result, mimetype="application/json")
+            return func.HttpResponse(
+                result,
+                mimetype="application/json",
+                headers={"deduplicated-records": str(skipped)}
+            )
 
         else:
             return func.HttpResponse(
@@ -0,0 +1,47 @@
+import json
+import unittest
+from unittest import mock
+
+import azure.functions as func
+import numpy as np
+
+# The trained model is not part of the repository, so inference is replaced by a fake session
+with mock.patch("onnxruntime.InferenceSession"):
+    import Watchdog
+
+
+def watchdog_request(texts):
+    body = {"values": [{"recordId": str(index), "data": {"text": text}} for index, text in enumerate(texts)]}
+    return func.HttpRequest("POST", "/api/Watchdog", body=json.dumps(body).encode("utf-8"))
+
+
+def score_by_length(output_names, input_dict):
+    # Class 1 for texts of more than 5 words (7 tokens with [CLS] and [SEP]), so texts get different predictions
+    tokens = np.count_nonzero(input_dict["attention_mask"], axis=1)
+    return [np.stack([tokens <= 7, tokens > 7], axis=1).astype(np.float32)]
+
+
+class TestWatchdog(unittest.TestCase):
+    def setUp(self):
+        Watchdog.ort_session.run.reset_mock()
+        Watchdog.ort_session.run.side_effect = score_by_length
+
+    def test_duplicate_records_are_scored_once(self):
+        texts = ["A short text.", "this is a longer text of several words", "a short   text.", "A SHORT TEXT."]
+        response = Watchdog.main(watchdog_request(texts))
+        values = json.loads(response.get_body())["values"]
+        self.assertEqual([value["recordId"] for value in values], ["0", "1", "2", "3"])
+        self.assertEqual([value["data"]["text_quality_warning"] for value in values], [0, 1, 0, 0])
+        # Texts that only differ in case and whitespace are the same model input
+        self.assertEqual(Watchdog.ort_session.run.call_count, 2)
+        self.assertEqual(response.headers["deduplicated-records"], "2")
+
+    def test_distinct_records_are_all_scored(self):
+        response = Watchdog.main(watchdog_request(["A short text.", "Another short text."]))
+        self.assertEqual(len(json.loads(response.get_body())["values"]), 2)
+        self.assertEqual(Watchdog.ort_session.run.call_count, 2)
+        self.assertEqual(response.headers["deduplicated-records"], "0")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+"""Compare the torch, onnx and onnx-int8 embedding backends.
+
+Embeds the same texts with every backend and reports batch throughput,
+single-record latency and the cosine similarity of each backend's vectors
+to the torch ones.
+
+Run from the skill folder:
+
+    python -m benchmarks.bench_backends --records 256 --threads 4
+    python -m benchmarks.bench_backends --random-weights    # all-MiniLM-L6-v2 sized model, no download
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+import torch
+import torch.nn.functional as F
+
+from benchmarks.bench_bucketing import mixed_texts
+from embedder.text_embedder import BACKENDS, DEFAULT_MODEL, TextEmbedder
+from tests.tiny_model import save_tiny_model
+
+
+def main(args):
+    torch.set_num_threads(args.threads)
+    with tempfile.TemporaryDirectory() as directory:
+        model = args.model
+        if args.random_weights:
+            model = save_tiny_model(os.path.join(directory, "model"), hidden_size=384, layers=6, heads=12,
+                                    max_position_embeddings=512)
+        onnx_dir = args.onnx_dir or os.path.join(directory, "onnx")
+        texts = mixed_texts(args.records, args.long_fraction)
+
+        print(f"{len(texts)} records, {args.threads} threads")
+        print(f"{'backend':<12}{'records/s':>12}{'p50 ms':>10}{'p95 ms':>10}{'min cosine':>12}")
+        reference = None
+        for backend in args.backends:
+            embedder = TextEmbedder(model, backend=backend, onnx_dir=onnx_dir, intra_op_threads=args.threads)
+            embedder.generate_embeddings(texts[:8])
+            started = time.perf_counter()
+            embeddings = embedder.generate_embeddings(texts)
+            throughput = len(texts) / (time.perf_counter() - started)
+
+            latencies = []
+            for text in texts[:args.latency_samples]:
+                started = time.perf_counter()
+                embedder.generate_embeddings([text])
+                latencies.append((time.perf_counter() - started) * 1000)
+            latencies.sort()
+
+            if reference is None:
+                reference = embeddings
+            cosine = F.cosine_similarity(embeddings, reference).min().item()
+            print(f"{backend:<12}{throughput:>12.1f}{statistics.median(latencies):>10.2f}"
+                  f"{latencies[int(0.95 * (len(latencies) - 1))]:>10.2f}{cosine:>12.4f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--model", default=DEFAULT_MODEL)
+    parser.add_argument("--random-weights", action="store_true",
+                        help="use a randomly initialised model of the all-MiniLM-L6-v2 shape instead of --model")
+    parser.add_argument("--onnx-dir", help="existing ONNX export to use instead of exporting to a temporary folder")
+    parser.add_argument("--backends", nargs="+", choices=BACKENDS, default=list(BACKENDS),
+                        help="the first backend is the reference for the cosine similarity")
+    parser.add_argument("--records", type=int, default=256)
+    parser.add_argument("--long-fraction", type=float, default=0.05)
+    parser.add_argument("--latency-samples", type=int, default=50)
+    parser.add_argument("--threads", type=int, default=torch.get_num_threads())
+    main(parser.parse_args())
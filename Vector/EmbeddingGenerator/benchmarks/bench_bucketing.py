@@ -0,0 +1,77 @@
+"""Compare one padded forward pass with length-bucketed batches.
+
+Embeds a request of mostly short texts with a few long ones, first as a
+single batch padded to the longest input (EMBEDDING_MAX_BATCH_TOKENS=0, the
+previous behaviour) and then in length buckets, and reports throughput and
+the number of padded tokens the model had to process.
+
+Run from the skill folder:
+
+    python -m benchmarks.bench_bucketing --records 256 --long-fraction 0.05
+    python -m benchmarks.bench_bucketing --random-weights    # all-MiniLM-L6-v2 sized model, no download
+"""
+import argparse
+import random
+import tempfile
+import time
+
+import torch
+
+from embedder.text_embedder import DEFAULT_MAX_BATCH_TOKENS, DEFAULT_MODEL, TextEmbedder, length_buckets
+from tests.tiny_model import WORDS, save_tiny_model
+
+
+def mixed_texts(records, long_fraction, seed=0):
+    rng = random.Random(seed)
+    texts = []
+    for _ in range(records):
+        words = rng.randint(300, 450) if rng.random() < long_fraction else rng.randint(5, 40)
+        texts.append(" ".join(rng.choice(WORDS) for _ in range(words)))
+    return texts
+
+
+def padded_tokens(lengths, max_batch_tokens):
+    return sum(len(bucket) * max(lengths[i] for i in bucket) for bucket in length_buckets(lengths, max_batch_tokens))
+
+
+def measure(embedder, texts, max_batch_tokens, repeat):
+    embedder.max_batch_tokens = max_batch_tokens
+    embedder.generate_embeddings(texts[:8])
+    started = time.perf_counter()
+    for _ in range(repeat):
+        embeddings = embedder.generate_embeddings(texts)
+    seconds = (time.perf_counter() - started) / repeat
+    return seconds, embeddings
+
+
+def main(args):
+    torch.set_num_threads(args.threads)
+    with tempfile.TemporaryDirectory() as directory:
+        model = args.model
+        if args.random_weights:
+            model = save_tiny_model(directory, hidden_size=384, layers=6, heads=12, max_position_embeddings=512)
+        embedder = TextEmbedder(model)
+
+    texts = mixed_texts(args.records, args.long_fraction)
+    lengths = [len(ids) for ids in embedder.tokenizer(texts, truncation=True)["input_ids"]]
+    print(f"{len(texts)} records, {sum(lengths)} tokens, longest {max(lengths)}")
+    print(f"{'strategy':<28}{'padded tokens':>15}{'seconds':>10}{'records/s':>12}")
+    results = {}
+    for name, budget in (("one padded batch", 0), (f"buckets of {args.max_batch_tokens} tokens", args.max_batch_tokens)):
+        seconds, results[name] = measure(embedder, texts, budget, args.repeat)
+        print(f"{name:<28}{padded_tokens(lengths, budget):>15}{seconds:>10.3f}{len(texts) / seconds:>12.1f}")
+    single, bucketed = results.values()
+    print(f"max abs difference: {(single - bucketed).abs().max().item():.2e}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--model", default=DEFAULT_MODEL)
+    parser.add_argument("--random-weights", action="store_true",
+                        help="use a randomly initialised model of the all-MiniLM-L6-v2 shape instead of --model")
+    parser.add_argument("--records", type=int, default=256)
+    parser.add_argument("--long-fraction", type=float, default=0.05)
+    parser.add_argument("--max-batch-tokens", type=int, default=DEFAULT_MAX_BATCH_TOKENS)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--threads", type=int, default=torch.get_num_threads())
+    main(parser.parse_args())
@@ -0,0 +1,88 @@
+"""Compare per-request forward passes with the coalescing queue under concurrency.
+
+Starts --clients threads that each send --requests small requests of
+--texts-per-request texts, like indexers calling the function concurrently,
+once calling generate_embeddings directly and once through the
+EmbeddingCoalescer, and reports throughput and request latency.
+
+Run from the skill folder:
+
+    python -m benchmarks.bench_coalescing --clients 16 --texts-per-request 2
+    python -m benchmarks.bench_coalescing --random-weights    # all-MiniLM-L6-v2 sized model, no download
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import threading
+import time
+
+import torch
+
+from benchmarks.bench_bucketing import mixed_texts
+from embedder.coalescer import EmbeddingCoalescer
+from embedder.text_embedder import DEFAULT_MODEL, TextEmbedder
+from tests.tiny_model import save_tiny_model
+
+
+def run_clients(embed, texts, clients, requests, texts_per_request):
+    latencies = []
+    lock = threading.Lock()
+
+    def client(number):
+        for request in range(requests):
+            start = (number * requests + request) * texts_per_request % len(texts)
+            batch = texts[start:start + texts_per_request]
+            started = time.perf_counter()
+            embed(batch)
+            with lock:
+                latencies.append((time.perf_counter() - started) * 1000)
+
+    threads = [threading.Thread(target=client, args=(number,)) for number in range(clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - started, sorted(latencies)
+
+
+def main(args):
+    torch.set_num_threads(args.threads)
+    with tempfile.TemporaryDirectory() as directory:
+        model = args.model
+        if args.random_weights:
+            model = save_tiny_model(os.path.join(directory, "model"), hidden_size=384, layers=6, heads=12,
+                                    max_position_embeddings=512)
+        embedder = TextEmbedder(model)
+    texts = mixed_texts(1000, long_fraction=0)
+    coalescer = EmbeddingCoalescer(embedder.generate_embeddings, args.max_batch_size, args.max_wait_ms)
+    embedder.generate_embeddings(texts[:8])
+
+    print(f"{args.clients} clients x {args.requests} requests of {args.texts_per_request} texts, {args.threads} threads")
+    print(f"{'strategy':<22}{'texts/s':>10}{'p50 ms':>10}{'p95 ms':>10}")
+    for name, embed in (("per request", embedder.generate_embeddings), ("coalesced", coalescer.embed)):
+        seconds, latencies = run_clients(embed, texts, args.clients, args.requests, args.texts_per_request)
+        total = args.clients * args.requests * args.texts_per_request
+        print(f"{name:<22}{total / seconds:>10.1f}{statistics.median(latencies):>10.2f}"
+              f"{latencies[int(0.95 * (len(latencies) - 1))]:>10.2f}")
+    print(f"coalescer: {coalescer.stats.as_dict()}")
+
+    seconds, latencies = run_clients(coalescer.embed, texts, 1, args.requests, args.texts_per_request)
+    single, _ = run_clients(embedder.generate_embeddings, texts, 1, args.requests, args.texts_per_request)
+    print(f"single client p50: {statistics.median(latencies):.2f} ms coalesced, "
+          f"{single / args.requests * 1000:.2f} ms per request direct")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--model", default=DEFAULT_MODEL)
+    parser.add_argument("--random-weights", action="store_true",
+                        help="use a randomly initialised model of the all-MiniLM-L6-v2 shape instead of --model")
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--texts-per-request", type=int, default=2)
+    parser.add_argument("--max-batch-size", type=int, default=64)
+    parser.add_argument("--max-wait-ms", type=float, default=2.0)
+    parser.add_argument("--threads", type=int, default=torch.get_num_threads())
+    main(parser.parse_args())
@@ -0,0 +1,90 @@
+"""Recall of projected and int8 quantized vectors against the full vectors.
+
+Fits a PCA projection on part of a corpus of normalized vectors and
+measures, for held-out queries, how many of the top-k neighbours by full
+vector cosine similarity are still found with the projected vectors, the
+int8 quantized vectors, and both, next to the bytes each vector takes.
+
+By default the corpus is synthetic vectors with the decaying variance
+spectrum and common offset of sentence embeddings; --input embeds a file
+of texts (one per line) with the model instead.
+
+Run from the skill folder:
+
+    python -m benchmarks.bench_projection --corpus 20000 --dimensions 64 128 192
+    python -m benchmarks.bench_projection --input sample.txt --model sentence-transformers/all-MiniLM-L6-v2
+"""
+import argparse
+
+import numpy as np
+import torch
+
+from embedder.encoding import quantize_int8
+from embedder.projection import Projection, fit_pca, read_texts
+from embedder.text_embedder import DEFAULT_MODEL
+
+
+def synthetic_vectors(count, dimensions, seed=0):
+    rng = np.random.default_rng(seed)
+    spectrum = 1 / np.arange(1, dimensions + 1) ** 0.75
+    rotation = np.linalg.qr(rng.standard_normal((dimensions, dimensions)))[0]
+    vectors = (rng.standard_normal((count, dimensions)) * spectrum) @ rotation + 0.3 * rng.standard_normal(dimensions)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def embedded_vectors(path, model):
+    from embedder.text_embedder import TextEmbedder
+
+    embedder = TextEmbedder(model)
+    texts = list(read_texts(path))
+    return np.concatenate([embedder.generate_embeddings(texts[start:start + 256]).numpy()
+                           for start in range(0, len(texts), 256)])
+
+
+def top_k(queries, corpus, k):
+    return torch.topk(torch.from_numpy(queries) @ torch.from_numpy(corpus).T, k).indices.numpy()
+
+
+def recall(found, expected):
+    return np.mean([len(set(f) & set(e)) / len(e) for f, e in zip(found, expected)])
+
+
+def dequantized(vectors):
+    return np.stack([codes * scale for codes, scale in map(quantize_int8, vectors)]).astype(np.float32)
+
+
+def main(args):
+    if args.input:
+        vectors = embedded_vectors(args.input, args.model).astype(np.float32)
+    else:
+        vectors = synthetic_vectors(args.corpus + args.queries, args.full_dimensions).astype(np.float32)
+    queries, corpus = vectors[:args.queries], vectors[args.queries:]
+    expected = top_k(queries, corpus, args.k)
+    fitted = fit_pca(corpus[:args.fit_sample])
+
+    print(f"{len(corpus)} vectors of {corpus.shape[1]} dimensions, {len(queries)} queries, recall@{args.k}")
+    print(f"{'vectors':<26}{'bytes':>8}{'recall':>10}")
+    print(f"{'full float32':<26}{corpus.shape[1] * 4:>8}{1.0:>10.4f}")
+    print(f"{'full int8':<26}{corpus.shape[1] + 4:>8}{recall(top_k(queries, dequantized(corpus), args.k), expected):>10.4f}")
+    for dimensions in args.dimensions:
+        for name, projection in (("pca", Projection(dimensions, fitted)), ("truncate", Projection(dimensions))):
+            projected_corpus = projection.apply(torch.from_numpy(corpus)).numpy()
+            projected_queries = projection.apply(torch.from_numpy(queries)).numpy()
+            print(f"{f'{name} {dimensions} float32':<26}{dimensions * 4:>8}"
+                  f"{recall(top_k(projected_queries, projected_corpus, args.k), expected):>10.4f}")
+            if name == "pca":
+                print(f"{f'{name} {dimensions} int8':<26}{dimensions + 4:>8}"
+                      f"{recall(top_k(projected_queries, dequantized(projected_corpus), args.k), expected):>10.4f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--input", help="texts to embed, one per line, instead of synthetic vectors")
+    parser.add_argument("--model", default=DEFAULT_MODEL)
+    parser.add_argument("--corpus", type=int, default=20000)
+    parser.add_argument("--full-dimensions", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--fit-sample", type=int, default=5000, help="corpus vectors the projection is fitted on")
+    parser.add_argument("--dimensions", type=int, nargs="+", default=[64, 128, 192])
+    parser.add_argument("--k", type=int, default=10)
+    main(parser.parse_args())
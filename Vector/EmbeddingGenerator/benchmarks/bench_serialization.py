@@ -0,0 +1,68 @@
+"""Compare the response serialization paths of the embed function.
+
+Serializes a response of random unit vectors the way the function used to
+(tensor rows through tolist and json.dumps) and with every wire format of
+embedder.encoding, and reports the time and payload size of each. No model
+is needed.
+
+Run from the skill folder:
+
+    python -m benchmarks.bench_serialization --records 1000 --dimensions 384
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+import torch
+
+from embedder.encoding import BASE64_FLOAT16, BASE64_FLOAT32, FLOAT, dumps, vector_payload
+
+
+def response(payloads):
+    return {"values": [{"recordId": str(index), "data": {"vector": payload}, "errors": None, "warnings": None}
+                       for index, payload in enumerate(payloads)]}
+
+
+def tolist_json(embeddings):
+    body = response([embedding.tolist() for embedding in embeddings])
+    return json.dumps(body, default=lambda obj: obj.__dict__).encode("utf-8")
+
+
+def encoded(vector_format, precision=None):
+    def serialize(embeddings):
+        return dumps(response([vector_payload(vector, vector_format, precision) for vector in embeddings.numpy()]))
+    return serialize
+
+
+def main(args):
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((args.records, args.dimensions)).astype(np.float32)
+    embeddings = torch.from_numpy(vectors / np.linalg.norm(vectors, axis=1, keepdims=True))
+    strategies = [
+        ("tolist + json.dumps", tolist_json),
+        ("float", encoded(FLOAT)),
+        (f"float, {args.precision} decimals", encoded(FLOAT, args.precision)),
+        (BASE64_FLOAT32, encoded(BASE64_FLOAT32)),
+        (BASE64_FLOAT16, encoded(BASE64_FLOAT16)),
+    ]
+    print(f"{args.records} vectors of {args.dimensions} dimensions")
+    print(f"{'format':<24}{'ms':>10}{'bytes':>12}{'vs tolist':>11}")
+    baseline = None
+    for name, serialize in strategies:
+        serialize(embeddings)
+        started = time.perf_counter()
+        for _ in range(args.repeat):
+            body = serialize(embeddings)
+        milliseconds = (time.perf_counter() - started) * 1000 / args.repeat
+        baseline = baseline or (milliseconds, len(body))
+        print(f"{name:<24}{milliseconds:>10.2f}{len(body):>12}{milliseconds / baseline[0]:>10.2f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--records", type=int, default=1000)
+    parser.add_argument("--dimensions", type=int, default=384)
+    parser.add_argument("--precision", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=5)
+    main(parser.parse_args())
@@ -0,0 +1,63 @@
+"""Measure the cold start of the embedding function, phase by phase.
+
+Starts a fresh Python process per model source and backend and reports
+the time to import torch and transformers, to load the tokenizer and
+model, the first inference (what the warm-up takes off the first request)
+and a second inference.
+
+Run from the skill folder, e.g. comparing the hub model with a folder baked
+by embedder.artifacts:
+
+    python -m embedder.artifacts --output model --onnx
+    python -m benchmarks.bench_startup --models sentence-transformers/all-MiniLM-L6-v2 model --backends torch onnx
+"""
+import argparse
+import json
+import subprocess
+import sys
+import time
+
+
+def child(model, backend, threads):
+    started = time.perf_counter()
+    import torch  # noqa: F401
+    import transformers  # noqa: F401
+
+    from embedder.text_embedder import TextEmbedder, configure_threads
+    timings = {"import": time.perf_counter() - started}
+
+    configure_threads(threads)
+    started = time.perf_counter()
+    embedder = TextEmbedder(model, backend=backend)
+    timings["load"] = time.perf_counter() - started
+    timings["first inference"] = embedder.warm_up()
+    timings["second inference"] = embedder.warm_up()
+    print(json.dumps(timings))
+
+
+def main(args):
+    phases = ["import", "load", "first inference", "second inference"]
+    print(f"{'model':<44}{'backend':<11}" + "".join(f"{phase:>18}" for phase in phases))
+    for model in args.models:
+        for backend in args.backends:
+            result = subprocess.run(
+                [sys.executable, "-m", "benchmarks.bench_startup", "--child", model, backend, str(args.threads)],
+                capture_output=True, text=True)
+            if result.returncode != 0:
+                print(f"{model:<44}{backend:<11}failed: {result.stderr.strip().splitlines()[-1]}")
+                continue
+            timings = json.loads(result.stdout.strip().splitlines()[-1])
+            print(f"{model[-43:]:<44}{backend:<11}" + "".join(f"{timings[phase]:>17.3f}s" for phase in phases))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 5 and sys.argv[1] == "--child":
+        child(sys.argv[2], sys.argv[3], int(sys.argv[4]))
+        sys.exit()
+    from embedder.text_embedder import BACKENDS, DEFAULT_MODEL
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--models", nargs="+", default=[DEFAULT_MODEL], help="hub ids or baked model folders")
+    parser.add_argument("--backends", nargs="+", choices=BACKENDS, default=["torch"])
+    parser.add_argument("--threads", type=int, default=0, help="intra-op threads, 0 for the torch default")
+    main(parser.parse_args())
@@ -0,0 +1,41 @@
+"""Bake a model into a local folder the function loads without the hub.
+
+Loading from the hub cache looks files up over the network and converts
+older weight files at every cold start. The baked folder holds the
+tokenizer and the model weights as safetensors, which load without
+unpickling, and optionally the ONNX exports of the model. Ship the folder
+with the function and point EMBEDDING_MODEL_PATH at it:
+
+    python -m embedder.artifacts --model sentence-transformers/all-MiniLM-L6-v2 --output model --onnx --quantize
+"""
+import argparse
+import os
+
+from transformers import AutoModel, AutoTokenizer
+
+from embedder.onnx_backend import default_onnx_dir, export
+
+
+def bake(model_path, output, onnx=False, quantize=False):
+    """Save the tokenizer and safetensors weights of model_path to output, with ONNX exports in output/onnx."""
+    tokenizer = AutoTokenizer.from_pretrained(model_path)
+    model = AutoModel.from_pretrained(model_path)
+    os.makedirs(output, exist_ok=True)
+    tokenizer.save_pretrained(output)
+    model.save_pretrained(output, safe_serialization=True)
+    if onnx or quantize:
+        export(model, tokenizer, default_onnx_dir(output), quantize=quantize)
+    return output
+
+
+if __name__ == '__main__':
+    from embedder.text_embedder import DEFAULT_MODEL
+
+    parser = argparse.ArgumentParser(description='Save a model to a local folder for fast startup')
+    parser.add_argument('--model', default=DEFAULT_MODEL)
+    parser.add_argument('--output', required=True)
+    parser.add_argument('--onnx', action='store_true', help='also export the model for the onnx backend')
+    parser.add_argument('--quantize', action='store_true', help='also export the int8 model for the onnx-int8 backend')
+    args = parser.parse_args()
+    bake(args.model, args.output, args.onnx, args.quantize)
+    print(f'Saved {args.model} to {args.output}')
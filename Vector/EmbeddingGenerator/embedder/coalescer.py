@@ -0,0 +1,140 @@
+"""Coalescing of concurrent embedding requests into shared forward passes.
+
+The function runs each HTTP invocation on its own thread, and indexers
+often send one or two records per call, so without coalescing many tiny
+forward passes compete for the same cores. Requests are instead queued to
+one inference thread, which takes everything waiting in the queue, waits
+up to max_wait_ms for more while the batch is below max_batch_size, runs
+one generate_embeddings call and hands every request its own rows. If
+that call fails, each request of the batch is run again on its own, so one
+bad input only fails its own request.
+"""
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+
+class CoalescerStats():
+    def __init__(self):
+        self.batches = 0
+        self.requests = 0
+        self.texts = 0
+
+    def as_dict(self):
+        return {
+            "batches": self.batches,
+            "requests": self.requests,
+            "texts": self.texts,
+            "requests_per_batch": round(self.requests / self.batches, 2) if self.batches else 0.0,
+            "texts_per_batch": round(self.texts / self.batches, 2) if self.batches else 0.0,
+        }
+
+
+class EmbeddingCoalescer():
+    def __init__(self, generate_embeddings, max_batch_size=64, max_wait_ms=2.0):
+        self.generate_embeddings = generate_embeddings
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.stats = CoalescerStats()
+        self._queue = queue.Queue()
+        # A request that did not fit in the previous batch starts the next one
+        self._carried = None
+        self._thread = None
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def submit(self, texts):
+        """Queue texts for the next forward pass; the future resolves to (embeddings, requests in the pass)."""
+        future = Future()
+        with self._lock:
+            closed = self._closed
+            if not closed:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name="embedding-coalescer", daemon=True)
+                    self._thread.start()
+                self._queue.put((list(texts), future))
+        if closed:
+            # Requests that raced the unloading of the model are still answered, on their own
+            future.set_result((self.generate_embeddings(list(texts)), 1))
+        return future
+
+    def close(self):
+        """Stop the inference thread once the requests queued so far are answered."""
+        with self._lock:
+            if not self._closed:
+                self._closed = True
+                self._queue.put(None)
+
+    def embed(self, texts):
+        """Embeddings of texts, computed together with the texts of concurrent requests."""
+        embeddings, _ = self.submit(texts).result()
+        return embeddings
+
+    def _next_batch(self):
+        batch = [self._carried] if self._carried is not None else [self._queue.get()]
+        self._carried = None
+        if batch[0] is None:
+            return None
+        size = len(batch[0][0])
+        deadline = time.monotonic() + self.max_wait
+        while size < self.max_batch_size:
+            try:
+                # Whatever is already queued is taken without waiting
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            if item is None:
+                # Closed: the batch runs, then the worker stops at the requeued marker
+                self._queue.put(None)
+                break
+            if size + len(item[0]) > self.max_batch_size:
+                self._carried = item
+                break
+            batch.append(item)
+            size += len(item[0])
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            texts = [text for item_texts, _ in batch for text in item_texts]
+            try:
+                embeddings = self.generate_embeddings(texts)
+            except Exception as e:
+                if len(batch) == 1:
+                    batch[0][1].set_exception(e)
+                    continue
+                logger.warning(f"Coalesced embedding batch of {len(batch)} requests failed, running them one by one: {e}")
+                self._run_separately(batch)
+                continue
+            self.stats.batches += 1
+            self.stats.requests += len(batch)
+            self.stats.texts += len(texts)
+            start = 0
+            for item_texts, future in batch:
+                future.set_result((embeddings[start:start + len(item_texts)], len(batch)))
+                start += len(item_texts)
+
+    def _run_separately(self, batch):
+        for item_texts, future in batch:
+            try:
+                embeddings = self.generate_embeddings(item_texts)
+            except Exception as e:
+                future.set_exception(e)
+                continue
+            self.stats.batches += 1
+            self.stats.requests += 1
+            self.stats.texts += len(item_texts)
+            future.set_result((embeddings, 1))
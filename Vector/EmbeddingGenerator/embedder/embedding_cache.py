@@ -0,0 +1,223 @@
+"""Cache of text embeddings, so re-crawled chunks are not embedded again.
+
+Vectors are keyed on the model and a hash of the text with its whitespace
+collapsed (the tokenizer splits on whitespace, so such texts get the same
+vector). An in-process LRU answers repeated texts of a worker, and an
+optional SQLite file keeps the vectors across restarts and between the
+worker processes of an instance. Both tiers are bounded in bytes and evict
+the least recently used vectors first.
+"""
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+import torch
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_text(text):
+    return " ".join(text.split())
+
+
+def embedding_key(model_id, text):
+    return hashlib.sha256(f"{model_id}\0{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+
+class CacheStats():
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+
+    def as_dict(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+class MemoryTier():
+    """In-process LRU of float32 vectors, bounded by their total size in bytes."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is not None:
+                self._entries.move_to_end(key)
+            return vector
+
+    def set(self, key, vector):
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.size -= previous.nbytes
+            self._entries[key] = vector
+            self.size += vector.nbytes
+            while self.size > self.max_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= evicted.nbytes
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SqliteTier():
+    """Vectors in a SQLite file, evicted least recently used first above max_bytes."""
+
+    # Eviction frees down to this fraction of max_bytes, so it does not run on every write
+    EVICT_TO = 0.9
+    # Below the host parameter limit of older SQLite builds
+    MAX_PARAMETERS = 500
+
+    def __init__(self, path, max_bytes):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings "
+                "(key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self.size = self._stored_bytes()
+
+    def _stored_bytes(self):
+        return self._conn.execute("SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings").fetchone()[0]
+
+    def get_many(self, keys):
+        rows = []
+        with self._lock:
+            for start in range(0, len(keys), self.MAX_PARAMETERS):
+                chunk = keys[start:start + self.MAX_PARAMETERS]
+                marks = ",".join("?" * len(chunk))
+                found = self._conn.execute(f"SELECT key, vector FROM embeddings WHERE key IN ({marks})",
+                                           chunk).fetchall()
+                if found:
+                    with self._conn:
+                        self._conn.execute(f"UPDATE embeddings SET last_used = ? WHERE key IN ({marks})",
+                                           [time.time()] + chunk)
+                rows.extend(found)
+        return {key: np.frombuffer(vector, dtype=np.float32) for key, vector in rows}
+
+    def set_many(self, items):
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                [(key, vector.tobytes(), now) for key, vector in items],
+            )
+            self.size += sum(vector.nbytes for _, vector in items)
+            if self.size > self.max_bytes:
+                # Other worker processes write to the same file, so count again before evicting
+                self.size = self._stored_bytes()
+                if self.size > self.max_bytes:
+                    self._evict()
+
+    def _evict(self):
+        target = self.size - int(self.max_bytes * self.EVICT_TO)
+        freed = 0
+        keys = []
+        for key, size in self._conn.execute("SELECT key, LENGTH(vector) FROM embeddings ORDER BY last_used"):
+            keys.append(key)
+            freed += size
+            if freed >= target:
+                break
+        self._conn.executemany("DELETE FROM embeddings WHERE key = ?", [(key,) for key in keys])
+        self.size -= freed
+        logger.info(f"Evicted {len(keys)} embeddings ({freed} bytes) from the embedding cache")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class EmbeddingCache():
+    def __init__(self, memory, disk=None):
+        self.memory = memory
+        self.disk = disk
+        self.stats = CacheStats()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        sqlite_path = os.getenv("EMBEDDING_CACHE_SQLITE_PATH")
+        return cls(
+            MemoryTier(int(float(os.getenv("EMBEDDING_CACHE_MAX_MB", "64")) * 1024 * 1024)),
+            SqliteTier(sqlite_path, int(float(os.getenv("EMBEDDING_CACHE_SQLITE_MAX_MB", "1024")) * 1024 * 1024))
+            if sqlite_path else None,
+        )
+
+    def embed(self, texts, model_id, generate_embeddings):
+        """Vectors of texts in order, calling generate_embeddings only for texts not in the cache.
+
+        Returns the vectors as a tensor and the number of texts answered from the cache.
+        """
+        keys = [embedding_key(model_id, text) for text in texts]
+        vectors = {}
+        memory_hits = 0
+        for key in keys:
+            vector = self.memory.get(key)
+            if vector is not None:
+                vectors[key] = vector
+                memory_hits += 1
+
+        disk_hits = 0
+        if self.disk is not None:
+            missing = [key for key in keys if key not in vectors]
+            try:
+                found = self.disk.get_many(missing)
+            except sqlite3.Error as e:
+                logger.warning(f"Failed to read embeddings from the cache file: {e}")
+                found = {}
+            for key, vector in found.items():
+                # Promote so the next lookup is served from memory
+                self.memory.set(key, vector)
+                vectors[key] = vector
+            disk_hits = len(found)
+
+        misses = [index for index, key in enumerate(keys) if key not in vectors]
+        if misses:
+            computed = generate_embeddings([texts[index] for index in misses]).numpy().astype(np.float32)
+            # Copies, so an evicted vector does not keep the whole batch array alive
+            items = [(keys[index], vector.copy()) for index, vector in zip(misses, computed)]
+            for key, vector in items:
+                self.memory.set(key, vector)
+                vectors[key] = vector
+            if self.disk is not None:
+                try:
+                    self.disk.set_many(items)
+                except sqlite3.Error as e:
+                    logger.warning(f"Failed to write embeddings to the cache file: {e}")
+
+        with self._lock:
+            self.stats.hits += memory_hits + disk_hits
+            self.stats.memory_hits += memory_hits
+            self.stats.disk_hits += disk_hits
+            self.stats.misses += len(misses)
+        return torch.from_numpy(np.stack([vectors[key] for key in keys])), memory_hits + disk_hits
+
+    def describe(self):
+        return {
+            "memory_entries": len(self.memory),
+            "memory_bytes": self.memory.size,
+            "disk_bytes": self.disk.size if self.disk is not None else None,
+            **self.stats.as_dict(),
+        }
@@ -0,0 +1,74 @@
+"""Wire formats of the vectors in an embedding response.
+
+Vectors stay numpy arrays until the response body is serialized, so no
+Python float object is created per dimension. The default format is a JSON
+array of numbers, optionally rounded to a number of decimals; the base64
+formats send the little-endian float32 or float16 bytes of the vector as
+one string, for clients that decode it themselves. The int8 format scalar
+quantizes each vector to integers in [-127, 127] with a per-vector scale,
+for int8 vector fields.
+"""
+import base64
+import json
+
+import numpy as np
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - the json module is used instead
+    orjson = None
+
+FLOAT = 'float'
+BASE64_FLOAT32 = 'base64-float32'
+BASE64_FLOAT16 = 'base64-float16'
+INT8 = 'int8'
+VECTOR_FORMATS = (FLOAT, BASE64_FLOAT32, BASE64_FLOAT16, INT8)
+_BASE64_DTYPES = {BASE64_FLOAT32: np.dtype('<f4'), BASE64_FLOAT16: np.dtype('<f2')}
+
+
+def vector_payload(vector, vector_format=FLOAT, precision=None):
+    """The value sent for a vector: an array serialized as numbers, or a base64 string."""
+    if vector_format == FLOAT:
+        if precision is None:
+            return vector
+        # Rounded in float64, where a rounded value also has a short decimal representation
+        return np.round(vector.astype(np.float64), precision)
+    return base64.b64encode(vector.astype(_BASE64_DTYPES[vector_format]).tobytes()).decode('ascii')
+
+
+def quantize_int8(vector):
+    """Symmetric scalar quantization: vector is about codes * scale."""
+    scale = float(np.abs(vector).max()) / 127
+    if scale == 0:
+        return np.zeros(len(vector), dtype=np.int8), 0.0
+    return np.clip(np.rint(vector / scale), -127, 127).astype(np.int8), scale
+
+
+def vector_data(vector, vector_format=FLOAT, precision=None):
+    """The fields a vector is returned in: the vector, and its scale for int8."""
+    if vector_format == INT8:
+        codes, scale = quantize_int8(vector)
+        return {'vector': codes, 'scale': scale}
+    return {'vector': vector_payload(vector, vector_format, precision)}
+
+
+def decode_vector(payload, vector_format):
+    """Inverse of vector_payload for the base64 formats, as float32."""
+    return np.frombuffer(base64.b64decode(payload), dtype=_BASE64_DTYPES[vector_format]).astype(np.float32)
+
+
+class NumpyJSONEncoder(json.JSONEncoder):
+    def default(self, obj):
+        if isinstance(obj, np.ndarray):
+            return obj.tolist()
+        if isinstance(obj, np.generic):
+            return obj.item()
+        return super().default(obj)
+
+
+def dumps(body):
+    """Serialize a response body holding numpy arrays to JSON bytes."""
+    if orjson is not None:
+        # Writes the array buffers directly, float32 arrays with their shortest float32 representation
+        return orjson.dumps(body, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(body, cls=NumpyJSONEncoder).encode('utf-8')
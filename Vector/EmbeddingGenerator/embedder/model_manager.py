@@ -0,0 +1,142 @@
+"""Several embedding models served by one function, within a memory budget.
+
+Indexes can use different embedding models, and a request names the model
+of its records. Models are loaded the first time they are requested and
+stay resident while their total size fits in max_bytes; loading one more
+evicts the least recently used models first, down to the budget minus the
+estimated size of the new model before it is loaded, so both are not in
+memory at once. The model being loaded is never evicted, so a single model
+larger than the budget still runs.
+"""
+import gc
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+def parse_models(value, default_name, default_path):
+    """Model names and paths from "name=path,name=path", or only the default model without a value."""
+    if not value:
+        return {default_name: default_path}
+    models = {}
+    for entry in value.split(","):
+        if not entry.strip():
+            continue
+        name, separator, path = entry.partition("=")
+        if not separator or not name.strip() or not path.strip():
+            raise ValueError(f"Invalid model entry '{entry}', expected name=path")
+        models[name.strip()] = path.strip()
+    return models
+
+
+class ModelStats():
+    def __init__(self):
+        self.hits = 0
+        self.loads = 0
+        self.evictions = 0
+
+    def as_dict(self):
+        return {
+            "hits": self.hits,
+            "loads": self.loads,
+            "evictions": self.evictions,
+        }
+
+
+class ModelManager():
+    """Loads models by name on demand and keeps the most recently used ones within max_bytes.
+
+    load(name, path) returns a model with a memory_bytes() method, and
+    on_evict(name, model) is called when a model is dropped, to release
+    anything else that holds on to it. estimate(name, path) returns the
+    expected memory_bytes() of a model before it is loaded, or None when
+    it cannot tell; models are then only evicted after the load.
+    """
+
+    def __init__(self, models, load, max_bytes, on_evict=None, estimate=None):
+        self.models = dict(models)
+        self.load = load
+        self.max_bytes = max_bytes
+        self.on_evict = on_evict
+        self.estimate = estimate
+        self.size = 0
+        self.stats = ModelStats()
+        self._resident = OrderedDict()
+        self._lock = threading.Lock()
+        # One lock per model, so a slow load does not block requests for resident models
+        self._load_locks = {name: threading.Lock() for name in self.models}
+
+    def get(self, name):
+        """The model called name, loading it first if it is not resident. Unknown names raise KeyError."""
+        if name not in self.models:
+            raise KeyError(f"Unknown embedding model '{name}', expected one of {', '.join(self.models)}")
+        model = self._lookup(name)
+        if model is not None:
+            return model
+        with self._load_locks[name]:
+            # Another request may have loaded it while this one waited
+            model = self._lookup(name)
+            if model is not None:
+                return model
+            estimated = self.estimate(name, self.models[name]) if self.estimate is not None else None
+            if estimated:
+                # Room is made before loading, so the new model does not load on top of the old ones
+                self._evict(self.max_bytes - estimated)
+            model = self.load(name, self.models[name])
+            self._add(name, model, model.memory_bytes())
+        return model
+
+    def _lookup(self, name):
+        with self._lock:
+            entry = self._resident.get(name)
+            if entry is None:
+                return None
+            self._resident.move_to_end(name)
+            self.stats.hits += 1
+            return entry[0]
+
+    def _add(self, name, model, size):
+        with self._lock:
+            self._resident[name] = (model, size)
+            self.size += size
+            self.stats.loads += 1
+        logger.info(f"Loaded embedding model {name} ({size / 2 ** 20:.0f} MB)")
+        # The estimate may have been low, or missing
+        self._evict(self.max_bytes, keep=name)
+
+    def _evict(self, max_bytes, keep=None):
+        """Drop the least recently used models, except keep, until the resident ones fit in max_bytes."""
+        evicted = []
+        with self._lock:
+            for evicted_name in list(self._resident):
+                if self.size <= max_bytes:
+                    break
+                if evicted_name == keep:
+                    continue
+                evicted_model, evicted_size = self._resident.pop(evicted_name)
+                self.size -= evicted_size
+                self.stats.evictions += 1
+                evicted.append((evicted_name, evicted_model, evicted_size))
+        for evicted_name, evicted_model, evicted_size in evicted:
+            logger.info(f"Evicted embedding model {evicted_name} ({evicted_size / 2 ** 20:.0f} MB)")
+            if self.on_evict is not None:
+                self.on_evict(evicted_name, evicted_model)
+        if evicted:
+            # Requests still running on an evicted model keep it alive until they finish
+            del evicted, evicted_model
+            gc.collect()
+
+    def resident(self):
+        """Names of the resident models, least recently used first."""
+        with self._lock:
+            return list(self._resident)
+
+    def describe(self):
+        return {
+            "resident": self.resident(),
+            "resident_bytes": self.size,
+            "max_bytes": self.max_bytes,
+            **self.stats.as_dict(),
+        }
@@ -0,0 +1,130 @@
+"""ONNX Runtime inference for the TextEmbedder.
+
+The transformer is exported to ONNX once and run by onnxruntime with all
+graph optimizations, optionally with its weights dynamically quantized to
+int8. Pooling and normalization stay in the TextEmbedder, so the backends
+only differ in how the token embeddings are computed.
+
+The function does not export models itself, so they are exported ahead
+of deployment; onnxruntime and onnx are in requirements-onnx.txt:
+
+    python -m embedder.onnx_backend --model sentence-transformers/all-MiniLM-L6-v2 --output onnx-model --quantize
+"""
+import argparse
+import inspect
+import os
+import tempfile
+
+import torch
+
+ONNX_FILE = 'model.onnx'
+QUANTIZED_FILE = 'model.int8.onnx'
+# Inputs of BERT-style encoders, in the order the exported graph takes them
+INPUT_NAMES = ['input_ids', 'attention_mask', 'token_type_ids']
+
+
+def default_onnx_dir(model_path):
+    """Folder the ONNX files of a model are exported to when none is configured."""
+    if os.path.isdir(model_path):
+        return os.path.join(model_path, 'onnx')
+    return os.path.join(tempfile.gettempdir(), 'embedder-onnx', model_path.replace('/', '--'))
+
+
+class _TokenEmbeddings(torch.nn.Module):
+    """Model with positional inputs and the token embeddings as its only output, for tracing."""
+
+    def __init__(self, model, names):
+        super().__init__()
+        self.model = model
+        self.names = names
+
+    def forward(self, *inputs):
+        return self.model(**dict(zip(self.names, inputs)))[0]
+
+
+def export(model, tokenizer, directory, quantize=False, opset=14):
+    """Export model to directory/model.onnx, and to model.int8.onnx too if quantize is set."""
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, ONNX_FILE)
+    # A padded sample, so the attention mask is not traced away as all ones
+    sample = tokenizer(['an input to trace the model with', 'input'], padding=True, return_tensors='pt')
+    names = [name for name in INPUT_NAMES if name in sample]
+    options = {}
+    # Newer torch versions default to the dynamo exporter, which needs extra packages
+    if 'dynamo' in inspect.signature(torch.onnx.export).parameters:
+        options['dynamo'] = False
+    model.eval()
+    with torch.no_grad():
+        torch.onnx.export(
+            _TokenEmbeddings(model, names),
+            tuple(sample[name] for name in names),
+            path,
+            input_names=names,
+            output_names=['last_hidden_state'],
+            dynamic_axes={name: {0: 'batch', 1: 'sequence'} for name in names + ['last_hidden_state']},
+            opset_version=opset,
+            **options,
+        )
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        quantize_dynamic(path, os.path.join(directory, QUANTIZED_FILE), weight_type=QuantType.QInt8)
+    return path
+
+
+class OnnxModel():
+    """Runs an exported model with the same call interface as the transformers model."""
+
+    def __init__(self, path, intra_op_threads=0):
+        try:
+            import onnxruntime
+        except ImportError as e:
+            raise ImportError('The onnx backends need onnxruntime, install requirements-onnx.txt') from e
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if intra_op_threads:
+            options.intra_op_num_threads = intra_op_threads
+        self.path = path
+        self.session = onnxruntime.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+        self.input_names = [model_input.name for model_input in self.session.get_inputs()]
+
+    def __call__(self, **encoded_input):
+        outputs = self.session.run(None, {name: encoded_input[name].numpy() for name in self.input_names})
+        # First element is the token embeddings, like the transformers model output
+        return (torch.from_numpy(outputs[0]),)
+
+
+def onnx_model_path(model_path, quantized=False, onnx_dir=None):
+    """Path of the exported ONNX file of model_path."""
+    return os.path.join(onnx_dir or default_onnx_dir(model_path), QUANTIZED_FILE if quantized else ONNX_FILE)
+
+
+def load_onnx_model(model_path, tokenizer, quantized=False, onnx_dir=None, intra_op_threads=0, export_missing=True):
+    """OnnxModel of model_path, exporting it first if onnx_dir has no export yet and export_missing is set."""
+    onnx_dir = onnx_dir or default_onnx_dir(model_path)
+    path = onnx_model_path(model_path, quantized, onnx_dir)
+    if not os.path.exists(path):
+        if not export_missing:
+            raise FileNotFoundError(
+                f"No ONNX export of {model_path} at {path}, create it with: python -m embedder.onnx_backend "
+                f"--model {model_path} --output {onnx_dir}{' --quantize' if quantized else ''}")
+        from transformers import AutoModel
+
+        export(AutoModel.from_pretrained(model_path), tokenizer, onnx_dir, quantize=quantized)
+    return OnnxModel(path, intra_op_threads)
+
+
+if __name__ == '__main__':
+    from transformers import AutoModel, AutoTokenizer
+
+    from embedder.text_embedder import DEFAULT_MODEL
+
+    parser = argparse.ArgumentParser(description='Export an embedding model to ONNX')
+    parser.add_argument('--model', default=DEFAULT_MODEL)
+    parser.add_argument('--output', help='folder for the ONNX files, the model folder/onnx by default')
+    parser.add_argument('--quantize', action='store_true', help='also write a dynamically int8 quantized model')
+    args = parser.parse_args()
+    output = args.output or default_onnx_dir(args.model)
+    export(AutoModel.from_pretrained(args.model), AutoTokenizer.from_pretrained(args.model), output, args.quantize)
+    print(f'Exported {args.model} to {output}')
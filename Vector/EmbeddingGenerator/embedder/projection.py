@@ -0,0 +1,91 @@
+"""Dimensionality reduction of the embedding vectors.
+
+A PCA projection is fitted offline on the vectors of a sample corpus and
+saved as a .npy array of principal components (rows), most significant
+first. The vectors are not centered: the uncentered components span the
+subspace that best keeps the dot products the index ranks by, which the
+common offset of sentence embeddings would otherwise distort. At runtime
+vectors are projected on the first k components and normalized again, so
+a single fitted file serves every k. Without a fitted file, vectors of
+models trained for it (Matryoshka embeddings) can be truncated to their
+first k dimensions instead.
+
+Fit the projection on a sample of the corpus, one text per line:
+
+    python -m embedder.projection --input sample.txt --output projection.npy
+"""
+import argparse
+import json
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+
+def fit_pca(vectors, dimensions=None):
+    """Principal components (rows) of vectors, as saved to a projection file."""
+    # Rows of vt are the principal directions, ordered by the share of the vectors they explain
+    _, _, vt = np.linalg.svd(np.asarray(vectors, dtype=np.float64), full_matrices=False)
+    return (vt[:dimensions] if dimensions else vt).astype(np.float32)
+
+
+class Projection():
+    def __init__(self, dimensions=None, components=None):
+        if components is not None:
+            dimensions = min(dimensions or len(components), len(components))
+            components = components[:dimensions]
+        self.dimensions = dimensions
+        self.components = torch.from_numpy(np.ascontiguousarray(components.T)) if components is not None else None
+
+    @classmethod
+    def load(cls, path, dimensions=None):
+        return cls(dimensions, np.load(path).astype(np.float32))
+
+    @property
+    def name(self):
+        """Identifies the projected vectors, e.g. in cache keys and logs."""
+        return f"{'pca' if self.components is not None else 'truncate'}-{self.dimensions}"
+
+    def apply(self, embeddings):
+        """Project normalized embeddings (rows) to self.dimensions and normalize them again."""
+        if self.components is not None:
+            embeddings = embeddings @ self.components.to(embeddings.dtype)
+        else:
+            embeddings = embeddings[:, :self.dimensions]
+        return F.normalize(embeddings, p=2, dim=1)
+
+
+def read_texts(path):
+    """Texts of a sample file: one text per line, or skill records ({"data": {"text": ...}}) as JSON lines."""
+    with open(path, 'r', encoding='utf-8') as file:
+        for line in file:
+            line = line.strip()
+            if line.startswith('{'):
+                line = json.loads(line).get('data', {}).get('text', '')
+            if line:
+                yield line
+
+
+if __name__ == '__main__':
+    from embedder.text_embedder import BACKENDS, DEFAULT_MODEL, TextEmbedder
+
+    parser = argparse.ArgumentParser(description='Fit a PCA projection of the embeddings of a sample corpus')
+    parser.add_argument('--input', required=True, help='sample texts, one per line, or skill records as JSON lines')
+    parser.add_argument('--output', required=True, help='.npy file the projection is saved to')
+    parser.add_argument('--dimensions', type=int, help='number of components to keep, all of them by default')
+    parser.add_argument('--model', default=DEFAULT_MODEL)
+    parser.add_argument('--backend', choices=BACKENDS, default='torch')
+    parser.add_argument('--batch-size', type=int, default=256)
+    args = parser.parse_args()
+
+    embedder = TextEmbedder(args.model, backend=args.backend)
+    texts = list(read_texts(args.input))
+    vectors = np.concatenate([
+        embedder.generate_embeddings(texts[start:start + args.batch_size]).numpy()
+        for start in range(0, len(texts), args.batch_size)
+    ])
+    if len(vectors) < vectors.shape[1]:
+        print(f'Warning: {len(vectors)} sample texts for {vectors.shape[1]} dimensions, '
+              'the components past the sample size are arbitrary')
+    np.save(args.output, fit_pca(vectors, args.dimensions))
+    print(f'Fitted a projection of {len(vectors)} vectors to {args.output}')
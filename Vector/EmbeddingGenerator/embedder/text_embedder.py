@@ -1,14 +1,146 @@
 # Code from https://huggingface.co/sentence-transformers/all-MiniLM-L6-v2
+import logging
+import os
+import time
+
+from huggingface_hub import try_to_load_from_cache
 from transformers import AutoTokenizer, AutoModel
 import torch
 import torch.nn.functional as F
 
+from embedder.onnx_backend import load_onnx_model, onnx_model_path
+
+DEFAULT_MODEL = 'sentence-transformers/all-MiniLM-L6-v2'
+# Padded tokens (batch size x longest input) of one forward pass
+DEFAULT_MAX_BATCH_TOKENS = 8192
+# torch runs the model eagerly, the onnx backends with onnxruntime
+BACKENDS = ('torch', 'onnx', 'onnx-int8')
+# all-MiniLM-L6-v2 was trained on inputs of up to 256 tokens
+DEFAULT_WINDOW_TOKENS = 256
+DEFAULT_WINDOW_OVERLAP = 32
+# How the window vectors of a long text are combined: plain mean, or weighted by window length
+POOLING = ('mean', 'weighted')
+# Weight files the torch backend loads, in the order transformers looks for them
+WEIGHT_FILES = ('model.safetensors', 'pytorch_model.bin')
+
+
+_threads_configured = False
+
+
+def configure_threads(intra_op_threads=0, inter_op_threads=0):
+    """Set the torch thread pools once per process; 0 keeps the torch default."""
+    global _threads_configured
+    if _threads_configured:
+        return
+    _threads_configured = True
+    if intra_op_threads:
+        torch.set_num_threads(intra_op_threads)
+    if inter_op_threads:
+        try:
+            torch.set_num_interop_threads(inter_op_threads)
+        except RuntimeError as e:
+            # Only possible before torch runs any parallel work
+            logging.warning(f'Could not set the torch inter-op threads: {e}')
+
+
+def length_buckets(lengths, max_batch_tokens, max_batch_size=None):
+    """Split input indexes into batches of similar token length.
+
+    Indexes are sorted by length and cut into consecutive runs whose padded
+    size (run length x longest input of the run) stays within
+    max_batch_tokens, so a long input only pads inputs of about its own
+    length. An input longer than max_batch_tokens gets a batch of its own.
+    max_batch_tokens <= 0 keeps every input in one batch.
+    """
+    order = sorted(range(len(lengths)), key=lambda index: lengths[index])
+    if max_batch_tokens <= 0:
+        return [order] if order else []
+    buckets = []
+    bucket = []
+    for index in order:
+        # Sorted ascending, so the newest input is the longest in the bucket
+        too_many = max_batch_size and len(bucket) >= max_batch_size
+        if bucket and (too_many or (len(bucket) + 1) * lengths[index] > max_batch_tokens):
+            buckets.append(bucket)
+            bucket = []
+        bucket.append(index)
+    if bucket:
+        buckets.append(bucket)
+    return buckets
+
+
+def pool_windows(window_embeddings, spans, pooling='mean'):
+    """One normalized vector per text from the vectors of its windows.
+
+    spans holds the (start, end, tokens) of the windows of every text, in
+    the order of window_embeddings.
+    """
+    if pooling not in POOLING:
+        raise ValueError(f"Unknown pooling {pooling}, expected one of {', '.join(POOLING)}")
+    pooled = []
+    start = 0
+    for text_spans in spans:
+        vectors = window_embeddings[start:start + len(text_spans)]
+        start += len(text_spans)
+        if pooling == 'weighted':
+            weights = torch.tensor([float(max(tokens, 1)) for _, _, tokens in text_spans], dtype=vectors.dtype)
+            pooled.append((vectors * weights.unsqueeze(1)).sum(0) / weights.sum())
+        else:
+            pooled.append(vectors.mean(0))
+    return F.normalize(torch.stack(pooled), p=2, dim=1)
+
+
+def estimate_memory_bytes(model_path, backend='torch', onnx_dir=None):
+    """Size of the weight file a model loads, close to its memory_bytes(), or None if it is not on disk."""
+    if backend != 'torch':
+        paths = [onnx_model_path(model_path, backend == 'onnx-int8', onnx_dir)]
+    elif os.path.isdir(model_path):
+        paths = [os.path.join(model_path, file) for file in WEIGHT_FILES]
+    else:
+        try:
+            # Hub models are looked up in the local cache, without a network call
+            paths = [try_to_load_from_cache(model_path, file) for file in WEIGHT_FILES]
+        except ValueError:
+            # Neither a folder nor a hub id, which the load itself reports
+            return None
+    for path in paths:
+        if isinstance(path, str) and os.path.isfile(path):
+            return os.path.getsize(path)
+    return None
+
+
 class TextEmbedder():
-    def __init__(self):
-        # Load model from HuggingFace Hub
-        model_path = 'sentence-transformers/all-MiniLM-L6-v2'
+    def __init__(self, model_path=DEFAULT_MODEL, max_batch_tokens=DEFAULT_MAX_BATCH_TOKENS, max_batch_size=None,
+                 backend='torch', onnx_dir=None, intra_op_threads=0, export_onnx=True):
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown embedding backend {backend}, expected one of {', '.join(BACKENDS)}")
+        # Load model from HuggingFace Hub, or from a local folder with a pre-baked model
         self.tokenizer = AutoTokenizer.from_pretrained(model_path)
-        self.model = AutoModel.from_pretrained(model_path)
+        if backend == 'torch':
+            self.model = AutoModel.from_pretrained(model_path)
+            self.model.eval()
+        else:
+            self.model = load_onnx_model(model_path, self.tokenizer, backend == 'onnx-int8', onnx_dir, intra_op_threads,
+                                         export_missing=export_onnx)
+        self.backend = backend
+        # Identifies the vectors this embedder produces, e.g. for caching them
+        self.model_id = f'{model_path}:{backend}'
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_size = max_batch_size
+
+    def memory_bytes(self):
+        """Approximate memory held by the model weights."""
+        if self.backend == 'torch':
+            tensors = list(self.model.parameters()) + list(self.model.buffers())
+            return sum(tensor.numel() * tensor.element_size() for tensor in tensors)
+        # onnxruntime keeps the initializers of the exported file in memory
+        return os.path.getsize(self.model.path)
+
+    def warm_up(self):
+        """Run a short and a long input through the model, so the first request does not pay for it."""
+        started = time.perf_counter()
+        self.generate_embeddings(['warm up', 'warm up ' * DEFAULT_WINDOW_TOKENS])
+        return time.perf_counter() - started
 
     # Mean Pooling - Take attention mask into account for correct averaging
     def _mean_pooling(self, model_output, attention_mask):
@@ -16,10 +148,7 @@ class TextEmbedder():
         input_mask_expanded = (attention_mask.unsqueeze(-1).expand(token_embeddings.size()).float())
         return torch.sum(token_embeddings * input_mask_expanded, 1) / torch.clamp(input_mask_expanded.sum(1), min=1e-9)
 
-    def generate_embeddings(self, sentences):
-        # # Tokenize sentences
-        encoded_input = self.tokenizer(sentences, padding=True, truncation=True, return_tensors='pt')
-
+    def _embed_batch(self, encoded_input):
         # Compute token embeddings
         with torch.no_grad():
             model_output = self.model(**encoded_input)
@@ -28,5 +157,62 @@ class TextEmbedder():
         sentence_embeddings = self._mean_pooling(model_output, encoded_input['attention_mask'])
 
         # Normalize embeddings
-        sentence_embeddings = F.normalize(sentence_embeddings, p=2, dim=1)
-        return sentence_embeddings
\ No newline at end of file
+        return F.normalize(sentence_embeddings, p=2, dim=1)
+
+    def generate_embeddings(self, sentences):
+        # Tokenize without padding first, so every batch is only padded to its own longest input
+        return self._embed_encoded(self.tokenizer(sentences, truncation=True))
+
+    def _embed_encoded(self, encoded):
+        lengths = [len(input_ids) for input_ids in encoded['input_ids']]
+
+        embeddings = None
+        for bucket in length_buckets(lengths, self.max_batch_tokens, self.max_batch_size):
+            encoded_input = self.tokenizer.pad(
+                {key: [values[index] for index in bucket] for key, values in encoded.items()},
+                return_tensors='pt')
+            bucket_embeddings = self._embed_batch(encoded_input)
+            if embeddings is None:
+                embeddings = bucket_embeddings.new_empty((len(lengths), bucket_embeddings.shape[1]))
+            # Back to the order of the input sentences
+            embeddings[torch.tensor(bucket)] = bucket_embeddings
+        return embeddings
+
+
+    def _window_spans(self, text, window_tokens, overlap_tokens):
+        """(start, end, tokens) character spans of the overlapping token windows of text."""
+        encoded = self.tokenizer(text, add_special_tokens=False, return_offsets_mapping=True, verbose=False)
+        offsets = encoded['offset_mapping']
+        content_tokens = window_tokens - self.tokenizer.num_special_tokens_to_add()
+        step = max(1, content_tokens - overlap_tokens)
+        spans = []
+        start = 0
+        while True:
+            window = offsets[start:start + content_tokens]
+            spans.append((window[0][0], window[-1][1], len(window)) if window else (0, len(text), 0))
+            if start + content_tokens >= len(offsets):
+                return spans
+            start += step
+
+    def generate_window_embeddings(self, texts, window_tokens=DEFAULT_WINDOW_TOKENS,
+                                   overlap_tokens=DEFAULT_WINDOW_OVERLAP):
+        """Vectors of the overlapping token windows of every text, instead of truncating long texts.
+
+        The windows of all texts are embedded together. Returns the window
+        vectors and, per text, the (start, end, tokens) character span of
+        each of its windows, in the same order. A text that fits in one
+        window gets a single window with the vector generate_embeddings
+        gives it.
+        """
+        window_tokens = min(window_tokens, self.tokenizer.model_max_length)
+        spans = [self._window_spans(text, window_tokens, overlap_tokens) for text in texts]
+        # The text of a window tokenizes back to its tokens, with the special tokens added
+        window_texts = [text[start:end] for text, text_spans in zip(texts, spans) for start, end, _ in text_spans]
+        encoded = self.tokenizer(window_texts, truncation=True, max_length=window_tokens)
+        return self._embed_encoded(encoded), spans
+
+    def generate_long_embeddings(self, texts, pooling='mean', window_tokens=DEFAULT_WINDOW_TOKENS,
+                                 overlap_tokens=DEFAULT_WINDOW_OVERLAP):
+        """One vector per text, pooled from the vectors of its windows."""
+        window_embeddings, spans = self.generate_window_embeddings(texts, window_tokens, overlap_tokens)
+        return pool_windows(window_embeddings, spans, pooling)
@@ -1,14 +1,130 @@
 import azure.functions as func
 import logging
 import json
+import os
+import time
 import jsonschema
-from embedder.text_embedder import TextEmbedder
+from embedder.coalescer import EmbeddingCoalescer
+from embedder.embedding_cache import EmbeddingCache
+from embedder.encoding import VECTOR_FORMATS, dumps, vector_data
+from embedder.model_manager import ModelManager, parse_models
+from embedder.projection import Projection
+from embedder.text_embedder import (DEFAULT_MAX_BATCH_TOKENS, DEFAULT_MODEL, DEFAULT_WINDOW_OVERLAP, DEFAULT_WINDOW_TOKENS,
+                                    POOLING, TextEmbedder, configure_threads, estimate_memory_bytes, pool_windows)
 
 app = func.FunctionApp()
-EMBEDDING_HELPER = TextEmbedder()
+# Thread pools are sized once, before the model runs
+configure_threads(int(os.getenv("EMBEDDING_INTRA_OP_THREADS", "0")), int(os.getenv("EMBEDDING_INTER_OP_THREADS", "0")))
+# A folder baked with embedder.artifacts loads without the hub
+DEFAULT_MODEL_PATH = os.getenv("EMBEDDING_MODEL_PATH", DEFAULT_MODEL)
+# Models requests can choose from, as name=path pairs; the first one is the default
+MODELS = parse_models(os.getenv("EMBEDDING_MODELS"), os.path.basename(DEFAULT_MODEL_PATH.rstrip("/")), DEFAULT_MODEL_PATH)
+DEFAULT_MODEL_NAME = next(iter(MODELS))
+WARMUP = os.getenv("EMBEDDING_WARMUP", "true").lower() == "true"
+COALESCE = os.getenv("EMBEDDING_COALESCE", "true").lower() == "true"
+# Texts of concurrent requests for a model share forward passes on its inference thread
+COALESCERS = {}
+
+def model_onnx_dir(name):
+    # An export folder holds a single model, so it only applies to the default model
+    return os.getenv("EMBEDDING_ONNX_PATH") if name == DEFAULT_MODEL_NAME else None
+
+def estimate_embedder(name, path):
+    return estimate_memory_bytes(path, os.getenv("EMBEDDING_BACKEND", "torch"), model_onnx_dir(name))
+
+def load_embedder(name, path):
+    load_started = time.perf_counter()
+    embedder = TextEmbedder(
+        path,
+        max_batch_tokens=int(os.getenv("EMBEDDING_MAX_BATCH_TOKENS", str(DEFAULT_MAX_BATCH_TOKENS))),
+        max_batch_size=int(os.getenv("EMBEDDING_MAX_BATCH_SIZE", "0")) or None,
+        backend=os.getenv("EMBEDDING_BACKEND", "torch"),
+        onnx_dir=model_onnx_dir(name),
+        intra_op_threads=int(os.getenv("EMBEDDING_INTRA_OP_THREADS", "0")),
+        # Exporting inside the Functions host is slow and needs onnx, so a missing export fails the load
+        export_onnx=False,
+    )
+    logging.info(f'Loaded {embedder.model_id} in {time.perf_counter() - load_started:.2f}s')
+    if WARMUP:
+        logging.info(f'Warmed up the embedding model {name} in {embedder.warm_up():.2f}s')
+    if COALESCE:
+        COALESCERS[name] = EmbeddingCoalescer(
+            embedder.generate_embeddings,
+            max_batch_size=int(os.getenv("EMBEDDING_COALESCE_MAX_BATCH_SIZE", "64")),
+            max_wait_ms=float(os.getenv("EMBEDDING_COALESCE_MAX_WAIT_MS", "2")),
+        )
+    return embedder
+
+def unload_embedder(name, embedder):
+    # The inference thread holds the model, so it is stopped with it
+    coalescer = COALESCERS.pop(name, None)
+    if coalescer is not None:
+        coalescer.close()
+
+MODEL_MANAGER = ModelManager(MODELS, load_embedder, int(float(os.getenv("EMBEDDING_MODEL_MEMORY_MB", "2048")) * 1024 * 1024),
+                             on_evict=unload_embedder, estimate=estimate_embedder)
+# The default model is loaded at startup, the others when they are first requested
+MODEL_MANAGER.get(DEFAULT_MODEL_NAME)
+EMBEDDING_CACHE = EmbeddingCache.from_env() if os.getenv("EMBEDDING_CACHE", "true").lower() == "true" else None
+VECTOR_FORMAT = os.getenv("EMBEDDING_VECTOR_FORMAT", "float")
+VECTOR_PRECISION = os.getenv("EMBEDDING_VECTOR_PRECISION")
+
+
+def load_projection():
+    """The projection set by EMBEDDING_PROJECTION_PATH and EMBEDDING_DIMENSIONS, or None to keep full vectors."""
+    # A dimension count of 0 or less means all dimensions, as when it is not set
+    dimensions = int(os.getenv("EMBEDDING_DIMENSIONS") or "0")
+    dimensions = dimensions if dimensions > 0 else None
+    if os.getenv("EMBEDDING_PROJECTION_PATH"):
+        return Projection.load(os.getenv("EMBEDDING_PROJECTION_PATH"), dimensions)
+    return Projection(dimensions) if dimensions else None
+
+
+# Vectors of the default model are projected after the cache, so the cache keeps the full vectors for any projection
+PROJECTION = load_projection()
+if PROJECTION is not None:
+    logging.info(f'Embedding vectors are projected to {PROJECTION.name}')
+# truncate embeds the start of long texts, the pooling modes pool the vectors of their
+# overlapping windows, and windows also returns the vector of every window
+LONG_TEXT_MODES = ("truncate",) + POOLING + ("windows",)
+LONG_TEXT = os.getenv("EMBEDDING_LONG_TEXT", "truncate")
+WINDOW_TOKENS = int(os.getenv("EMBEDDING_WINDOW_TOKENS", str(DEFAULT_WINDOW_TOKENS)))
+WINDOW_OVERLAP = int(os.getenv("EMBEDDING_WINDOW_OVERLAP_TOKENS", str(DEFAULT_WINDOW_OVERLAP)))
+
+def embed_texts(model_name, embedder, texts, long_text, vector_format, precision):
+    """Payloads (and windows) of distinct texts with one model, and the number of texts from the cache."""
+    projection = PROJECTION if model_name == DEFAULT_MODEL_NAME else None
+    cache_hits = 0
+    windows = None
+    if long_text == "windows":
+        window_embeddings, spans = embedder.generate_window_embeddings(texts, WINDOW_TOKENS, WINDOW_OVERLAP)
+        embeddings = pool_windows(window_embeddings, spans, "mean")
+        if projection is not None:
+            window_embeddings = projection.apply(window_embeddings)
+        window_data = iter(vector_data(vector, vector_format, precision) for vector in window_embeddings.numpy())
+        windows = [[{**next(window_data), "offset": start, "length": end - start}
+                    for start, end, _ in text_spans] for text_spans in spans]
+    else:
+        coalescer = COALESCERS.get(model_name)
+        embed = coalescer.embed if coalescer is not None else embedder.generate_embeddings
+        model_id = embedder.model_id
+        if long_text != "truncate":
+            # The windows of all texts are embedded together, so these skip the coalescer
+            embed = lambda batch: embedder.generate_long_embeddings(batch, long_text, WINDOW_TOKENS, WINDOW_OVERLAP)
+            model_id = f"{model_id}:{long_text}:{WINDOW_TOKENS}:{WINDOW_OVERLAP}"
+        if EMBEDDING_CACHE is not None:
+            # Only texts that are not in the cache are sent to the model
+            embeddings, cache_hits = EMBEDDING_CACHE.embed(texts, model_id, embed)
+        else:
+            embeddings = embed(texts)
+    if projection is not None:
+        embeddings = projection.apply(embeddings)
+    # One payload per distinct text, shared by its records
+    payloads = [vector_data(vector, vector_format, precision) for vector in embeddings.numpy()]
+    return payloads, windows, cache_hits
 
 @app.function_name(name="TextEmbedder")
-@app.route(route="embed")
+@app.route(route="embed/{model?}")
 def text_chunking(req: func.HttpRequest) -> func.HttpResponse:
     logging.info('Python HTTP trigger function processed a request.')
     request = req.get_json()
@@ -18,29 +134,88 @@ def text_chunking(req: func.HttpRequest) -> func.HttpResponse:
     except jsonschema.exceptions.ValidationError as e:
         return func.HttpResponse("Invalid request: {0}".format(e), status_code=400)
 
-    texts = []
-    for value in request["values"]:
-        texts.append(value["data"]["text"])
+    # The wire format can be chosen per request with headers, e.g. in the skill's httpHeaders
+    vector_format = req.headers.get("vector-format", VECTOR_FORMAT)
+    precision = req.headers.get("vector-precision", VECTOR_PRECISION)
+    if vector_format not in VECTOR_FORMATS:
+        return func.HttpResponse("Invalid vector-format: expected one of {0}".format(", ".join(VECTOR_FORMATS)), status_code=400)
+    try:
+        precision = int(precision) if precision else None
+    except ValueError:
+        return func.HttpResponse("Invalid vector-precision: expected a number of decimals", status_code=400)
+    long_text = req.headers.get("long-text", LONG_TEXT)
+    if long_text not in LONG_TEXT_MODES:
+        return func.HttpResponse("Invalid long-text: expected one of {0}".format(", ".join(LONG_TEXT_MODES)), status_code=400)
 
-    embeddings = EMBEDDING_HELPER.generate_embeddings(texts)
+    # A record's model comes from its data, then from the route (embed/<model>), then the default
+    route_model = req.route_params.get("model") or DEFAULT_MODEL_NAME
+    model_records = {}
+    for index, value in enumerate(request["values"]):
+        model_records.setdefault(value["data"].get("model") or route_model, []).append(index)
 
-    values = []
-    for index, value in enumerate(request['values']):
-        recordId = value['recordId']
-        embedding = embeddings[index]
-        values.append({
-            "recordId": recordId,
-            "data": {"vector": embedding.tolist()},
-            "errors": None,
-            "warnings": None
-        })
+    values = [None] * len(request["values"])
+    skipped = 0
+    cache_hits = 0
+    for model_name, indexes in model_records.items():
+        try:
+            embedder = MODEL_MANAGER.get(model_name)
+        except Exception as e:
+            # An unknown model, or one that fails to load, only fails its own records
+            if isinstance(e, KeyError):
+                message = e.args[0]
+            else:
+                logging.exception(f'Failed to load the embedding model {model_name}')
+                message = f"Failed to load embedding model '{model_name}': {e}"
+            for index in indexes:
+                values[index] = {
+                    "recordId": request["values"][index]["recordId"],
+                    "data": None,
+                    "errors": [{"message": message}],
+                    "warnings": None
+                }
+            continue
+
+        # Records with the same text are embedded once and share the vector
+        texts = []
+        text_indexes = {}
+        record_indexes = []
+        for index in indexes:
+            text = request["values"][index]["data"]["text"]
+            if text not in text_indexes:
+                text_indexes[text] = len(texts)
+                texts.append(text)
+            record_indexes.append(text_indexes[text])
+        skipped += len(record_indexes) - len(texts)
+
+        # The records of a model are embedded together, in shared forward passes
+        payloads, windows, model_cache_hits = embed_texts(model_name, embedder, texts, long_text, vector_format, precision)
+        cache_hits += model_cache_hits
+        for index, text_index in zip(indexes, record_indexes):
+            data = dict(payloads[text_index])
+            if windows is not None:
+                data["windows"] = windows[text_index]
+            values[index] = {
+                "recordId": request["values"][index]["recordId"],
+                "data": data,
+                "errors": None,
+                "warnings": None
+            }
 
     response_body = { "values": values }
 
-    logging.info(f'Python HTTP trigger function created {len(values)} embeddings.')
+    logging.info(f'Python HTTP trigger function created {len(values)} embeddings with {len(model_records)} models, skipping {skipped} duplicate texts.')
+    logging.info(f'Embedding models: {json.dumps(MODEL_MANAGER.describe())}')
+    if EMBEDDING_CACHE is not None:
+        logging.info(f'Embedding cache: {cache_hits} texts cached, {json.dumps(EMBEDDING_CACHE.describe())}')
+    for model_name, coalescer in list(COALESCERS.items()):
+        logging.info(f'Embedding coalescer of {model_name}: {json.dumps(coalescer.stats.as_dict())}')
 
-    response = func.HttpResponse(json.dumps(response_body, default=lambda obj: obj.__dict__))
+    response = func.HttpResponse(dumps(response_body))
     response.headers['Content-Type'] = 'application/json'    
+    response.headers['deduplicated-records'] = str(skipped)
+    if EMBEDDING_CACHE is not None:
+        response.headers['embedding-cache-hits'] = str(cache_hits)
+        response.headers['embedding-cache-hit-rate'] = str(EMBEDDING_CACHE.stats.as_dict()['hit_rate'])
     return response
 
 def get_request_schema():
@@ -58,7 +233,8 @@ def get_request_schema():
                         "data": {
                             "type": "object",
                             "properties": {
-                                "text": {"type": "string", "minLength": 1}
+                                "text": {"type": "string", "minLength": 1},
+                                "model": {"type": "string"}
                             },
                             "required": ["text"],
                         },
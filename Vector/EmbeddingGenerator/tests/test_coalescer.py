@@ -0,0 +1,91 @@
+import threading
+import time
+import unittest
+
+import torch
+
+from embedder.coalescer import EmbeddingCoalescer
+
+
+class RecordingEmbedder():
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.batches = []
+        self.started = threading.Event()
+
+    def generate_embeddings(self, texts):
+        self.started.set()
+        time.sleep(self.delay)
+        if "fail" in texts:
+            raise RuntimeError("model error")
+        self.batches.append(list(texts))
+        return torch.tensor([[float(len(text))] for text in texts])
+
+
+class TestEmbeddingCoalescer(unittest.TestCase):
+    def test_concurrent_requests_share_a_forward_pass_and_get_their_own_rows(self):
+        embedder = RecordingEmbedder(delay=0.05)
+        coalescer = EmbeddingCoalescer(embedder.generate_embeddings, max_batch_size=64, max_wait_ms=0)
+        # Keeps the worker busy while the other requests queue up
+        first = coalescer.submit(["x"])
+        embedder.started.wait(1)
+        futures = [coalescer.submit(["a" * n, "b" * (n + 1)]) for n in range(1, 6)]
+
+        self.assertEqual(first.result(1)[0].tolist(), [[1.0]])
+        for n, future in enumerate(futures, start=1):
+            embeddings, requests = future.result(1)
+            self.assertEqual(embeddings[:, 0].tolist(), [float(n), float(n + 1)])
+            self.assertEqual(requests, 5)
+        self.assertEqual(len(embedder.batches), 2)
+        self.assertEqual(coalescer.stats.as_dict()["requests_per_batch"], 3.0)
+
+    def test_batches_stay_within_the_size_limit(self):
+        embedder = RecordingEmbedder(delay=0.05)
+        coalescer = EmbeddingCoalescer(embedder.generate_embeddings, max_batch_size=4, max_wait_ms=0)
+        coalescer.submit(["x"])
+        embedder.started.wait(1)
+        futures = [coalescer.submit(["a", "b", "c"]) for _ in range(3)]
+        for future in futures:
+            future.result(1)
+        self.assertEqual([len(batch) for batch in embedder.batches], [1, 3, 3, 3])
+
+    def test_waits_for_more_requests_up_to_the_wait_time(self):
+        embedder = RecordingEmbedder()
+        coalescer = EmbeddingCoalescer(embedder.generate_embeddings, max_wait_ms=200)
+        first = coalescer.submit(["a"])
+        time.sleep(0.05)
+        second = coalescer.submit(["b"])
+        self.assertEqual(first.result(1)[1], 2)
+        self.assertEqual(second.result(1)[1], 2)
+
+    def test_a_failed_batch_is_retried_per_request_and_only_the_bad_one_fails(self):
+        embedder = RecordingEmbedder(delay=0.05)
+        coalescer = EmbeddingCoalescer(embedder.generate_embeddings, max_wait_ms=0)
+        # Keeps the worker busy while the other requests queue up
+        first = coalescer.submit(["x"])
+        embedder.started.wait(1)
+        futures = [coalescer.submit(["a"]), coalescer.submit(["fail"]), coalescer.submit(["bb", "ccc"])]
+        self.assertEqual(first.result(1)[0].tolist(), [[1.0]])
+        embeddings, requests = futures[0].result(1)
+        self.assertEqual((embeddings.tolist(), requests), ([[1.0]], 1))
+        with self.assertRaisesRegex(RuntimeError, "model error"):
+            futures[1].result(1)
+        self.assertEqual(futures[2].result(1)[0].tolist(), [[2.0], [3.0]])
+        self.assertEqual(embedder.batches, [["x"], ["a"], ["bb", "ccc"]])
+        # The worker keeps running
+        self.assertEqual(coalescer.embed(["ok"]).tolist(), [[2.0]])
+
+    def test_close_answers_queued_requests_and_stops_the_worker(self):
+        embedder = RecordingEmbedder(delay=0.05)
+        coalescer = EmbeddingCoalescer(embedder.generate_embeddings, max_wait_ms=0)
+        queued = [coalescer.submit(["a"]), coalescer.submit(["bb"])]
+        coalescer.close()
+        self.assertEqual([future.result(1)[0].tolist() for future in queued], [[[1.0]], [[2.0]]])
+        coalescer._thread.join(1)
+        self.assertFalse(coalescer._thread.is_alive())
+        # Requests after close still get their vectors, on the caller's thread
+        self.assertEqual(coalescer.embed(["ccc"]).tolist(), [[3.0]])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+import torch
+
+from embedder.embedding_cache import EmbeddingCache, MemoryTier, SqliteTier, embedding_key
+
+VECTOR_BYTES = 4 * 4
+
+
+class CountingEmbedder():
+    def __init__(self):
+        self.calls = []
+
+    def generate_embeddings(self, texts):
+        self.calls.append(list(texts))
+        return torch.tensor([[float(len(text)), 1.0, 2.0, 3.0] for text in texts])
+
+
+class TestEmbeddingCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.path = os.path.join(self.directory.name, "embeddings.db")
+        self.embedder = CountingEmbedder()
+
+    def cache(self, memory_bytes=1024, disk_bytes=None):
+        disk = SqliteTier(self.path, disk_bytes) if disk_bytes else None
+        if disk is not None:
+            self.addCleanup(disk.close)
+        return EmbeddingCache(MemoryTier(memory_bytes), disk)
+
+    def test_only_misses_are_embedded_and_vectors_keep_their_order(self):
+        cache = self.cache()
+        cache.embed(["bb", "c"], "model", self.embedder.generate_embeddings)
+        vectors, hits = cache.embed(["a", "bb", "c  "], "model", self.embedder.generate_embeddings)
+
+        self.assertEqual(self.embedder.calls, [["bb", "c"], ["a"]])
+        self.assertEqual(hits, 2)
+        self.assertEqual(vectors[:, 0].tolist(), [1.0, 2.0, 1.0])
+        self.assertEqual(cache.stats.as_dict()["hit_rate"], 0.4)
+
+    def test_models_do_not_share_vectors(self):
+        self.assertNotEqual(embedding_key("model:torch", "text"), embedding_key("model:onnx-int8", "text"))
+        self.assertEqual(embedding_key("model", "a  text\n"), embedding_key("model", "a text"))
+
+    def test_memory_tier_evicts_least_recently_used_by_size(self):
+        tier = MemoryTier(2 * VECTOR_BYTES)
+        tier.set("a", np.zeros(4, dtype=np.float32))
+        tier.set("b", np.zeros(4, dtype=np.float32))
+        tier.get("a")
+        tier.set("c", np.zeros(4, dtype=np.float32))
+        self.assertIsNone(tier.get("b"))
+        self.assertIsNotNone(tier.get("a"))
+        self.assertEqual(tier.size, 2 * VECTOR_BYTES)
+
+    def test_vectors_survive_a_restart_in_the_sqlite_tier(self):
+        self.cache(disk_bytes=1024).embed(["persisted"], "model", self.embedder.generate_embeddings)
+        cache = self.cache(disk_bytes=1024)
+        vectors, hits = cache.embed(["persisted"], "model", self.embedder.generate_embeddings)
+        self.assertEqual((hits, cache.stats.disk_hits), (1, 1))
+        self.assertEqual(vectors[0].tolist(), [9.0, 1.0, 2.0, 3.0])
+        self.assertEqual(len(self.embedder.calls), 1)
+
+    def test_sqlite_tier_evicts_least_recently_used_above_its_size(self):
+        tier = SqliteTier(self.path, 10 * VECTOR_BYTES)
+        self.addCleanup(tier.close)
+        for batch in range(4):
+            tier.set_many([(f"{batch}-{i}", np.full(4, batch, dtype=np.float32)) for i in range(3)])
+            tier.get_many(["0-0"])
+        self.assertLessEqual(tier.size, 10 * VECTOR_BYTES)
+        self.assertEqual(set(tier.get_many(["0-0", "0-1", "3-2"])), {"0-0", "3-2"})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,34 @@
+import json
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from embedder import encoding
+from embedder.encoding import BASE64_FLOAT16, BASE64_FLOAT32, FLOAT, decode_vector, dumps, vector_payload
+
+VECTOR = np.array([0.1234567, -0.5, 0.0, 0.987654321], dtype=np.float32)
+
+
+class TestVectorPayload(unittest.TestCase):
+    def test_float_vectors_serialize_to_their_float32_values(self):
+        for module in (encoding.orjson, None):
+            with mock.patch.object(encoding, "orjson", module):
+                values = json.loads(dumps({"vector": vector_payload(VECTOR)}))["vector"]
+                self.assertTrue(np.array_equal(np.array(values, dtype=np.float32), VECTOR))
+
+    def test_rounding(self):
+        self.assertEqual(json.loads(dumps({"vector": vector_payload(VECTOR, FLOAT, 3)})),
+                         {"vector": [0.123, -0.5, 0.0, 0.988]})
+
+    def test_base64_round_trips(self):
+        float32 = vector_payload(VECTOR, BASE64_FLOAT32)
+        self.assertIsInstance(float32, str)
+        self.assertTrue(np.array_equal(decode_vector(float32, BASE64_FLOAT32), VECTOR))
+        float16 = decode_vector(vector_payload(VECTOR, BASE64_FLOAT16), BASE64_FLOAT16)
+        self.assertTrue(np.allclose(float16, VECTOR, atol=1e-3))
+        self.assertLess(len(vector_payload(VECTOR, BASE64_FLOAT16)), len(float32))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+import importlib
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import azure.functions as func
+import numpy as np
+
+from tests.tiny_model import save_tiny_model
+
+
+def embed_request(texts, route_params=None, models=None):
+    body = {"values": [{"recordId": str(index), "data": {"text": text}} for index, text in enumerate(texts)]}
+    for value, model in zip(body["values"], models or []):
+        if model:
+            value["data"]["model"] = model
+    return func.HttpRequest("POST", "/api/embed", body=json.dumps(body).encode("utf-8"), route_params=route_params or {})
+
+
+class TestFunctionApp(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        model_path = save_tiny_model(os.path.join(cls.directory.name, "tiny"))
+        environment = {
+            "EMBEDDING_MODEL_PATH": model_path,
+            "EMBEDDING_MODELS": f"tiny={model_path},broken={os.path.join(cls.directory.name, 'missing')}",
+            "EMBEDDING_WARMUP": "false",
+            "EMBEDDING_CACHE": "false",
+        }
+        with mock.patch.dict(os.environ, environment):
+            cls.function_app = importlib.import_module("function_app")
+        cls.handler = staticmethod(cls.function_app.text_chunking.build().get_user_function())
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+
+    def test_duplicate_records_share_one_embedding(self):
+        response = self.handler(embed_request(["a search index", "a vector", "a search index", "a search index"]))
+        values = json.loads(response.get_body())["values"]
+        self.assertEqual([value["recordId"] for value in values], ["0", "1", "2", "3"])
+        self.assertEqual(values[0]["data"], values[2]["data"])
+        self.assertEqual(values[0]["data"], values[3]["data"])
+        self.assertNotEqual(values[0]["data"], values[1]["data"])
+        self.assertEqual(response.headers["deduplicated-records"], "2")
+
+    def test_distinct_records_are_not_counted_as_duplicates(self):
+        response = self.handler(embed_request(["a search index", "a vector"]))
+        self.assertEqual(len(json.loads(response.get_body())["values"]), 2)
+        self.assertEqual(response.headers["deduplicated-records"], "0")
+
+    def test_models_that_fail_to_load_only_fail_their_own_records(self):
+        response = self.handler(embed_request(["a vector", "a vector", "a search index", "a text"],
+                                              models=[None, "broken", "unknown", "tiny"]))
+        values = json.loads(response.get_body())["values"]
+        self.assertIsNotNone(values[0]["data"])
+        self.assertIsNotNone(values[3]["data"])
+        self.assertIsNone(values[1]["data"])
+        self.assertIn("Failed to load embedding model 'broken'", values[1]["errors"][0]["message"])
+        self.assertIsNone(values[2]["data"])
+        self.assertIn("Unknown embedding model 'unknown'", values[2]["errors"][0]["message"])
+
+    def test_dimensions_of_zero_or_less_keep_the_full_vectors(self):
+        for dimensions in ["0", "-1", ""]:
+            with mock.patch.dict(os.environ, {"EMBEDDING_DIMENSIONS": dimensions}):
+                self.assertIsNone(self.function_app.load_projection())
+        with mock.patch.dict(os.environ, {"EMBEDDING_DIMENSIONS": "8"}):
+            self.assertEqual(self.function_app.load_projection().name, "truncate-8")
+
+    def test_dimensions_of_zero_or_less_use_every_component_of_a_projection_file(self):
+        components = np.eye(16, dtype=np.float32)
+        path = os.path.join(self.directory.name, "projection.npy")
+        np.save(path, components)
+        with mock.patch.dict(os.environ, {"EMBEDDING_PROJECTION_PATH": path, "EMBEDDING_DIMENSIONS": "0"}):
+            self.assertEqual(self.function_app.load_projection().name, "pca-16")
+
+
+if __name__ == "__main__":
+    unittest.main()
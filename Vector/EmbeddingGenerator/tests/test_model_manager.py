@@ -0,0 +1,113 @@
+import threading
+import time
+import unittest
+
+from embedder.model_manager import ModelManager, parse_models
+
+MB = 1024 * 1024
+
+
+class FakeModel():
+    def __init__(self, name, size):
+        self.name = name
+        self.size = size
+
+    def memory_bytes(self):
+        return self.size
+
+
+class Loader():
+    def __init__(self, sizes, delay=0.0):
+        self.sizes = sizes
+        self.delay = delay
+        self.loaded = []
+
+    def __call__(self, name, path):
+        time.sleep(self.delay)
+        self.loaded.append(name)
+        return FakeModel(name, self.sizes[name])
+
+
+class TestParseModels(unittest.TestCase):
+    def test_pairs_keep_their_order(self):
+        models = parse_models(" small=models/small, large = models/large ,", "default", "unused")
+        self.assertEqual(list(models.items()), [("small", "models/small"), ("large", "models/large")])
+
+    def test_default_model_without_a_value(self):
+        self.assertEqual(parse_models("", "all-MiniLM-L6-v2", "model"), {"all-MiniLM-L6-v2": "model"})
+
+    def test_entries_without_a_path_are_rejected(self):
+        with self.assertRaises(ValueError):
+            parse_models("small", "default", "unused")
+
+
+class TestModelManager(unittest.TestCase):
+    def setUp(self):
+        self.loader = Loader({"a": 4 * MB, "b": 4 * MB, "c": 4 * MB, "huge": 20 * MB})
+        self.evicted = []
+        self.manager = ModelManager({name: f"models/{name}" for name in self.loader.sizes}, self.loader,
+                                    10 * MB, on_evict=lambda name, model: self.evicted.append(name))
+
+    def test_models_are_loaded_once_on_first_use(self):
+        self.assertIs(self.manager.get("a"), self.manager.get("a"))
+        self.assertEqual(self.loader.loaded, ["a"])
+        self.assertEqual(self.manager.describe()["hits"], 1)
+
+    def test_least_recently_used_model_is_evicted_above_the_budget(self):
+        self.manager.get("a")
+        self.manager.get("b")
+        self.manager.get("a")
+        self.manager.get("c")
+        self.assertEqual(self.evicted, ["b"])
+        self.assertEqual(self.manager.resident(), ["a", "c"])
+        self.assertEqual(self.manager.size, 8 * MB)
+
+    def test_model_larger_than_the_budget_still_loads_alone(self):
+        self.manager.get("a")
+        self.assertEqual(self.manager.get("huge").name, "huge")
+        self.assertEqual(self.manager.resident(), ["huge"])
+        self.assertEqual(self.evicted, ["a"])
+
+    def test_models_are_evicted_before_loading_with_an_estimate(self):
+        resident_at_load = {}
+
+        def load(name, path):
+            resident_at_load[name] = self.manager.resident()
+            return self.loader(name, path)
+
+        self.manager = ModelManager({name: f"models/{name}" for name in self.loader.sizes}, load, 10 * MB,
+                                    on_evict=lambda name, model: self.evicted.append(name),
+                                    estimate=lambda name, path: self.loader.sizes[name])
+        self.manager.get("a")
+        self.manager.get("b")
+        self.manager.get("c")
+        self.assertEqual(resident_at_load["c"], ["b"])
+        self.assertEqual(self.evicted, ["a"])
+        self.assertEqual(self.manager.resident(), ["b", "c"])
+
+    def test_low_estimate_still_keeps_the_budget_after_loading(self):
+        self.manager.estimate = lambda name, path: 1 * MB
+        self.manager.get("a")
+        self.manager.get("b")
+        self.manager.get("c")
+        self.assertEqual(self.evicted, ["a"])
+        self.assertEqual(self.manager.size, 8 * MB)
+
+    def test_unknown_model_raises_key_error(self):
+        with self.assertRaisesRegex(KeyError, "Unknown embedding model 'missing'"):
+            self.manager.get("missing")
+
+    def test_concurrent_requests_share_one_load(self):
+        self.loader.delay = 0.05
+        models = []
+        threads = [threading.Thread(target=lambda: models.append(self.manager.get("a"))) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(1)
+        self.assertEqual(self.loader.loaded, ["a"])
+        self.assertEqual(len({id(model) for model in models}), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
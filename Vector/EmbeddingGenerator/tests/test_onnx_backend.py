@@ -0,0 +1,64 @@
+import importlib.util
+import os
+import tempfile
+import unittest
+
+import torch.nn.functional as F
+
+from embedder.onnx_backend import ONNX_FILE, QUANTIZED_FILE
+from embedder.text_embedder import TextEmbedder
+from tests.tiny_model import save_tiny_model
+
+SENTENCES = ["a document", "the search index of the azure skill", "vector " * 40, "long text " * 3]
+
+
+@unittest.skipUnless(importlib.util.find_spec("onnxruntime") and importlib.util.find_spec("onnx"),
+                     "onnxruntime and onnx are needed for the onnx backends")
+class TestOnnxBackend(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.model_path = save_tiny_model(os.path.join(cls.directory.name, "model"), hidden_size=64)
+        cls.expected = TextEmbedder(cls.model_path).generate_embeddings(SENTENCES)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+
+    def assert_parity(self, backend, threshold):
+        onnx_dir = os.path.join(self.directory.name, "onnx")
+        embeddings = TextEmbedder(self.model_path, backend=backend, onnx_dir=onnx_dir).generate_embeddings(SENTENCES)
+        self.assertEqual(embeddings.shape, self.expected.shape)
+        self.assertGreaterEqual(F.cosine_similarity(embeddings, self.expected).min().item(), threshold)
+        return onnx_dir
+
+    def test_onnx_matches_torch(self):
+        onnx_dir = self.assert_parity("onnx", 0.9999)
+        self.assertTrue(os.path.exists(os.path.join(onnx_dir, ONNX_FILE)))
+
+    def test_int8_quantized_is_close_to_torch(self):
+        onnx_dir = self.assert_parity("onnx-int8", 0.99)
+        self.assertTrue(os.path.exists(os.path.join(onnx_dir, QUANTIZED_FILE)))
+
+    def test_existing_export_loads_without_exporting(self):
+        onnx_dir = self.assert_parity("onnx", 0.9999)
+        embedder = TextEmbedder(self.model_path, backend="onnx", onnx_dir=onnx_dir, export_onnx=False)
+        self.assertEqual(embedder.generate_embeddings(SENTENCES).shape, self.expected.shape)
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            TextEmbedder(self.model_path, backend="tensorrt")
+
+
+class TestMissingExport(unittest.TestCase):
+    def test_missing_export_fails_with_the_export_command(self):
+        with tempfile.TemporaryDirectory() as directory:
+            model_path = save_tiny_model(os.path.join(directory, "model"))
+            onnx_dir = os.path.join(directory, "onnx")
+            with self.assertRaisesRegex(FileNotFoundError, "python -m embedder.onnx_backend"):
+                TextEmbedder(model_path, backend="onnx-int8", onnx_dir=onnx_dir, export_onnx=False)
+            self.assertFalse(os.path.exists(onnx_dir))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+import torch
+
+from embedder.encoding import INT8, quantize_int8, vector_data
+from embedder.projection import Projection, fit_pca
+
+
+class TestProjection(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        # Vectors that vary along 4 of their 16 dimensions, around an offset
+        basis = np.linalg.qr(rng.standard_normal((16, 4)))[0].T
+        self.vectors = (rng.standard_normal((200, 4)) @ basis + rng.standard_normal(16)).astype(np.float32)
+
+    def test_pca_keeps_the_similarities_of_low_rank_vectors(self):
+        fitted = fit_pca(self.vectors)
+        self.assertEqual(fitted.shape, (16, 16))
+        # The offset adds one direction to the 4 the vectors vary along
+        projection = Projection(5, fitted)
+        embeddings = torch.from_numpy(self.vectors)
+        projected = projection.apply(embeddings)
+
+        self.assertEqual(tuple(projected.shape), (200, 5))
+        self.assertTrue(torch.allclose(projected.norm(dim=1), torch.ones(200), atol=1e-5))
+        # Nearest neighbours are the same as with the full vectors
+        normalized = torch.nn.functional.normalize(embeddings, dim=1)
+        full = (normalized @ normalized.T).topk(5).indices
+        self.assertTrue(torch.equal((projected @ projected.T).topk(5).indices, full))
+
+    def test_load_keeps_the_first_components(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "projection.npy")
+            np.save(path, fit_pca(self.vectors, 8))
+            projection = Projection.load(path, 3)
+        self.assertEqual(projection.name, "pca-3")
+        self.assertEqual(tuple(projection.apply(torch.from_numpy(self.vectors)).shape), (200, 3))
+
+    def test_truncation_without_a_fitted_projection(self):
+        projected = Projection(2).apply(torch.tensor([[3.0, 4.0, 12.0]]))
+        self.assertTrue(torch.allclose(projected, torch.tensor([[0.6, 0.8]])))
+
+
+class TestInt8(unittest.TestCase):
+    def test_codes_times_scale_approximate_the_vector(self):
+        vector = np.array([0.5, -0.25, 0.01, 0.0], dtype=np.float32)
+        codes, scale = quantize_int8(vector)
+        self.assertEqual(codes.dtype, np.int8)
+        self.assertEqual(codes.tolist(), [127, -64, 3, 0])
+        self.assertTrue(np.allclose(codes * scale, vector, atol=scale / 2))
+        self.assertEqual(quantize_int8(np.zeros(3, dtype=np.float32))[1], 0.0)
+        self.assertEqual(set(vector_data(vector, INT8)), {"vector", "scale"})
+
+
+if __name__ == "__main__":
+    unittest.main()
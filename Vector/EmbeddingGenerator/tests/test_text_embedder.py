@@ -0,0 +1,80 @@
+import tempfile
+import unittest
+
+import torch
+
+from embedder.text_embedder import TextEmbedder, estimate_memory_bytes, length_buckets, pool_windows
+from tests.tiny_model import save_tiny_model
+
+
+class TestLengthBuckets(unittest.TestCase):
+    def test_inputs_are_grouped_by_length_within_the_token_budget(self):
+        lengths = [100, 5, 6, 90, 7]
+        self.assertEqual(length_buckets(lengths, max_batch_tokens=200), [[1, 2, 4], [3, 0]])
+        self.assertEqual(length_buckets(lengths, max_batch_tokens=20), [[1, 2], [4], [3], [0]])
+
+    def test_batch_size_limit(self):
+        self.assertEqual(length_buckets([1, 1, 1], max_batch_tokens=100, max_batch_size=2), [[0, 1], [2]])
+
+    def test_no_budget_keeps_one_batch(self):
+        self.assertEqual(length_buckets([3, 1, 2], max_batch_tokens=0), [[1, 2, 0]])
+        self.assertEqual(length_buckets([], max_batch_tokens=0), [])
+
+
+class TestTextEmbedder(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.embedder = TextEmbedder(save_tiny_model(cls.directory.name), max_batch_tokens=64)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+
+    def test_bucketed_embeddings_match_one_padded_batch_in_input_order(self):
+        sentences = ["the search index " * 20, "a document", "vector", "the long text of a record " * 5]
+        bucketed = self.embedder.generate_embeddings(sentences)
+
+        encoded_input = self.embedder.tokenizer(sentences, padding=True, truncation=True, return_tensors="pt")
+        expected = self.embedder._embed_batch(encoded_input)
+
+        self.assertEqual(tuple(bucketed.shape), (4, 32))
+        self.assertTrue(torch.allclose(bucketed, expected, atol=1e-5))
+        self.assertTrue(torch.allclose(bucketed.norm(dim=1), torch.ones(4), atol=1e-5))
+
+    def test_weight_file_size_estimates_the_model_memory(self):
+        estimated = estimate_memory_bytes(self.directory.name)
+        self.assertAlmostEqual(estimated / self.embedder.memory_bytes(), 1, delta=0.05)
+        self.assertIsNone(estimate_memory_bytes(self.directory.name, backend="onnx"))
+        self.assertIsNone(estimate_memory_bytes(self.directory.name + "/missing"))
+
+    def test_long_texts_are_split_into_overlapping_windows(self):
+        words = "the a of and to in is it that this for on with as was at by an be from".split()
+        long_text = " ".join(words[i % len(words)] + " " + words[(i * 7) % len(words)] for i in range(150))
+        window_embeddings, spans = self.embedder.generate_window_embeddings(
+            ["a document", long_text], window_tokens=64, overlap_tokens=16)
+
+        self.assertEqual(spans[0], [(0, 10, 2)])
+        self.assertTrue(torch.allclose(window_embeddings[0], self.embedder.generate_embeddings(["a document"])[0],
+                                       atol=1e-5))
+        long_spans = spans[1]
+        self.assertEqual(len(window_embeddings), 1 + len(long_spans))
+        self.assertEqual(sum(tokens for _, _, tokens in long_spans) - 16 * (len(long_spans) - 1), 300)
+        self.assertEqual((long_spans[0][0], long_spans[-1][1]), (0, len(long_text)))
+        for (_, previous_end, _), (start, _, _) in zip(long_spans, long_spans[1:]):
+            self.assertLess(start, previous_end)
+
+        pooled = self.embedder.generate_long_embeddings(["a document", long_text], "weighted", 64, 16)
+        self.assertTrue(torch.allclose(pooled, pool_windows(window_embeddings, spans, "weighted"), atol=1e-5))
+        self.assertTrue(torch.allclose(pooled.norm(dim=1), torch.ones(2), atol=1e-5))
+
+    def test_weighted_pooling_favours_long_windows(self):
+        windows = torch.tensor([[1.0, 0.0], [0.0, 1.0]])
+        mean = pool_windows(windows, [[(0, 10, 10), (5, 6, 1)]], "mean")
+        weighted = pool_windows(windows, [[(0, 10, 10), (5, 6, 1)]], "weighted")
+        self.assertAlmostEqual(mean[0, 0].item(), mean[0, 1].item(), places=5)
+        self.assertGreater(weighted[0, 0].item(), 0.99)
+
+
+if __name__ == "__main__":
+    unittest.main()
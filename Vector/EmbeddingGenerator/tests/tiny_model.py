@@ -0,0 +1,25 @@
+"""A small randomly initialised BERT model saved like a hub model, so the
+embedder can be tested without downloading all-MiniLM-L6-v2."""
+import os
+
+from transformers import BertConfig, BertModel, BertTokenizerFast
+
+SPECIAL_TOKENS = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"]
+WORDS = ("the a of and to in is it that this for on with as was at by an be from document search index "
+         "vector text record skill azure model query long short word token embedding chunk").split()
+
+
+def save_tiny_model(directory, hidden_size=32, layers=2, heads=4, max_position_embeddings=128, seed=0):
+    import torch
+
+    os.makedirs(directory, exist_ok=True)
+    vocab_file = os.path.join(directory, "vocab.txt")
+    with open(vocab_file, "w", encoding="utf-8") as file:
+        file.write("\n".join(SPECIAL_TOKENS + WORDS + [chr(c) for c in range(ord("a"), ord("z") + 1)]) + "\n")
+    BertTokenizerFast(vocab_file=vocab_file, model_max_length=max_position_embeddings).save_pretrained(directory)
+    torch.manual_seed(seed)
+    config = BertConfig(vocab_size=len(SPECIAL_TOKENS) + len(WORDS) + 26, hidden_size=hidden_size,
+                        num_hidden_layers=layers, num_attention_heads=heads, intermediate_size=hidden_size * 4,
+                        max_position_embeddings=max_position_embeddings)
+    BertModel(config).save_pretrained(directory)
+    return directory
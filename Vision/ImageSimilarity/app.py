@@ -26,7 +26,7 @@ API_KEY = os.environ['KEY']
 API_KEY_NAME = "Ocp-Apim-Subscription-Key"
 
 api_key_header = APIKeyHeader(name=API_KEY_NAME, auto_error=False)
-similarity_models = models.Models(all_image_features=None, resnet_model=None)
+similarity_models = models.Models(feature_store=None, resnet_model=None)
 
 
 @app.on_event("startup")
@@ -54,7 +54,7 @@ def extract(values: Values, api_key: APIKey = Depends(get_api_key)):
         return 'Expected text within body of request. No text found.', status.HTTP_400_BAD_REQUEST
     else:
         return extractor.go_extract(body, resnet_model=similarity_models.resnet_model,
-                                    all_image_features=similarity_models.all_image_features,
+                                    feature_store=similarity_models.feature_store,
                                     topn=int(os.environ['TOPN']))
 
 
@@ -0,0 +1,79 @@
+"""Query time of the top-n similarity search for growing catalogs.
+
+Compares the original search, one scipy cdist call per catalog image
+followed by heapq.nsmallest, with the FeatureStore matrix-vector product
+and argpartition, on random feature vectors shaped like the ResNet50
+predictions in the features file. The baseline is only run up to
+--baseline-max images, as it takes seconds per query on large catalogs,
+and the top-n of both searches are compared where both run.
+
+Run from the skill folder:
+
+    python -m benchmarks.bench_similarity
+    python -m benchmarks.bench_similarity --sizes 10000 100000 1000000 --dimensions 1000 --queries 20
+"""
+import argparse
+import time
+from heapq import nsmallest
+
+import numpy as np
+
+from powerskill.similarity import FeatureStore
+
+
+def random_features(count, dimensions, rng, chunk_size=65536):
+    features = np.empty((count, dimensions), dtype=np.float32)
+    for start in range(0, count, chunk_size):
+        features[start:start + chunk_size] = rng.random((min(chunk_size, count - start), dimensions), dtype=np.float32)
+    return features
+
+
+def loop_most_similar(image_vector, all_image_features, topn):
+    from scipy.spatial import distance
+
+    scores = {key: distance.cdist(image_vector.reshape(1, -1), vector.reshape(1, -1), metric="cosine")[0][0]
+              for key, vector in all_image_features.items()}
+    return nsmallest(topn, scores, key=scores.get)
+
+
+def time_queries(search, queries):
+    started = time.perf_counter()
+    results = [search(query) for query in queries]
+    return (time.perf_counter() - started) / len(queries), results
+
+
+def main(args):
+    rng = np.random.default_rng(0)
+    queries = rng.random((args.queries, args.dimensions), dtype=np.float32)
+    print(f"{'images':>9} {'load (s)':>9} {'matrix (ms)':>12} {'loop (ms)':>10} {'speedup':>8} {'same top-n':>11}")
+    for size in args.sizes:
+        keys = np.array([f"image{index}.jpg" for index in range(size)])
+        features = random_features(size, args.dimensions, rng)
+        # The loop reads the raw vectors, so they are kept before the store normalises its copy
+        all_image_features = dict(zip(keys, features.copy())) if size <= args.baseline_max else None
+
+        started = time.perf_counter()
+        store = FeatureStore(keys, features)
+        load = time.perf_counter() - started
+        matrix_time, matrix_results = time_queries(lambda query: store.most_similar(query, args.topn), queries)
+
+        loop_cell = speedup_cell = same_cell = "-"
+        if all_image_features is not None:
+            loop_queries = queries[:args.baseline_queries]
+            loop_time, loop_results = time_queries(
+                lambda query: loop_most_similar(query, all_image_features, args.topn), loop_queries)
+            same = np.mean([list(a) == list(b) for a, b in zip(matrix_results, loop_results)])
+            loop_cell, speedup_cell, same_cell = f"{loop_time * 1000:.1f}", f"{loop_time / matrix_time:.0f}x", f"{same:.0%}"
+        print(f"{size:>9} {load:>9.2f} {matrix_time * 1000:>12.2f} {loop_cell:>10} {speedup_cell:>8} {same_cell:>11}")
+        del features, store, all_image_features
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--dimensions', type=int, default=1000, help='ResNet50 predictions have 1000')
+    parser.add_argument('--topn', type=int, default=3)
+    parser.add_argument('--queries', type=int, default=20)
+    parser.add_argument('--baseline-queries', type=int, default=3)
+    parser.add_argument('--baseline-max', type=int, default=100000, help='largest catalog the loop is run on')
+    main(parser.parse_args())
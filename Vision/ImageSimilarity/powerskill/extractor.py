@@ -2,7 +2,6 @@ import base64
 import io
 import logging
 import os
-from heapq import nsmallest
 
 import numpy as np
 from PIL import Image
@@ -12,29 +11,24 @@ from tensorflow.keras.models import Model
 from tensorflow.keras.preprocessing import image
 from objdict import ObjDict
 from powerskill.timer import timefunc
-from scipy.spatial import distance
 
 load_dotenv()
 
 
-def find_most_similar(image_vectors, all_image_features):
+def find_most_similar(image_vectors, feature_store, topn):
     """
 
     Parameters
     ----------
     image_vectors: Vectors of our input image
-    all_image_features: All vectorised images
+    feature_store: The FeatureStore of all vectorised images
+    topn: The number of images to return
 
-    Returns: The cosine similarity score per comparison
+    Returns: The topn most similar images by cosine similarity, most similar first
     -------
 
     """
-    scorescos = {}
-    for key, vector in all_image_features.items():
-        scorecos = findDifference(image_vectors, vector)
-        scorescos[key] = scorecos  # cosine similarity
-
-    return scorescos
+    return feature_store.most_similar(image_vectors, topn)
 
 
 def predict(img64: str, model: Model):
@@ -59,25 +53,6 @@ def predict(img64: str, model: Model):
     return model.predict(x)
 
 
-def findDifference(image_vector1, image_vector2):
-    """
-
-    Parameters
-    ----------
-    image_vector1: Our source image vector
-    image_vector2: The target image vector
-
-    Returns: Cosine distance score
-    -------
-
-    """
-    dist = distance.cdist(
-        image_vector1.reshape(1, -1),
-        image_vector2.reshape(1, -1),
-        metric="cosine")
-    return dist[0][0]
-
-
 def extract_image_features(resnet_model, image64):
     """
 
@@ -131,7 +106,7 @@ def build_output_response(inputs, outputs, topncos, error=None):
 
 
 @timefunc
-def go_extract(inputs, all_image_features, resnet_model, topn):
+def go_extract(inputs, feature_store, resnet_model, topn):
     """
     :param args:
     :return:
@@ -148,9 +123,7 @@ def go_extract(inputs, all_image_features, resnet_model, topn):
         img = base64.b64decode(str(encoded_image).strip())
         logging.info((f"Base64Encoded string {img[:100]}"))
         image_vectors = extract_image_features(resnet_model, img)
-        compared_vectorscos = find_most_similar(image_vectors, all_image_features)
-
-        topncos = nsmallest(topn, compared_vectorscos, key=compared_vectorscos.get)
+        topncos = find_most_similar(image_vectors, feature_store, topn)
 
     except Exception as ProcessingError:
         logging.exception(ProcessingError)
@@ -3,16 +3,19 @@ import os
 import joblib
 from tensorflow.keras.applications.resnet50 import ResNet50
 
+from powerskill.similarity import FeatureStore
+
 
 class Models:
 
-    def __init__(self, all_image_features, resnet_model):
-        self.all_image_features = all_image_features
+    def __init__(self, feature_store, resnet_model):
+        self.feature_store = feature_store
         self.resnet_model = resnet_model
 
     def load_image_features(self, image_features_file):
         all_image_features = joblib.load(os.path.join("models", image_features_file))
-        self.all_image_features = all_image_features
+        # Preloaded as one normalised matrix, so a query is a single matrix-vector product
+        self.feature_store = FeatureStore.from_dict(all_image_features)
 
     def load_resnet_model(self):
         resnet_model = ResNet50(weights='imagenet')
@@ -0,0 +1,74 @@
+import numpy as np
+
+
+class FeatureStore:
+    """
+    The features of all catalog images as one matrix, for vectorised similarity search.
+
+    Each row is the L2-normalised float32 feature vector of an image and keys holds the
+    image names in the same order, so the cosine similarity to every image is a single
+    matrix-vector product. A contiguous float32 features array is normalised in place.
+    """
+
+    def __init__(self, keys, features):
+        self.keys = np.asarray(keys)
+        self.features = np.ascontiguousarray(features, dtype=np.float32)
+        normalise_rows(self.features)
+
+    @classmethod
+    def from_dict(cls, all_image_features):
+        """
+
+        Parameters
+        ----------
+        all_image_features: The feature vector of every image, keyed on the image name
+
+        Returns: A FeatureStore of the images
+        -------
+
+        """
+        keys = list(all_image_features.keys())
+        features = np.empty((len(keys), np.size(all_image_features[keys[0]]) if keys else 0), dtype=np.float32)
+        for row, key in enumerate(keys):
+            features[row] = np.ravel(all_image_features[key])
+        return cls(keys, features)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def most_similar(self, image_vector, topn):
+        """
+
+        Parameters
+        ----------
+        image_vector: Feature vector of our input image
+        topn: The number of images to return
+
+        Returns: The keys of the topn most similar images, most similar first
+        -------
+
+        """
+        topn = min(topn, len(self.keys))
+        if topn <= 0:
+            return []
+        query = np.ravel(image_vector).astype(np.float32)
+        norm = np.linalg.norm(query)
+        if norm > 0:
+            query /= norm
+        # Cosine similarity to every image, as the rows are normalised
+        scores = self.features @ query
+        # Only the topn best are selected, then sorted
+        top = np.argpartition(-scores, topn - 1)[:topn]
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return self.keys[top].tolist()
+
+
+def normalise_rows(features, chunk_size=65536):
+    """
+    L2-normalise the rows of features in place, in chunks so no copy of the whole matrix is made.
+    """
+    for start in range(0, len(features), chunk_size):
+        chunk = features[start:start + chunk_size]
+        norms = np.sqrt(np.einsum('ij,ij->i', chunk, chunk))
+        norms[norms == 0] = 1
+        chunk /= norms[:, None]